@@ -1,4 +1,8 @@
 import json
+import time
+import logging
+import threading
+import traceback
 import requests
 from web3 import Web3
 
@@ -12,6 +16,11 @@ BASE_TOKEN_ADDRESS = ''
 PERPETUAL_POOL_ADDRESS = ''
 ORACLE_URL = 'https://oracle.deri.finance/price/?symbol=BTCUSD'
 
+# seconds between background refreshes of the oracle signature, see start_prefetch
+ORACLE_PREFETCH_INTERVAL = 5
+# seconds left on a signature's validity for it to still be used, so it is not expired when the transaction is mined
+ORACLE_MARGIN = 15
+
 web3 = Web3(Web3.HTTPProvider(PROVIDER_URL))
 session = requests.session()
 
@@ -26,10 +35,21 @@ def get_contract(address, contract_name):
     return web3.eth.contract(address=address, abi=get_abi(contract_name))
 
 
+# gas used by the last successful transaction of each contract function and argument shape, estimated only the first time
+GAS_USED = {}
+
+
+# which arguments are negative, only a trade volume can be, so buys and sells keep separate gas
+def get_arg_shape(params):
+    return tuple(isinstance(param, int) and param < 0 for param in params)
+
+
 def transact(contract, function_name, params=()):
+    function = contract.functions[function_name](*params)
     nonce = web3.eth.getTransactionCount(ACCOUNT_ADDRESS)
-    gas = contract.functions[function_name](*params).estimateGas({'from': ACCOUNT_ADDRESS})
-    tx = contract.functions[function_name](*params).buildTransaction({
+    key = (contract.address, function_name, get_arg_shape(params))
+    gas = GAS_USED[key] if key in GAS_USED else function.estimateGas({'from': ACCOUNT_ADDRESS})
+    tx = function.buildTransaction({
         'nonce': nonce,
         'from': ACCOUNT_ADDRESS,
         'gas': int(gas * 1.2)
@@ -37,10 +57,14 @@ def transact(contract, function_name, params=()):
     signed_tx = web3.eth.ACCOUNT_ADDRESS.signTransaction(tx, ACCOUNT_PRIVATE)
     tx_hash = web3.eth.sendRawTransaction(signed_tx.rawTransaction)
     receipt = web3.eth.waitForTransactionReceipt(tx_hash)
+    if receipt.status == 0 and receipt.gasUsed >= tx['gas']:
+        GAS_USED.pop(key, None)
+    elif receipt.status == 1:
+        GAS_USED[key] = max(GAS_USED.get(key, 0), receipt.gasUsed)
     return receipt
 
 
-def get_signature():
+def fetch_signature():
     data = session.get(ORACLE_URL)
     data = data.json()
     return (
@@ -52,6 +76,48 @@ def get_signature():
     )
 
 
+# freshest signature fetched, the pool accepts it until timestamp + priceDelayAllowance
+SIGNATURE = {'signature': None, 'allowance': None}
+SIGNATURE_LOCK = threading.Lock()
+
+
+def get_price_delay_allowance():
+    if SIGNATURE['allowance'] is None:
+        contract = get_contract(PERPETUAL_POOL_ADDRESS, 'PerpetualPool')
+        SIGNATURE['allowance'] = contract.functions.getParameters().call()[-1]
+    return SIGNATURE['allowance']
+
+
+def refresh_signature():
+    signature = fetch_signature()
+    with SIGNATURE_LOCK:
+        if SIGNATURE['signature'] is None or signature[0] > SIGNATURE['signature'][0]:
+            SIGNATURE['signature'] = signature
+    return signature
+
+
+# the prefetched signature if it is still valid for ORACLE_MARGIN seconds, otherwise a new one
+def get_signature():
+    signature = SIGNATURE['signature']
+    if signature is not None and signature[0] + get_price_delay_allowance() - ORACLE_MARGIN > time.time():
+        return signature
+    return refresh_signature()
+
+
+# keeps a signature prefetched in the background so actions do not wait on the oracle server,
+# a failed fetch is logged and retried after interval, get_signature fetches itself meanwhile
+def start_prefetch(interval=ORACLE_PREFETCH_INTERVAL):
+    def run():
+        while True:
+            try:
+                refresh_signature()
+            except Exception:
+                logging.error(f'(Oracle) prefetch error: {traceback.format_exc()}')
+            time.sleep(interval)
+    get_price_delay_allowance()
+    threading.Thread(target=run, daemon=True).start()
+
+
 # approve pool for spending your base token
 def approve():
     contract = get_contract(BASE_TOKEN_ADDRESS, 'ERC20')
@@ -70,6 +70,10 @@ class ArbitraguerV2:
         }
 
 
+    def get_watch_addresses(self):
+        return [self.defiPoolAddress]
+
+
     def update_cefi_position(self):
         self.cefi_position = self.rest.get_position(symbol=self.cefiSymbol)
 
@@ -121,9 +125,9 @@ class ArbitraguerV2:
             logging.info(f'       CefiVolume: {cefi_volume} => {self.cefi_position["volume"]}')
 
 
-    def check(self):
+    def check(self, update=True):
         logging.info(f'====> Check {self.defiSymbolId}.{self.cefiSymbol}')
-        self.update_defi_symbol_state()
+        if update: self.update_defi_symbol_state()
         self.check_defi_position()
         self.check_cefi_position()
 
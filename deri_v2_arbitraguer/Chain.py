@@ -1,21 +1,42 @@
 import time
 import json
 import random
+import threading
+import requests
 from web3 import Web3
 from web3.middleware import geth_poa_middleware, local_filter_middleware
 from Preference import *
 
 
 ABIS = {}
+WEB3S = {}
+CONTRACTS = {}
+LOCK = threading.Lock()
 
 
-def getWeb3(network):
-    web3 = Web3(Web3.HTTPProvider(random.choice(RPCS[network])))
-    if 'bsc' in network or 'heco' in network:
-        web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-        web3.middleware_onion.add(local_filter_middleware)
-    web3.network = network
-    return web3
+def getSession():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def getWeb3(network, rpc=None):
+    if rpc is None: rpc = random.choice(RPCS[network])
+    if rpc in WEB3S: return WEB3S[rpc]
+    with LOCK:
+        if rpc not in WEB3S:
+            session = getSession()
+            web3 = Web3(Web3.HTTPProvider(rpc, request_kwargs={'timeout': RPC_TIMEOUT}, session=session))
+            if 'bsc' in network or 'heco' in network:
+                web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+                web3.middleware_onion.add(local_filter_middleware)
+            web3.network = network
+            web3.rpc = rpc
+            web3.session = session
+            WEB3S[rpc] = web3
+    return WEB3S[rpc]
 
 
 def getAbi(abiName):
@@ -29,7 +50,10 @@ def getAbi(abiName):
 
 def getContract(network, address, abiName):
     web3 = getWeb3(network)
+    key = (network, address, abiName, web3.rpc)
+    if key in CONTRACTS: return CONTRACTS[key]
     contract = web3.eth.contract(address=address, abi=getAbi(abiName))
+    CONTRACTS[key] = contract
     return contract
 
 
@@ -39,6 +63,18 @@ def call(network, address, abiName, functionName, params=None):
     return contract.functions[functionName](*params).call()
 
 
+def getBlockNumber(network):
+    return getWeb3(network).eth.blockNumber
+
+
+def getLogs(network, addresses, fromBlock, toBlock):
+    return getWeb3(network).eth.getLogs({
+        'address': list(addresses),
+        'fromBlock': fromBlock,
+        'toBlock': toBlock
+    })
+
+
 def transact(network, address, abiName, functionName, params, account, private):
     contract = getContract(network, address, abiName)
     tx = contract.functions[functionName](*params).buildTransaction({
@@ -2,28 +2,42 @@ import time
 import traceback
 from Preference import *
 from ArbitraguerV2 import ArbitraguerV2
+from Watcher import Watcher
 
 
 if __name__ == '__main__':
 
     arbitraguers = [ArbitraguerV2(details) for details in ARBITRAGUERS_V2]
 
+    watcher = Watcher(arbitraguers) if CHECK_MODE == 'event' else None
+
+    last = 0
     while True:
 
         try:
-            defi_dynamic_equity = Decimal(0)
-            cefi_dynamic_equity = Decimal(0)
+            if time.time() - last >= CHECK_INTERVAL:
+                last = time.time()
+
+                defi_dynamic_equity = Decimal(0)
+                cefi_dynamic_equity = Decimal(0)
+
+                for arbitraguer in arbitraguers:
+                    arbitraguer.check()
+                    defi_dynamic_equity += arbitraguer.get_defi_pnl()
 
-            for arbitraguer in arbitraguers:
-                arbitraguer.check()
-                defi_dynamic_equity += arbitraguer.get_defi_pnl()
+                defi_dynamic_equity += arbitraguers[0].defi_margin
+                cefi_dynamic_equity = arbitraguers[0].get_cefi_dynamic_equity()
 
-            defi_dynamic_equity += arbitraguers[0].defi_margin
-            cefi_dynamic_equity = arbitraguers[0].get_cefi_dynamic_equity()
+                logging.info(f'====> Dynamic equity: Defi: {defi_dynamic_equity:.3f}, Cefi: {cefi_dynamic_equity:.3f}, Total: {defi_dynamic_equity + cefi_dynamic_equity:.3f}')
 
-            logging.info(f'====> Dynamic equity: Defi: {defi_dynamic_equity:.3f}, Cefi: {cefi_dynamic_equity:.3f}, Total: {defi_dynamic_equity + cefi_dynamic_equity:.3f}')
+            elif watcher is not None:
+                for arbitraguer in watcher.poll():
+                    arbitraguer.check(update=False)
 
         except Exception as e:
             logging.error(f'Arbitraguer error: {traceback.format_exc()}')
 
-        time.sleep(60)
+        if watcher is not None:
+            time.sleep(WATCH_INTERVAL)
+        else:
+            time.sleep(max(CHECK_INTERVAL - (time.time() - last), 0))
@@ -25,6 +25,14 @@ RPCS = {
     ]
 }
 
+RPC_TIMEOUT = 10
+RPC_POOL_SIZE = 16
+
+CHECK_INTERVAL = 60
+CHECK_MODE = 'poll'
+WATCH_INTERVAL = 3
+WATCH_MAX_BLOCKS = 5000
+
 ARBITRAGUERS_V2 = [
     {
         'defiNetwork': '',
@@ -0,0 +1,45 @@
+import logging
+from Preference import *
+import Chain
+
+
+class Watcher:
+
+    def __init__(self, arbitraguers, maxBlocks=WATCH_MAX_BLOCKS):
+        self.arbitraguers = arbitraguers
+        self.maxBlocks = maxBlocks
+        self.cursors = {}
+
+
+    # scans the logs of the watched pools since the last poll with a block cursor,
+    # returns the arbitraguers whose pool net volume changed, with their defi state already refreshed
+    def poll(self):
+        networks = {}
+        for arbitraguer in self.arbitraguers:
+            networks.setdefault(arbitraguer.defiNetwork, []).append(arbitraguer)
+
+        changed = []
+        for network, group in networks.items():
+            block = Chain.getBlockNumber(network)
+            cursor = self.cursors.get(network)
+            if cursor is None or block <= cursor:
+                self.cursors.setdefault(network, block)
+                continue
+
+            if block - cursor > self.maxBlocks:
+                logging.info(f'(Watcher) {network} cursor {cursor} lags head {block}, rechecking all pools')
+                candidates = group
+            else:
+                addresses = {address for arbitraguer in group for address in arbitraguer.get_watch_addresses()}
+                touched = {log['address'] for log in Chain.getLogs(network, addresses, cursor + 1, block)}
+                candidates = [arbitraguer for arbitraguer in group if touched & set(arbitraguer.get_watch_addresses())]
+            self.cursors[network] = block
+
+            if candidates:
+                for arbitraguer in candidates:
+                    volume = arbitraguer.defi_symbol_state['tradersNetVolume']
+                    arbitraguer.update_defi_symbol_state()
+                    if arbitraguer.defi_symbol_state['tradersNetVolume'] != volume:
+                        logging.info(f'(Watcher) {arbitraguer.defiSymbolId} PoolNetVolume: {volume} => {arbitraguer.defi_symbol_state["tradersNetVolume"]} at block {block}')
+                        changed.append(arbitraguer)
+        return changed
@@ -0,0 +1,110 @@
+import time
+import threading
+from decimal import Decimal
+import RestBinance
+
+
+ACCOUNTS = {}
+LOCK = threading.Lock()
+
+
+# arbitraguers trading on the same binance account share one snapshot
+def getAccount(url, key, secret, ttl=10):
+    with LOCK:
+        if (url, key) not in ACCOUNTS:
+            ACCOUNTS[(url, key)] = Account(RestBinance.Rest(url, key, secret), ttl)
+        return ACCOUNTS[(url, key)]
+
+
+# one position per symbol, the BOTH side in one-way mode, the LONG and SHORT sides netted in hedge mode,
+# priced so that volume * (mark - price) is the unrealized pnl of all sides
+def get_net_position(symbol, sides):
+    volume = sum((volume for volume, _ in sides.values()), Decimal(0))
+    legs = [(volume, price) for volume, price in sides.values() if volume != 0]
+    if len(legs) == 1:
+        price = legs[0][1]
+    elif volume != 0:
+        price = sum(volume * price for volume, price in legs) / volume
+    else:
+        price = Decimal(0)
+    return {'symbol': symbol, 'volume': volume, 'price': price}
+
+
+class Account:
+
+    def __init__(self, rest, ttl=10):
+        self.rest = rest
+        self.ttl = ttl
+
+        self.name = 'Account.Binance'
+        self.lock = threading.Lock()
+        self.timestamp = 0
+        self.balances = {}
+        self.wallets = {}
+        self.positions = {}
+        self.sides = {}
+        self.stream = None
+        self.live = False
+
+
+    # all balances and positions come from one /fapi/v2/account request
+    def refresh(self):
+        data = self.rest.get_account()
+        if data is None:
+            raise ValueError(f'({self.name}) account snapshot unavailable')
+        balances = {item['asset']: Decimal(item['walletBalance']) + Decimal(item['crossUnPnl']) for item in data['assets']}
+        wallets = {item['asset']: Decimal(item['walletBalance']) for item in data['assets']}
+        sides = {}
+        for item in data['positions']:
+            sides.setdefault(item['symbol'], {})[item['positionSide']] = (Decimal(item['positionAmt']), Decimal(item['entryPrice']))
+        self.balances = balances
+        self.wallets = wallets
+        self.sides = sides
+        self.positions = {symbol: get_net_position(symbol, items) for symbol, items in sides.items()}
+        self.timestamp = time.time()
+
+
+    # positions and wallet balances pushed by the user data stream, balances keep their rest snapshot for crossUnPnl,
+    # an update carries only the sides that changed
+    def apply_account_update(self, data):
+        with self.lock:
+            for item in data.get('B', []):
+                self.wallets[item['a']] = Decimal(item['wb'])
+            for item in data['P']:
+                sides = self.sides.setdefault(item['s'], {})
+                sides[item['ps']] = (Decimal(item['pa']), Decimal(item['ep']))
+                self.positions[item['s']] = get_net_position(item['s'], sides)
+
+
+    def invalidate(self):
+        self.timestamp = 0
+
+
+    # with a live stream positions never expire, balances still follow the ttl
+    def _snapshot(self, streamed=False):
+        with self.lock:
+            if streamed and self.live and self.timestamp:
+                return
+            if time.time() - self.timestamp >= self.ttl:
+                self.refresh()
+
+
+    def get_balance(self, currency='USDT'):
+        self._snapshot()
+        return self.balances.get(currency)
+
+
+    # a symbol the account never traded is left out of /fapi/v2/account, it has no position
+    def get_position(self, symbol='BTCUSDT'):
+        self._snapshot(streamed=True)
+        position = self.positions.get(symbol)
+        return position if position is not None else get_net_position(symbol, {})
+
+
+    # orders carry no positionSide, so trading needs the account in one-way mode, hedge mode positions are only read
+    def place_order(self, symbol, side, amount, order_type, price=None):
+        data = self.rest.place_order(symbol, side, amount, order_type, price)
+        if self.live and data is not None and self.stream.wait_order(data['orderId']):
+            return data
+        self.invalidate()
+        return data
@@ -3,10 +3,16 @@ import logging
 import requests
 import traceback
 from web3 import Web3
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from Preference import *
 import Chain
-import RestBinance
+import Hedge
+import State
+import AccountBinance
+import StreamBinance
+import Recorder
+import Metrics
+import Oracle
 
 
 class ArbitraguerV3:
@@ -17,8 +23,9 @@ class ArbitraguerV3:
         self.defiAccount = details['defiAccount']
         self.defiPrivate = details['defiPrivate']
         self.defiSymbol = details['defiSymbol']
-        self.defiMinVolume = details['defiMinVolume']
-        self.defiMaxVolume = details['defiMaxVolume']
+        self.defiMinVolume = State.to_int(details['defiMinVolume'])
+        self.defiMaxVolume = State.to_int(details['defiMaxVolume'])
+        self.defiOracleSymbols = details.get('defiOracleSymbols', [])
 
         self.symbolManagerAddress = Chain.call(self.defiNetwork, self.defiPoolAddress, 'PoolImplementation', 'symbolManager', [])
         self.symbolAddress = Chain.call(
@@ -32,109 +39,220 @@ class ArbitraguerV3:
         self.cefiKey = details['cefiKey']
         self.cefiSecret = details['cefiSecret']
         self.cefiSymbol = details['cefiSymbol']
-        self.cefiMiltiplier = details['cefiMiltiplier']
-        self.cefiMinVolume = details['cefiMinVolume']
+        self.cefiMiltiplier = State.to_int(details['cefiMiltiplier'])
+        self.cefiMinVolume = State.to_int(details['cefiMinVolume'])
 
         if self.cefiExchange == 'Binance':
-            self.rest = RestBinance.Rest(self.cefiUrl, self.cefiKey, self.cefiSecret)
+            self.account = AccountBinance.getAccount(self.cefiUrl, self.cefiKey, self.cefiSecret, ACCOUNT_TTL)
+            if details.get('cefiStreamUrl'):
+                StreamBinance.startStream(self.account, details['cefiStreamUrl'])
         else:
             raise ValueError(f'Unsopported cefi exchange: {self.cefiExchange}')
 
-        self.update_defi_symbol_state()
-        self.update_defi_margin()
-        self.update_defi_position()
+        self.pair = f'{self.defiSymbol}.{self.cefiSymbol}'
+        self.recorder = Recorder.getRecorder(DIR_RECORDS) if RECORD else None
+        self.equity = None
+
+        if self.defiOracleSymbols:
+            Oracle.register(self.defiOracleSymbols)
+
+        self.defi_symbol_state = State.SymbolState()
+        self.defi_position = State.Position()
+        self.defi_margin = 0
+        self.vault = None
+        self.defi_pending = None
+        self.update_defi_state()
         self.update_cefi_position()
 
 
+    def get_defi_symbol_state_calls(self):
+        return [
+            (self.symbolAddress, 'SymbolImplementationFutures', 'indexPrice', []),
+            (self.symbolAddress, 'SymbolImplementationFutures', 'cumulativeFundingPerVolume', []),
+            (self.symbolAddress, 'SymbolImplementationFutures', 'netVolume', []),
+            (self.symbolAddress, 'SymbolImplementationFutures', 'netCost', [])
+        ]
+
+
+    # state is kept as the raw 18-decimal integers read from the pool, see State
+    def set_defi_symbol_state(self, price, cumulativeFundingPerVolume, netVolume, netCost):
+        self.defi_symbol_state.set(price, cumulativeFundingPerVolume, netVolume, netCost)
+
+
+    def set_defi_margin(self, amountB0, vaultLiquidity):
+        self.defi_margin = vaultLiquidity + amountB0
+
+
+    def set_defi_position(self, volume, cost, lastCumulativeFundingPerVolume):
+        self.defi_position.set(volume, cost, lastCumulativeFundingPerVolume)
+
+
     def update_defi_symbol_state(self):
-        price = Chain.call(self.defiNetwork, self.symbolAddress, 'SymbolImplementationFutures', 'indexPrice', [])
-        cumulativeFundingPerVolume = Chain.call(self.defiNetwork, self.symbolAddress, 'SymbolImplementationFutures', 'cumulativeFundingPerVolume', [])
-        netVolume = Chain.call(self.defiNetwork, self.symbolAddress, 'SymbolImplementationFutures', 'netVolume', [])
-        netCost = Chain.call(self.defiNetwork, self.symbolAddress, 'SymbolImplementationFutures', 'netCost', [])
-        self.defi_symbol_state = {
-            'price': Decimal(price) / ONE,
-            'cumulativeFundingPerVolume': Decimal(cumulativeFundingPerVolume) / ONE,
-            'netVolume': Decimal(netVolume) / ONE,
-            'netCost': Decimal(netCost) / ONE
-        }
+        self.set_defi_symbol_state(*Chain.batchCall(self.defiNetwork, self.get_defi_symbol_state_calls()))
 
 
     def update_defi_margin(self):
         vault, amountB0 = Chain.call(self.defiNetwork, self.defiPoolAddress, 'PoolImplementation', 'tdInfos', [self.pTokenId])
         vaultLiquidity = Chain.call(self.defiNetwork, vault, 'VaultImplementation', 'getVaultLiquidity', [])
-        self.defi_margin = (Decimal(vaultLiquidity) + Decimal(amountB0)) / ONE
+        self.vault = vault
+        self.set_defi_margin(amountB0, vaultLiquidity)
 
 
     def update_defi_position(self):
-        volume, cost, lastCumulativeFundingPerVolume = Chain.call(
+        self.set_defi_position(*Chain.call(
             self.defiNetwork, self.symbolAddress, 'SymbolImplementationFutures', 'positions', [self.pTokenId]
-        )
-        self.defi_position = {
-            'volume': Decimal(volume) / ONE,
-            'cost': Decimal(cost) / ONE,
-            'lastCumulativeFundingPerVolume': Decimal(lastCumulativeFundingPerVolume) / ONE
-        }
+        ))
+
+
+    # symbol state, position and margin in one batch, the vault address is only known after the first tdInfos
+    def get_defi_state_calls(self):
+        calls = self.get_defi_symbol_state_calls() + [
+            (self.symbolAddress, 'SymbolImplementationFutures', 'positions', [self.pTokenId]),
+            (self.defiPoolAddress, 'PoolImplementation', 'tdInfos', [self.pTokenId])
+        ]
+        if self.vault is not None:
+            calls.append((self.vault, 'VaultImplementation', 'getVaultLiquidity', []))
+        return calls
+
+
+    def set_defi_state(self, results):
+        self.set_defi_symbol_state(*results[:4])
+        self.set_defi_position(*results[4])
+        if self.recorder is not None:
+            self.recorder.record('defi_symbol_state', self.pair, self.defi_symbol_state.values())
+            self.recorder.record('defi_position', self.pair, self.defi_position.values())
+        vault, amountB0 = results[5]
+        if vault != self.vault:
+            self.vault = vault
+            vaultLiquidity = Chain.call(self.defiNetwork, vault, 'VaultImplementation', 'getVaultLiquidity', [])
+        else:
+            vaultLiquidity = results[6]
+        self.set_defi_margin(amountB0, vaultLiquidity)
+        if self.recorder is not None:
+            self.recorder.record('defi_margin', self.pair, [self.defi_margin])
+        if self.equity is not None:
+            self.equity.update(self)
+
+
+    def update_defi_state(self):
+        self.set_defi_state(Chain.batchCall(self.defiNetwork, self.get_defi_state_calls()))
+
+
+    def get_watch_addresses(self):
+        return [self.defiPoolAddress, self.symbolAddress]
 
 
     def update_cefi_position(self):
-        self.cefi_position = self.rest.get_position(symbol=self.cefiSymbol)
+        self.cefi_position = self.account.get_position(symbol=self.cefiSymbol)
+        if self.recorder is not None:
+            self.recorder.record('cefi_position', self.pair, [self.cefi_position['volume'], self.cefi_position['price']])
+        if self.equity is not None:
+            self.equity.update(self)
 
 
     def get_defi_pnl(self):
-        pnl = self.defi_position['volume'] * self.defi_symbol_state['price'] - self.defi_position['cost']
-        funding = (self.defi_symbol_state['cumulativeFundingPerVolume'] - self.defi_position['lastCumulativeFundingPerVolume']) * self.defi_position['volume']
-        return pnl - funding
+        return self.defi_position.get_pnl(self.defi_symbol_state) - self.defi_position.get_funding(self.defi_symbol_state)
 
 
     def get_cefi_dynamic_equity(self):
-        return self.rest.get_balance()
+        return self.account.get_balance()
 
 
+    # no new trade while an earlier one is unresolved, its nonce is taken and both could be mined
     def check_defi_position(self):
-        pool_volume = self.defi_symbol_state['netVolume']
-        defi_volume = self.defi_position['volume']
-        target = -(pool_volume - defi_volume) / 2
-        target = min(target, self.defiMaxVolume) if target >= 0 else max(target, -self.defiMaxVolume)
-        if target == 0:
-            delta = -defi_volume
-        elif target * defi_volume >= 0:
-            delta = (target - defi_volume) // self.defiMinVolume * self.defiMinVolume
-        else:
-            delta = target // self.defiMinVolume * self.defiMinVolume - defi_volume
-        if delta == 0 and pool_volume * defi_volume >= 0:
-            delta = -defi_volume
-        logging.info(f'(Defi) PoolNetVolume: {pool_volume}, HedgeTargetVolume: {target}, ArbitraguerVolume: {defi_volume}, Delta: {delta}')
+        if self.defi_pending is not None:
+            logging.info(f'(Defi) Waiting for {self.defi_pending.txHash.hex()}, ArbitraguerVolume: {State.to_decimal(self.defi_pending_volume)} expected')
+            return
+        pool_volume = self.defi_symbol_state.netVolume
+        defi_volume = self.defi_position.volume
+        target, delta = Hedge.get_defi_delta(pool_volume, defi_volume, self.defiMaxVolume, self.defiMinVolume)
+        logging.info(f'(Defi) PoolNetVolume: {State.to_decimal(pool_volume)}, HedgeTargetVolume: {State.to_decimal(target)}, '
+                     f'ArbitraguerVolume: {State.to_decimal(defi_volume)}, Delta: {State.to_decimal(delta)}')
 
         if delta != 0:
-            price = self.defi_symbol_state['price']
-            priceLimit = int(price * 1.1 * ONE) if delta > 0 else int(price * 0.9 * ONE)
-            oracleSignatures = []
-            receipt = Chain.transact(self.defiNetwork, self.defiPoolAddress, 'PoolImplementation', 'trade',
-                                     [self.defiSymbol, int(delta * ONE), priceLimit, oracleSignatures], self.defiAccount, self.defiPrivate)
+            price = self.defi_symbol_state.price
+            priceLimit = price * 11 // 10 if delta > 0 else price * 9 // 10
+            oracleSignatures = Oracle.getSignatures(self.defiOracleSymbols)
+            self.defi_pending = Chain.submit(self.defiNetwork, self.defiPoolAddress, 'PoolImplementation', 'trade',
+                                             [self.defiSymbol, delta, priceLimit, oracleSignatures], self.defiAccount, self.defiPrivate)
+            self.defi_pending_volume = defi_volume + delta
+            logging.info(f'       Submitted: {self.defi_pending.txHash.hex()}')
+            if self.recorder is not None:
+                self.recorder.record('hedge', self.pair, [delta, price], 'defi', self.defi_pending.txHash.hex())
+
+
+    # waits for the submitted defi trade, returns False if the position did not end up where the cefi leg was hedged to,
+    # a trade not mined in time stays pending and is waited for again by the next check
+    def confirm_defi_position(self):
+        if self.defi_pending is None: return True
+        defi_volume = self.defi_position.volume
+        try:
+            receipt = self.defi_pending.result(TX_RECEIPT_TIMEOUT)
             logging.info(f'       Receipt: ({receipt.transactionHash.hex()}, {receipt.status})')
-            self.update_defi_margin()
-            self.update_defi_position()
-            logging.info(f'       ArbitraguerVolume: {defi_volume} => {self.defi_position["volume"]}')
-
-
+        except TimeoutError:
+            logging.info(f'       Pending: {self.defi_pending.txHash.hex()} not mined after {TX_RECEIPT_TIMEOUT}s')
+            return True
+        except Exception:
+            logging.error(f'       Failed: {self.defi_pending.txHash.hex()} {traceback.format_exc()}')
+        self.defi_pending = None
+        self.update_defi_state()
+        logging.info(f'       ArbitraguerVolume: {State.to_decimal(defi_volume)} => {State.to_decimal(self.defi_position.volume)}')
+        return self.defi_position.volume == self.defi_pending_volume
+
+
+    # while a defi trade is pending the cefi leg is hedged against its expected volume
     def check_cefi_position(self):
-        defi_volume = self.defi_position['volume']
-        cefi_volume = self.cefi_position['volume']
-        target = -defi_volume / self.cefiMiltiplier // self.cefiMinVolume * self.cefiMinVolume
-        delta = target - cefi_volume
-        logging.info(f'(Cefi) DefiVolume: {defi_volume}, CefiTargetVolume: {target}, CefiVolume: {cefi_volume}, Delta: {delta}')
+        defi_volume = self.defi_pending_volume if self.defi_pending is not None else self.defi_position.volume
+        cefi_volume = State.to_int(self.cefi_position['volume'])
+        target, delta = Hedge.get_cefi_delta(defi_volume, cefi_volume, self.cefiMiltiplier, self.cefiMinVolume)
+        logging.info(f'(Cefi) DefiVolume: {State.to_decimal(defi_volume)}, CefiTargetVolume: {State.to_decimal(target)}, '
+                     f'CefiVolume: {State.to_decimal(cefi_volume)}, Delta: {State.to_decimal(delta)}')
 
         if delta != 0:
-            self.rest.place_order(self.cefiSymbol, 'buy' if delta > 0 else 'sell', str(abs(delta)), 'market')
+            order = self.account.place_order(self.cefiSymbol, 'buy' if delta > 0 else 'sell', str(State.to_decimal(abs(delta))), 'market')
+            if self.recorder is not None:
+                self.recorder.record('hedge', self.pair, [delta, order.get('avgPrice', 0) if order else 0], 'cefi', str(order.get('orderId')) if order else None)
             self.update_cefi_position()
-            logging.info(f'       CefiVolume: {cefi_volume} => {self.cefi_position["volume"]}')
+            logging.info(f'       CefiVolume: {State.to_decimal(cefi_volume)} => {self.cefi_position["volume"]}')
 
 
-    def check(self):
+    def check(self, update=True):
         logging.info(f'====> Check {self.defiSymbol}.{self.cefiSymbol}')
-        self.update_defi_symbol_state()
-        self.check_defi_position()
-        self.check_cefi_position()
+        with Metrics.timer('check', pair=self.pair, phase='total'):
+            if update:
+                with Metrics.timer('check', pair=self.pair, phase='update'):
+                    self.update_defi_state()
+            with Metrics.timer('check', pair=self.pair, phase='defi'):
+                self.check_defi_position()
+            try:
+                with Metrics.timer('check', pair=self.pair, phase='cefi'):
+                    self.check_cefi_position()
+            finally:
+                with Metrics.timer('check', pair=self.pair, phase='confirm'):
+                    confirmed = self.confirm_defi_position()
+            if not confirmed:
+                with Metrics.timer('check', pair=self.pair, phase='rehedge'):
+                    self.check_cefi_position()
+
+
+# constructs the arbitraguers concurrently, addresses come from the Chain cache after the first start
+def create_arbitraguers(details, workers=None):
+    if not details: return []
+    with ThreadPoolExecutor(max_workers=workers or CHECK_WORKERS or len(details)) as executor:
+        return list(executor.map(ArbitraguerV3, details))
+
+
+# refresh the defi state of all arbitraguers with one batch per network
+def update_defi_states(arbitraguers):
+    networks = {}
+    for arbitraguer in arbitraguers:
+        networks.setdefault(arbitraguer.defiNetwork, []).append(arbitraguer)
+    for network, group in networks.items():
+        calls = [arbitraguer.get_defi_state_calls() for arbitraguer in group]
+        results = Chain.batchCall(network, [call for items in calls for call in items])
+        for arbitraguer, items in zip(group, calls):
+            arbitraguer.set_defi_state(results[:len(items)])
+            results = results[len(items):]
 
 
 
@@ -0,0 +1,135 @@
+import sys
+import csv
+import glob
+import gzip
+import time
+from decimal import Decimal
+import Hedge
+import State
+
+
+# replays recorded pool state and binance prices through the ArbitraguerV3 hedge rules
+# tick files are gzip csv with the columns below, values in units (not 18 decimals), sorted by timestamp
+COLUMNS = ['timestamp', 'price', 'cumulativeFundingPerVolume', 'netVolume', 'netCost', 'cefiPrice']
+
+
+# streams the raw rows one at a time, values are only parsed for the ticks the strategy acts on
+def read_ticks(paths):
+    for path in paths:
+        with gzip.open(path, 'rt', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            if header != COLUMNS:
+                raise ValueError(f'Unexpected columns in {path}: {header}')
+            yield from reader
+
+
+class Backtest:
+
+    def __init__(self, details, check_interval=60, defi_fee_ratio=Decimal(0), defi_slippage=Decimal(0),
+                 cefi_fee_ratio=Decimal('0.0004'), own_volume_recorded=False):
+        self.defiMinVolume = State.to_int(details['defiMinVolume'])
+        self.defiMaxVolume = State.to_int(details['defiMaxVolume'])
+        self.cefiMiltiplier = details['cefiMiltiplier']
+        self.cefiMinVolume = State.to_int(details['cefiMinVolume'])
+        self.check_interval = check_interval
+        self.defi_fee_ratio = defi_fee_ratio
+        self.defi_slippage = defi_slippage
+        self.cefi_fee_ratio = cefi_fee_ratio
+        self.own_volume_recorded = own_volume_recorded
+
+        self.defi_volume = Decimal(0)
+        self.defi_cost = Decimal(0)
+        self.defi_last_funding = Decimal(0)
+        self.defi_funding = Decimal(0)
+        self.defi_fee = Decimal(0)
+        self.cefi_volume = Decimal(0)
+        self.cefi_cost = Decimal(0)
+        self.cefi_fee = Decimal(0)
+        self.slippage = Decimal(0)
+        self.ticks = 0
+        self.defi_trades = 0
+        self.cefi_trades = 0
+
+
+    # funding accrued since the last settlement is realized before the position changes
+    def trade_defi(self, delta, price, funding, pool_volume):
+        self.defi_funding += (funding - self.defi_last_funding) * self.defi_volume
+        self.defi_last_funding = funding
+        trade_price = price * (1 + self.defi_slippage * (pool_volume + delta / 2))
+        self.defi_volume += delta
+        self.defi_cost += delta * trade_price
+        self.defi_fee += abs(delta * price) * self.defi_fee_ratio
+        self.defi_trades += 1
+
+
+    # slippage of the hedge is the cefi fill price against the defi index price at the same tick
+    def trade_cefi(self, delta, price, cefi_price):
+        notional = delta * self.cefiMiltiplier
+        self.cefi_volume += delta
+        self.cefi_cost += notional * cefi_price
+        self.cefi_fee += abs(notional * cefi_price) * self.cefi_fee_ratio
+        self.slippage += notional * (cefi_price - price)
+        self.cefi_trades += 1
+
+
+    # ticks are rows of COLUMNS, as strings or numbers
+    def run(self, ticks):
+        next_check = None
+        row = None
+        for row in ticks:
+            self.ticks += 1
+            timestamp = int(row[0])
+            if next_check is not None and timestamp < next_check:
+                continue
+            next_check = timestamp + self.check_interval
+
+            _, price, funding, pool_volume, _, cefi_price = row
+            price, funding, pool_volume, cefi_price = Decimal(price), Decimal(funding), Decimal(pool_volume), Decimal(cefi_price)
+            if not self.own_volume_recorded:
+                pool_volume += self.defi_volume
+            _, delta = Hedge.get_defi_delta(State.to_int(pool_volume), State.to_int(self.defi_volume), self.defiMaxVolume, self.defiMinVolume)
+            if delta != 0:
+                self.trade_defi(State.to_decimal(delta), price, funding, pool_volume)
+            _, delta = Hedge.get_cefi_delta(
+                State.to_int(self.defi_volume), State.to_int(self.cefi_volume), State.to_int(self.cefiMiltiplier), self.cefiMinVolume
+            )
+            if delta != 0:
+                self.trade_cefi(State.to_decimal(delta), price, cefi_price)
+
+        if row is None:
+            raise ValueError('No ticks to replay')
+        return self.report(Decimal(row[1]), Decimal(row[2]), Decimal(row[5]))
+
+
+    def report(self, price, funding, cefi_price):
+        defi_funding = self.defi_funding + (funding - self.defi_last_funding) * self.defi_volume
+        defi_pnl = self.defi_volume * price - self.defi_cost
+        cefi_pnl = self.cefi_volume * self.cefiMiltiplier * cefi_price - self.cefi_cost
+        return {
+            'ticks': self.ticks,
+            'defiTrades': self.defi_trades,
+            'cefiTrades': self.cefi_trades,
+            'defiVolume': self.defi_volume,
+            'cefiVolume': self.cefi_volume,
+            'defiPnl': defi_pnl,
+            'defiFunding': -defi_funding,
+            'defiFee': self.defi_fee,
+            'cefiPnl': cefi_pnl,
+            'cefiFee': self.cefi_fee,
+            'hedgeSlippage': self.slippage,
+            'total': defi_pnl - defi_funding - self.defi_fee + cefi_pnl - self.cefi_fee
+        }
+
+
+
+
+if __name__ == '__main__':
+    from Preference import *
+
+    paths = sorted(path for pattern in sys.argv[1:] for path in glob.glob(pattern))
+    start = time.time()
+    report = Backtest(ARBITRAGUERS[0]).run(read_ticks(paths))
+    for key, value in report.items():
+        print(f'{key}: {value:.6f}' if isinstance(value, Decimal) else f'{key}: {value}')
+    print(f'Replayed {report["ticks"]} ticks in {time.time() - start:.3f}s')
@@ -0,0 +1,203 @@
+import sys
+import time
+import random
+import logging
+import argparse
+from decimal import Decimal
+from web3 import Web3
+from eth_account import Account
+from Preference import *
+import Chain
+import ArbitraguerV3
+import Metrics
+from Scheduler import Scheduler
+from Liquidator import Liquidator
+from Mock import MockChain, MockBinance
+
+
+# runs ArbitraguerV3 against the Mock chain and binance servers with a growing number of pairs, reports
+# check() latency, rpc / binance requests per cycle and pairs checked per second, every cycle other traders
+# move the pool net volume of each symbol so the defi and cefi legs are traded as they would be live,
+# with --accounts the Liquidator is run instead over that many traders while index prices move each block
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def run(pairs, cycles, latency, seed):
+    random.seed(seed)
+    symbols = [f'MOCK{i}USD' for i in range(pairs)]
+    chain = MockChain(symbols, latency=latency)
+    binance = MockBinance({f'MOCK{i}USDT': Decimal(20000) for i in range(pairs)}, latency=latency)
+    network = f'mock{pairs}'
+    RPCS[network] = [chain.start()]
+    binance.start()
+
+    account = Account.from_key(Web3.keccak(text=f'Benchmark.{seed}'))
+    chain.add_account(account.address, 1000 * ONE, 100000 * ONE)
+    details = [{
+        'defiNetwork': network,
+        'defiPoolAddress': chain.pool,
+        'defiAccount': account.address,
+        'defiPrivate': account.key.hex(),
+        'defiSymbol': symbol,
+        'defiMinVolume': Decimal('0.001'),
+        'defiMaxVolume': Decimal(10),
+        'cefiExchange': 'Binance',
+        'cefiUrl': binance.url,
+        'cefiKey': 'mock',
+        'cefiSecret': 'mock',
+        'cefiSymbol': f'MOCK{i}USDT',
+        'cefiMiltiplier': Decimal(1),
+        'cefiMinVolume': Decimal('0.001')
+    } for i, symbol in enumerate(symbols)]
+
+    start = time.perf_counter()
+    arbitraguers = ArbitraguerV3.create_arbitraguers(details)
+    construct = time.perf_counter() - start
+
+    # one check per pair in turn, each refreshing its own state
+    checks = []
+    for arbitraguer in arbitraguers:
+        chain.move(arbitraguer.defiSymbol, random.randint(-2000, 2000) * 10**15)
+        start = time.perf_counter()
+        arbitraguer.check()
+        checks.append(time.perf_counter() - start)
+
+    # full cycles through the scheduler, state of all pairs refreshed in one batch
+    scheduler = Scheduler(arbitraguers)
+    durations, rpcRequests, rpcCalls, cefiRequests, failures = [], [], [], [], 0
+    for _ in range(cycles):
+        for symbol in symbols:
+            chain.move(symbol, random.randint(-2000, 2000) * 10**15)
+        chain.reset_counts()
+        binance.reset_counts()
+        start = time.perf_counter()
+        results = scheduler.run()
+        durations.append(time.perf_counter() - start)
+        rpcRequests.append(chain.requests)
+        rpcCalls.append(sum(chain.counts.values()))
+        cefiRequests.append(binance.requests)
+        failures += sum(not result for result in results.values())
+
+    scheduler.executor.shutdown()
+    chain.stop()
+    binance.stop()
+    return {
+        'pairs': pairs,
+        'construct': construct,
+        'checkP50': percentile(checks, 0.5),
+        'checkP95': percentile(checks, 0.95),
+        'cycleP50': percentile(durations, 0.5),
+        'cycleP95': percentile(durations, 0.95),
+        'rpcRequests': sum(rpcRequests) / cycles,
+        'rpcCalls': sum(rpcCalls) / cycles,
+        'cefiRequests': sum(cefiRequests) / cycles,
+        'throughput': pairs * cycles / sum(durations),
+        'failures': failures
+    }
+
+
+def runLiquidations(accounts, updates, latency, seed, symbolsCount=4):
+    random.seed(seed)
+    symbols = [f'MOCK{i}USD' for i in range(symbolsCount)]
+    chain = MockChain(symbols, latency=latency)
+    network = f'mockliquidator{accounts}'
+    RPCS[network] = [chain.start()]
+    for _ in range(accounts):
+        positions = {}
+        for symbol in random.sample(symbols, random.randint(1, symbolsCount)):
+            volume = random.randint(-1000, 1000) * 10**15
+            positions[symbol] = (volume, volume * 20000)
+        chain.add_trader(random.randint(100, 5000) * ONE, positions)
+
+    account = Account.from_key(Web3.keccak(text=f'Benchmark.Liquidator.{seed}'))
+    chain.add_account(account.address)
+    liquidator = Liquidator({
+        'network': network,
+        'poolAddress': chain.pool,
+        'account': account.address,
+        'private': account.key.hex(),
+        'symbols': symbols
+    })
+
+    start = time.perf_counter()
+    liquidator.sync()
+    index = time.perf_counter() - start
+
+    # every block the index prices move by up to 5%, each check syncs, reads prices, scans and fires liquidations
+    checks, scans, rpcRequests, liquidations = [], [], [], 0
+    for _ in range(updates):
+        for symbol in symbols:
+            chain.set_price(symbol, chain.symbols[symbol]['indexPrice'] * random.randint(950, 1050) // 1000)
+        chain.reset_counts()
+        start = time.perf_counter()
+        liquidator.collect()
+        liquidator.sync()
+        liquidator.update_prices()
+        scanStart = time.perf_counter()
+        candidates = liquidator.scan()
+        scans.append(time.perf_counter() - scanStart)
+        liquidations += len(liquidator.liquidate(candidates))
+        checks.append(time.perf_counter() - start)
+        rpcRequests.append(chain.requests)
+    for future in list(liquidator.pending.values()):
+        future.result(TX_RECEIPT_TIMEOUT)
+    liquidator.collect()
+    remaining = len(liquidator.scan())
+
+    chain.stop()
+    return {
+        'accounts': accounts,
+        'index': index,
+        'checkP50': percentile(checks, 0.5),
+        'checkP95': percentile(checks, 0.95),
+        'scanP50': percentile(scans, 0.5),
+        'rpcRequests': sum(rpcRequests) / updates,
+        'liquidations': liquidations,
+        'remaining': remaining
+    }
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', default='1,2,4,8,16,32', help='comma separated numbers of pairs')
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every mock request')
+    parser.add_argument('--tx-poll', type=float, default=0.05, help='receipt poll interval, the mock mines on send')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', action='store_true', help=f'record state to {DIR_RECORDS}')
+    parser.add_argument('--metrics', action='store_true', help='print the collected metrics at the end')
+    parser.add_argument('--accounts', help='comma separated numbers of traders, benchmarks the Liquidator instead')
+    parser.add_argument('--updates', type=int, default=10, help='index price updates per Liquidator run')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    Chain.TX_POLL_INTERVAL = args.tx_poll
+    ArbitraguerV3.RECORD = args.record
+    Metrics.ENABLED = args.metrics
+
+    if args.accounts:
+        print(f'{"accounts":>9} {"index":>8} {"check p50":>10} {"check p95":>10} {"scan p50":>9} {"rpc req":>8} '
+              f'{"liquidated":>11} {"remaining":>10}')
+        for accounts in [int(item) for item in args.accounts.split(',')]:
+            result = runLiquidations(accounts, args.updates, args.latency, args.seed)
+            print(f'{result["accounts"]:>9} {result["index"]:>7.2f}s {result["checkP50"] * 1000:>8.1f}ms {result["checkP95"] * 1000:>8.1f}ms '
+                  f'{result["scanP50"] * 1000:>7.2f}ms {result["rpcRequests"]:>8.1f} {result["liquidations"]:>11} {result["remaining"]:>10}')
+        if args.metrics:
+            print(Metrics.render())
+        sys.exit()
+
+    print(f'{"pairs":>6} {"construct":>10} {"check p50":>10} {"check p95":>10} {"cycle p50":>10} {"cycle p95":>10} '
+          f'{"rpc req":>8} {"rpc calls":>10} {"cefi req":>9} {"pairs/s":>8} {"failed":>7}')
+    for pairs in [int(item) for item in args.pairs.split(',')]:
+        result = run(pairs, args.cycles, args.latency, args.seed)
+        print(f'{result["pairs"]:>6} {result["construct"]:>9.3f}s {result["checkP50"] * 1000:>8.1f}ms {result["checkP95"] * 1000:>8.1f}ms '
+              f'{result["cycleP50"] * 1000:>8.1f}ms {result["cycleP95"] * 1000:>8.1f}ms {result["rpcRequests"]:>8.1f} '
+              f'{result["rpcCalls"]:>10.1f} {result["cefiRequests"]:>9.1f} {result["throughput"]:>8.1f} {result["failures"]:>7}')
+    if args.metrics:
+        print(Metrics.render())
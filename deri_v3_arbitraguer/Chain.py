@@ -1,28 +1,147 @@
+import os
 import time
 import json
-import random
+import pickle
+import logging
+import threading
+import traceback
+import requests
+from concurrent.futures import Future
 from web3 import Web3
-from web3.middleware import geth_poa_middleware, local_filter_middleware
+from web3.exceptions import TransactionNotFound
+from hexbytes import HexBytes
+from web3.middleware import geth_poa_middleware, local_filter_middleware, simple_cache_middleware
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
 from Preference import *
+import Metrics
+import Endpoints
 
 
-ABIS = {}
+MULTICALL_ABI = [
+    {
+        'inputs': [
+            {
+                'components': [
+                    {'internalType': 'address', 'name': 'target', 'type': 'address'},
+                    {'internalType': 'bytes', 'name': 'callData', 'type': 'bytes'}
+                ],
+                'internalType': 'struct Multicall.Call[]',
+                'name': 'calls',
+                'type': 'tuple[]'
+            }
+        ],
+        'name': 'aggregate',
+        'outputs': [
+            {'internalType': 'uint256', 'name': 'blockNumber', 'type': 'uint256'},
+            {'internalType': 'bytes[]', 'name': 'returnData', 'type': 'bytes[]'}
+        ],
+        'stateMutability': 'nonpayable',
+        'type': 'function'
+    }
+]
 
+# reads whose result never changes once set, kept in DIR_CACHE across restarts with the code hash of the contract read,
+# entries of contracts whose code changed are dropped on first use, zero results are not cached
+IMMUTABLE_READS = {
+    ('PoolImplementation', 'symbolManager'),
+    ('PoolImplementation', 'pToken'),
+    ('SymbolManagerImplementation', 'symbols'),
+    ('DToken', 'getTokenIdOf')
+}
+MISSING = object()
 
-def getWeb3(network):
-    web3 = Web3(Web3.HTTPProvider(random.choice(RPCS[network])))
-    if 'bsc' in network or 'heco' in network:
-        web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-        web3.middleware_onion.add(local_filter_middleware)
-    web3.network = network
-    return web3
+ABIS = {'Multicall': MULTICALL_ABI}
+WEB3S = {}
+ENDPOINTS = {}
+CONTRACTS = {}
+LOCK = threading.Lock()
+TRANSACTORS = {}
+CHAIN_IDS = {}
+FEES = {}
+GAS_PROFILES = None
+PINS = {}
+IMMUTABLES = None
+CODE_HASHES = {}
+ABI_CACHE = None
+CACHE_LOCK = threading.Lock()
 
 
+def getSession():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def getEndpoints(network):
+    if network in ENDPOINTS: return ENDPOINTS[network]
+    with LOCK:
+        if network not in ENDPOINTS:
+            ENDPOINTS[network] = Endpoints.Endpoints(network, RPCS[network], lambda rpc: getWeb3(network, rpc))
+    return ENDPOINTS[network]
+
+
+# the best scored endpoint of the network unless rpc is given
+def getWeb3(network, rpc=None):
+    endpoints = getEndpoints(network)
+    if rpc is None: rpc = endpoints.select()
+    if rpc in WEB3S: return WEB3S[rpc]
+    with LOCK:
+        if rpc not in WEB3S:
+            session = getSession()
+            # ens is never used, without it contracts are created without building an ENS instance each time
+            web3 = Web3(Web3.HTTPProvider(rpc, request_kwargs={'timeout': RPC_TIMEOUT}, session=session), ens=None)
+            if 'bsc' in network or 'heco' in network:
+                web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+                web3.middleware_onion.add(local_filter_middleware)
+            # added last, the cache is the outermost layer and its hits never reach the endpoint measurements
+            web3.middleware_onion.add(Endpoints.getMiddleware(endpoints, rpc), 'endpoints')
+            web3.middleware_onion.add(simple_cache_middleware, 'cache')
+            web3.network = network
+            web3.rpc = rpc
+            web3.session = session
+            WEB3S[rpc] = web3
+    return WEB3S[rpc]
+
+
+# cache files are written to a temporary file that is then moved over the target, so that a crash or another
+# process never leaves a partial file behind, an unreadable file is loaded as an empty cache
+def writeCache(fileName, dump, binary=False):
+    path = f'{DIR_CACHE}/{fileName}'
+    temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp, 'wb' if binary else 'w') as file:
+        dump(file)
+    os.replace(temp, path)
+
+
+def getAbiCache():
+    global ABI_CACHE
+    if ABI_CACHE is None:
+        try:
+            with open(f'{DIR_CACHE}/Abis.pickle', 'rb') as file:
+                ABI_CACHE = pickle.load(file)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, ValueError):
+            ABI_CACHE = {}
+    return ABI_CACHE
+
+
+# abis are parsed once and kept pickled in DIR_CACHE, a cached abi is used while its json file is unchanged
 def getAbi(abiName):
     global ABIS
     if abiName in ABIS: return ABIS[abiName]
-    with open(f'{DIR_ABIS}/{abiName}.json') as file:
-        interface = json.load(file)
+    path = f'{DIR_ABIS}/{abiName}.json'
+    stat = os.stat(path)
+    with CACHE_LOCK:
+        cache = getAbiCache()
+        if abiName in cache and cache[abiName][0] == (stat.st_mtime_ns, stat.st_size):
+            ABIS[abiName] = cache[abiName][1]
+            return ABIS[abiName]
+        with open(path) as file:
+            interface = json.load(file)
+        cache[abiName] = ((stat.st_mtime_ns, stat.st_size), interface['abi'])
+        writeCache('Abis.pickle', lambda file: pickle.dump(cache, file, pickle.HIGHEST_PROTOCOL), binary=True)
     ABIS[abiName] = interface['abi']
     return ABIS[abiName]
 
@@ -31,26 +150,398 @@ def getId(symbol):
     return Web3.keccak(text=symbol).hex()
 
 
-def getContract(network, address, abiName):
-    web3 = getWeb3(network)
-    contract = web3.eth.contract(address=address, abi=getAbi(abiName))
+# one contract class per (abi, endpoint), instantiated for each address
+def getContract(network, address, abiName, rpc=None):
+    web3 = getWeb3(network, rpc)
+    key = (network, address, abiName, web3.rpc)
+    if key in CONTRACTS: return CONTRACTS[key]
+    if (abiName, web3.rpc) not in CONTRACTS:
+        abi = getAbi(abiName)
+        with LOCK:
+            if (abiName, web3.rpc) not in CONTRACTS:
+                CONTRACTS[(abiName, web3.rpc)] = web3.eth.contract(abi=abi)
+    factory = CONTRACTS[(abiName, web3.rpc)]
+    contract = factory(address=address)
+    CONTRACTS[key] = contract
     return contract
 
 
+def getCodeHash(network, address):
+    if (network, address) not in CODE_HASHES:
+        CODE_HASHES[(network, address)] = Web3.keccak(getWeb3(network).eth.getCode(address)).hex()
+    return CODE_HASHES[(network, address)]
+
+
+def saveImmutables():
+    reads = {network: item['reads'] for network, item in IMMUTABLES.items()}
+    writeCache('Immutables.json', lambda file: json.dump(reads, file))
+
+
+# the code of all contracts cached for the network is fetched in one batch the first time it is used in the process
+def getImmutables(network):
+    global IMMUTABLES
+    with CACHE_LOCK:
+        if IMMUTABLES is None:
+            try:
+                with open(f'{DIR_CACHE}/Immutables.json') as file:
+                    IMMUTABLES = {network: {'validated': False, 'reads': reads} for network, reads in json.load(file).items()}
+            except (FileNotFoundError, ValueError):
+                IMMUTABLES = {}
+        immutables = IMMUTABLES.setdefault(network, {'validated': True, 'reads': {}})
+        if not immutables['validated'] and immutables['reads']:
+            reads = immutables['reads']
+            addresses = sorted({key.split(':')[0] for key in reads})
+            codes = batchRequest(getWeb3(network), [('eth_getCode', [address, 'latest']) for address in addresses])
+            for address, code in zip(addresses, codes):
+                CODE_HASHES[(network, address)] = Web3.keccak(hexstr=code).hex()
+            invalid = [key for key, item in reads.items() if CODE_HASHES[(network, key.split(':')[0])] != item['codeHash']]
+            for key in invalid:
+                reads.pop(key)
+            if invalid:
+                logging.info(f'(Chain) {network} contract code changed, dropped {len(invalid)} cached reads')
+                saveImmutables()
+        immutables['validated'] = True
+        return immutables['reads']
+
+
+# reads of the network are pinned to its head block until the next pin, repeated reads at the pinned block are
+# served from memory, a new head or another hash at the same height (reorg) starts with an empty cache
+def pinBlock(network):
+    block = getWeb3(network).eth.getBlock('latest')
+    with LOCK:
+        pin = PINS.get(network)
+        if pin is None or pin['number'] != block.number or pin['hash'] != block.hash:
+            PINS[network] = {'number': block.number, 'hash': block.hash, 'reads': {}}
+    return block.number
+
+
+# reads go to the latest block again, after our own transactions
+def unpinBlock(network):
+    PINS.pop(network, None)
+
+
+def getReadKey(address, functionName, params):
+    return f'{address}:{functionName}:{json.dumps(params, default=str)}'
+
+
+def getRead(network, pin, abiName, functionName, key):
+    if (abiName, functionName) in IMMUTABLE_READS:
+        result = getImmutables(network).get(key, {'result': MISSING})['result']
+    elif pin is not None:
+        result = pin['reads'].get(key, MISSING)
+    else:
+        return MISSING
+    if result is not MISSING:
+        Metrics.count('chain_cache_hits', network=network, contract=abiName, function=functionName)
+    return result
+
+
+def setRead(network, pin, abiName, functionName, key, result):
+    if (abiName, functionName) in IMMUTABLE_READS:
+        if result in (0, ZERO_ADDRESS): return
+        reads = getImmutables(network)
+        codeHash = getCodeHash(network, key.split(':')[0])
+        with CACHE_LOCK:
+            reads[key] = {'result': result, 'codeHash': codeHash}
+            saveImmutables()
+    elif pin is not None:
+        pin['reads'][key] = result
+
+
 def call(network, address, abiName, functionName, params=None):
-    contract = getContract(network, address, abiName)
     if params is None: params = []
-    return contract.functions[functionName](*params).call()
+    pin = PINS.get(network)
+    key = getReadKey(address, functionName, params)
+    result = getRead(network, pin, abiName, functionName, key)
+    if result is not MISSING: return result
+    contract = getContract(network, address, abiName)
+    with Metrics.timer('chain_call', network=network, contract=abiName, function=functionName):
+        result = contract.functions[functionName](*params).call(block_identifier=pin['number'] if pin else 'latest')
+    setRead(network, pin, abiName, functionName, key, result)
+    return result
+
+
+def decodeResult(web3, abi, data):
+    types = get_abi_output_types(abi)
+    result = map_abi_data(BASE_RETURN_NORMALIZERS, types, web3.codec.decode_abi(types, HexBytes(data)))
+    return result[0] if len(result) == 1 else result
+
+
+# an empty batch is answered by the node with a single error object, it is not sent
+def batchRequest(web3, requests):
+    if not requests: return []
+    payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params} for i, (method, params) in enumerate(requests)]
+    endpoints = getEndpoints(web3.network)
+    start = time.perf_counter()
+    try:
+        res = web3.session.post(web3.rpc, json=payload, timeout=RPC_TIMEOUT)
+        res.raise_for_status()
+    except Exception:
+        endpoints.record(web3.rpc, time.perf_counter() - start, error=True)
+        raise
+    endpoints.record(web3.rpc, time.perf_counter() - start)
+    responses = sorted(res.json(), key=lambda response: response['id'])
+    for response in responses:
+        if 'error' in response:
+            method, params = requests[response['id']]
+            raise ValueError(f'Batch request {method} {params} error: {response["error"]}')
+    return [response['result'] for response in responses]
+
+
+# calls: [(address, abiName, functionName, params), ...], all reads are sent in one round trip,
+# through the network's multicall contract if configured, otherwise as a JSON-RPC batch,
+# with hedge the round trip is repeated on a second endpoint when the first is slower than usual,
+# reads cached at the pinned block and duplicates are left out of the request
+def batchCall(network, calls, hedge=RPC_HEDGE):
+    if not calls: return []
+    web3 = getWeb3(network)
+    pin = PINS.get(network)
+    keys = [getReadKey(address, functionName, params or []) for address, _, functionName, params in calls]
+    results = [getRead(network, pin, abiName, functionName, key) for (_, abiName, functionName, _), key in zip(calls, keys)]
+    missing = {}
+    for i, (key, result) in enumerate(zip(keys, results)):
+        if result is MISSING: missing.setdefault(key, i)
+    if not missing: return results
+
+    indices = list(missing.values())
+    functions = [
+        getContract(network, calls[i][0], calls[i][1]).functions[calls[i][2]](*(calls[i][3] or [])) for i in indices
+    ]
+    datas = [function._encode_transaction_data() for function in functions]
+    if Metrics.ENABLED:
+        for i in indices:
+            Metrics.count('chain_batched_calls', network=network, contract=calls[i][1], function=calls[i][2])
+    block = pin['number'] if pin else 'latest'
+
+    def request(rpc):
+        if MULTICALLS.get(network):
+            multicall = getContract(network, MULTICALLS[network], 'Multicall', rpc)
+            calls = [(function.address, data) for function, data in zip(functions, datas)]
+            return multicall.functions.aggregate(calls).call(block_identifier=block)[1]
+        return batchRequest(getWeb3(network, rpc), [
+            ('eth_call', [{'to': function.address, 'data': data}, hex(block) if pin else block]) for function, data in zip(functions, datas)
+        ])
+
+    with Metrics.timer('chain_batch', network=network):
+        returnDatas = getEndpoints(network).hedge(request) if hedge else request(web3.rpc)
+    for i, function, data in zip(indices, functions, returnDatas):
+        results[i] = decodeResult(web3, function.abi, data)
+        setRead(network, pin, calls[i][1], calls[i][2], keys[i], results[i])
+    return [results[missing[key]] if result is MISSING else result for key, result in zip(keys, results)]
+
+
+def getBlockNumber(network):
+    with Metrics.timer('chain_request', network=network, method='eth_blockNumber'):
+        return getWeb3(network).eth.blockNumber
+
+
+def getLogs(network, addresses, fromBlock, toBlock):
+    with Metrics.timer('chain_request', network=network, method='eth_getLogs'):
+        return getWeb3(network).eth.getLogs({
+            'address': list(addresses),
+            'fromBlock': fromBlock,
+            'toBlock': toBlock
+        })
+
+
+def getChainId(network):
+    if network not in CHAIN_IDS: CHAIN_IDS[network] = getWeb3(network).eth.chainId
+    return CHAIN_IDS[network]
+
+
+# eip-1559 fees from the recent fee history, legacy gas price on chains without a base fee, cached for FEE_TTL
+def getFees(network):
+    if network in FEES and time.time() - FEES[network][0] < FEE_TTL:
+        return FEES[network][1]
+    web3 = getWeb3(network)
+    try:
+        history = web3.eth.fee_history(FEE_HISTORY_BLOCKS, 'latest', [FEE_PERCENTILE])
+        baseFee = history['baseFeePerGas'][-1]
+    except Exception as e:
+        logging.info(f'(Chain) {network} fee history unavailable, using gasPrice: {e}')
+        baseFee = None
+    if baseFee:
+        rewards = sorted(reward[0] for reward in history['reward'])
+        priorityFee = rewards[len(rewards) // 2]
+        fees = {'maxFeePerGas': baseFee * 2 + priorityFee, 'maxPriorityFeePerGas': priorityFee}
+    else:
+        fees = {'gasPrice': web3.eth.gasPrice}
+    FEES[network] = (time.time(), fees)
+    return fees
+
+
+# list lengths and integer signs, the signs tell buys from sells but not opening from closing trades of the same side,
+# which would need the position the trade is applied to
+def getArgShape(params):
+    shape = []
+    for param in params:
+        if isinstance(param, (list, tuple)):
+            shape.append(f'list{len(param)}')
+        elif isinstance(param, int) and not isinstance(param, bool):
+            shape.append('int-' if param < 0 else 'int+' if param > 0 else 'int0')
+        else:
+            shape.append(type(param).__name__)
+    return ','.join(shape)
+
+
+def getGasKey(network, address, functionName, params):
+    return f'{network}:{address}:{functionName}:{getArgShape(params)}'
+
+
+def getGasProfiles():
+    global GAS_PROFILES
+    if GAS_PROFILES is None:
+        try:
+            with open(f'{DIR_CACHE}/GasProfiles.json') as file:
+                GAS_PROFILES = json.load(file)
+        except (FileNotFoundError, ValueError):
+            GAS_PROFILES = {}
+    return GAS_PROFILES
+
+
+# gas limit from the gasUsed of the last receipts with the same contract, function and argument shape
+def estimateGas(gasKey, function, account):
+    profile = getGasProfiles().get(gasKey)
+    if profile:
+        return max(profile) * 3 // 2
+    return function.estimateGas({'from': account}) * 3 // 2
+
+
+def recordGas(gasKey, gas, receipt):
+    profiles = getGasProfiles()
+    with LOCK:
+        if receipt.status == 0 and receipt.gasUsed >= gas:
+            profiles.pop(gasKey, None)
+        elif receipt.status == 1:
+            profiles[gasKey] = (profiles.get(gasKey, []) + [receipt.gasUsed])[-GAS_PROFILE_SIZE:]
+        else:
+            return
+        writeCache('GasProfiles.json', lambda file: json.dump(profiles, file))
+
+
+class Transactor:
+
+    def __init__(self, network, account, private):
+        self.network = network
+        self.account = account
+        self.private = private
+
+        self.lock = threading.Lock()
+        self.nonce = None
+        self.pending = {}
+        self.thread = None
+
+
+    def _send(self, web3, tx):
+        signedTx = web3.eth.account.signTransaction(tx, self.private)
+        return web3.eth.sendRawTransaction(signedTx.rawTransaction)
+
+
+    # nonces are allocated locally, the transaction is sent without waiting for it to be mined,
+    # the returned future resolves to the receipt
+    def submit(self, address, abiName, functionName, params):
+        with Metrics.timer('chain_submit', network=self.network, contract=abiName, function=functionName):
+            return self._submit(address, abiName, functionName, params)
+
+
+    def _submit(self, address, abiName, functionName, params):
+        contract = getContract(self.network, address, abiName)
+        function = contract.functions[functionName](*params)
+        gasKey = getGasKey(self.network, address, functionName, params)
+        gas = estimateGas(gasKey, function, self.account)
+        fees = getFees(self.network)
+        with self.lock:
+            if self.nonce is None:
+                self.nonce = contract.web3.eth.getTransactionCount(self.account, 'pending')
+            tx = function.buildTransaction({
+                'nonce': self.nonce,
+                'from': self.account,
+                'gas': gas,
+                'chainId': getChainId(self.network),
+                **fees
+            })
+            try:
+                txHash = self._send(contract.web3, tx)
+            except Exception:
+                self.nonce = None
+                raise
+            future = Future()
+            future.txHash = txHash
+            self.pending[self.nonce] = {
+                'tx': tx, 'txHashes': [txHash], 'sent': time.time(), 'submitted': time.time(), 'future': future,
+                'gasKey': gasKey, 'labels': {'network': self.network, 'contract': abiName, 'function': functionName}
+            }
+            self.nonce += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._track, daemon=True)
+                self.thread.start()
+        return future
+
+
+    # replacement must raise the gas price by at least 10%, it is built under the lock and sent outside it
+    # so that submits are not held up by the round trip
+    def _replace(self, web3, nonce, item):
+        with self.lock:
+            tx = dict(item['tx'])
+            for key in ('gasPrice', 'maxFeePerGas', 'maxPriorityFeePerGas'):
+                if key in tx: tx[key] = tx[key] * 9 // 8 + 1
+        txHash = self._send(web3, tx)
+        logging.info(f'(Transactor) {self.account} nonce {nonce} stuck, replaced {item["txHashes"][-1].hex()} with {txHash.hex()}')
+        with self.lock:
+            item.update({'tx': tx, 'sent': time.time()})
+            item['txHashes'].append(txHash)
+
+
+    def _track(self):
+        while True:
+            time.sleep(TX_POLL_INTERVAL)
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+                pending = list(self.pending.items())
+            try:
+                web3 = getWeb3(self.network)
+                confirmed = web3.eth.getTransactionCount(self.account)
+                for nonce, item in pending:
+                    receipt = None
+                    for txHash in item['txHashes']:
+                        try:
+                            receipt = web3.eth.getTransactionReceipt(txHash)
+                            break
+                        except TransactionNotFound:
+                            pass
+                    if receipt is not None:
+                        with self.lock: self.pending.pop(nonce)
+                        unpinBlock(self.network)
+                        recordGas(item['gasKey'], item['tx']['gas'], receipt)
+                        Metrics.observe('chain_confirm', time.time() - item['submitted'], error=receipt.status != 1, **item['labels'])
+                        Metrics.count('chain_replacements', len(item['txHashes']) - 1, **item['labels'])
+                        item['future'].set_result(receipt)
+                    elif nonce < confirmed:
+                        with self.lock: self.pending.pop(nonce)
+                        item['future'].set_exception(ValueError(f'Nonce {nonce} of {self.account} used by another transaction'))
+                    elif time.time() - item['sent'] > TX_REPLACE_TIMEOUT:
+                        try:
+                            self._replace(web3, nonce, item)
+                        except Exception:
+                            logging.error(f'(Transactor) {self.account} nonce {nonce} replacement error: {traceback.format_exc()}')
+            except Exception:
+                logging.error(f'(Transactor) {self.account} tracking error: {traceback.format_exc()}')
+
+
+def getTransactor(network, account, private):
+    with LOCK:
+        if (network, account) not in TRANSACTORS:
+            TRANSACTORS[(network, account)] = Transactor(network, account, private)
+        return TRANSACTORS[(network, account)]
+
+
+def submit(network, address, abiName, functionName, params, account, private):
+    return getTransactor(network, account, private).submit(address, abiName, functionName, params)
 
 
 def transact(network, address, abiName, functionName, params, account, private):
-    contract = getContract(network, address, abiName)
-    tx = contract.functions[functionName](*params).buildTransaction({
-        'nonce': contract.web3.eth.getTransactionCount(account),
-        'from': account,
-        'gas': contract.functions[functionName](*params).estimateGas({'from': account}) * 3 // 2
-    })
-    signedTx = contract.web3.eth.account.signTransaction(tx, private)
-    txHash = contract.web3.eth.sendRawTransaction(signedTx.rawTransaction)
-    receipt = contract.web3.eth.waitForTransactionReceipt(txHash)
-    return receipt
+    future = submit(network, address, abiName, functionName, params, account, private)
+    with Metrics.timer('chain_receipt_wait', network=network, contract=abiName, function=functionName):
+        return future.result(TX_RECEIPT_TIMEOUT)
@@ -0,0 +1,154 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from Preference import *
+import Metrics
+
+
+# health of the rpc endpoints of a network, requests are routed to the endpoint with the lowest score:
+# latency ewma, inflated by the error rate ewma, plus a penalty per block the endpoint lags the best known head,
+# an endpoint failing RPC_BREAKER_FAILURES times in a row is skipped for RPC_BREAKER_TIMEOUT (doubling while it keeps failing)
+EXECUTOR = ThreadPoolExecutor(max_workers=RPC_POOL_SIZE)
+
+
+class Endpoint:
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.latency = 0
+        self.errorRate = 0
+        self.samples = deque(maxlen=100)
+        self.head = None
+        self.failures = 0
+        self.openUntil = 0
+        self.timeout = RPC_BREAKER_TIMEOUT
+
+
+class Endpoints:
+
+    def __init__(self, network, rpcs, getWeb3):
+        self.network = network
+        self.endpoints = {rpc: Endpoint(rpc) for rpc in rpcs}
+        self.getWeb3 = getWeb3
+
+        self.lock = threading.Lock()
+        self.head = 0
+        self.thread = None
+
+
+    def score(self, endpoint):
+        lag = self.head - endpoint.head if endpoint.head is not None else 0
+        return endpoint.latency * (1 + RPC_ERROR_PENALTY * endpoint.errorRate) + lag * RPC_LAG_PENALTY
+
+
+    # endpoints never measured score 0 so each one is tried, if every endpoint is open the one reopening first is used
+    def select(self, exclude=()):
+        if len(self.endpoints) == 1:
+            return next(iter(self.endpoints))
+        if self.thread is None: self.start()
+        now = time.time()
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints.values() if endpoint.rpc not in exclude]
+            closed = [endpoint for endpoint in candidates if endpoint.openUntil <= now]
+            if closed:
+                return min(closed, key=self.score).rpc
+            return min(candidates or self.endpoints.values(), key=lambda endpoint: endpoint.openUntil).rpc
+
+
+    def record(self, rpc, seconds, error=False):
+        endpoint = self.endpoints.get(rpc)
+        if endpoint is None: return
+        with self.lock:
+            endpoint.errorRate += RPC_EWMA_ALPHA * ((1 if error else 0) - endpoint.errorRate)
+            if error:
+                endpoint.failures += 1
+                if endpoint.failures >= RPC_BREAKER_FAILURES:
+                    if endpoint.openUntil: endpoint.timeout = min(endpoint.timeout * 2, RPC_BREAKER_TIMEOUT * 32)
+                    endpoint.openUntil = time.time() + endpoint.timeout
+                    logging.info(f'(Endpoints) {self.network} {rpc} failed {endpoint.failures} times, skipped for {endpoint.timeout}s')
+                    Metrics.count('rpc_breaker_open', network=self.network, rpc=rpc)
+                return
+            endpoint.latency = seconds if not endpoint.samples else endpoint.latency + RPC_EWMA_ALPHA * (seconds - endpoint.latency)
+            endpoint.samples.append(seconds)
+            endpoint.failures = 0
+            endpoint.openUntil = 0
+            endpoint.timeout = RPC_BREAKER_TIMEOUT
+
+
+    def update_head(self, rpc, block):
+        endpoint = self.endpoints.get(rpc)
+        if endpoint is None: return
+        with self.lock:
+            endpoint.head = max(endpoint.head or 0, block)
+            self.head = max(self.head, block)
+
+
+    # delay after which a read is hedged to a second endpoint, the RPC_HEDGE_PERCENTILE of the recent latencies
+    def threshold(self, rpc):
+        endpoint = self.endpoints[rpc]
+        with self.lock:
+            samples = sorted(endpoint.samples)
+        if len(samples) < 10:
+            return RPC_TIMEOUT / 4
+        return samples[min(int(len(samples) * RPC_HEDGE_PERCENTILE), len(samples) - 1)]
+
+
+    # request(rpc) is sent to the best endpoint, and again to the next best one if it has not answered within the threshold,
+    # the first successful response wins
+    def hedge(self, request):
+        primary = self.select()
+        if len(self.endpoints) == 1:
+            return request(primary)
+        futures = [EXECUTOR.submit(request, primary)]
+        done, _ = wait(futures, timeout=self.threshold(primary))
+        if done and futures[0].exception() is None:
+            return futures[0].result()
+        secondary = self.select(exclude={primary})
+        Metrics.count('rpc_hedged', network=self.network)
+        futures.append(EXECUTOR.submit(request, secondary))
+        pending = futures
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+        raise futures[0].exception()
+
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None: return
+            self.thread = threading.Thread(target=self._probe, daemon=True)
+        self.thread.start()
+
+
+    # block number of every endpoint each RPC_PROBE_INTERVAL, which also tests endpoints whose breaker is open
+    def _probe(self):
+        while True:
+            for rpc in list(self.endpoints):
+                try:
+                    self.getWeb3(rpc).eth.blockNumber
+                except Exception:
+                    pass
+            time.sleep(RPC_PROBE_INTERVAL)
+
+
+# web3 middleware measuring every request sent to rpc, and the head block it reports
+def getMiddleware(endpoints, rpc):
+    def middleware(make_request, web3):
+        def request(method, params):
+            start = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception:
+                endpoints.record(rpc, time.perf_counter() - start, error=True)
+                raise
+            endpoints.record(rpc, time.perf_counter() - start)
+            if method == 'eth_blockNumber' and 'result' in response:
+                result = response['result']
+                endpoints.update_head(rpc, int(result, 16) if isinstance(result, str) else int(result))
+            return response
+        return request
+    return middleware
@@ -0,0 +1,143 @@
+import time
+import array
+import threading
+from Preference import *
+import State
+
+
+# mark-to-market equity of all arbitraguers, updated from the state they already hold whenever one of them refreshes it,
+# only the changed pair is recomputed and the totals moved by its difference, nothing is requested for it
+#   defi equity = margin of each distinct pToken + sum(pnl - funding) of the pairs
+#   cefi equity = wallet balance of each distinct account + sum(volume * (index price * multiplier - entry price))
+#                 of each distinct position, pairs hedged in the same symbol of the same account share one position
+# the cefi leg is marked at the pool's index price of the same underlying, its balances and positions come from the
+# last account snapshot and the user data stream, the exposure of a hedge is that of its position and the defi legs
+# of all its pairs
+# the totals are kept in a ring buffer of EQUITY_HISTORY_SIZE points, at most one every EQUITY_SAMPLE_INTERVAL, taken by
+# sample() once all pairs of a cycle are updated so that peaks and drawdowns never see a partly updated total
+class Equity:
+
+    def __init__(self, arbitraguers, size=EQUITY_HISTORY_SIZE, interval=EQUITY_SAMPLE_INTERVAL, currency=EQUITY_CURRENCY):
+        self.arbitraguers = arbitraguers
+        self.size = size
+        self.interval = interval
+        self.currency = currency
+
+        self.lock = threading.Lock()
+        self.pairs = {}
+        self.positions = {}
+        self.hedges = {}
+        self.margins = {}
+        self.wallets = {}
+        self.defi = 0
+        self.cefi = 0
+        self.exposure = 0
+
+        self.times = array.array('d', [0]) * size
+        self.totals = array.array('d', [0]) * size
+        self.defis = array.array('d', [0]) * size
+        self.cefis = array.array('d', [0]) * size
+        self.exposures = array.array('d', [0]) * size
+        self.count = 0
+        self.peak = None
+        self.drawdown = 0
+        self.maxDrawdown = 0
+
+        for arbitraguer in arbitraguers:
+            self.update(arbitraguer)
+            arbitraguer.equity = self
+        self.sample()
+
+
+    # pnl and exposure of the defi leg of a pair and unrealized pnl and exposure of its cefi position, all with 18 decimals
+    def get_pair(self, arbitraguer):
+        price = arbitraguer.defi_symbol_state.price
+        defi = arbitraguer.get_defi_pnl()
+        defiExposure = State.mul(arbitraguer.defi_position.volume, price)
+        cefi = 0
+        cefiExposure = 0
+        position = arbitraguer.account.positions.get(arbitraguer.cefiSymbol)
+        if position is not None:
+            cefiVolume = State.to_int(position['volume'])
+            mark = State.mul(price, arbitraguer.cefiMiltiplier)
+            cefi = State.mul(cefiVolume, mark - State.to_int(position['price']))
+            cefiExposure = State.mul(State.mul(cefiVolume, arbitraguer.cefiMiltiplier), price)
+        return defi, defiExposure, cefi, cefiExposure
+
+
+    def update(self, arbitraguer):
+        defi, defiExposure, cefi, cefiExposure = self.get_pair(arbitraguer)
+        pToken = (arbitraguer.defiNetwork, arbitraguer.defiPoolAddress, arbitraguer.pTokenId)
+        hedge = (arbitraguer.account, arbitraguer.cefiSymbol)
+        wallet = arbitraguer.account.wallets.get(self.currency)
+        with self.lock:
+            lastDefi, lastDefiExposure = self.pairs.get(arbitraguer, (0, 0))
+            lastCefi, lastCefiExposure = self.positions.get(hedge, (0, 0))
+            self.pairs[arbitraguer] = (defi, defiExposure)
+            self.positions[hedge] = (cefi, cefiExposure)
+            self.defi += defi - lastDefi + arbitraguer.defi_margin - self.margins.get(pToken, 0)
+            self.margins[pToken] = arbitraguer.defi_margin
+            self.cefi += cefi - lastCefi
+            if wallet is not None:
+                wallet = State.to_int(wallet)
+                self.cefi += wallet - self.wallets.get(arbitraguer.account, 0)
+                self.wallets[arbitraguer.account] = wallet
+            exposure = defiExposure - lastDefiExposure + cefiExposure - lastCefiExposure
+            self.hedges[hedge] = self.hedges.get(hedge, 0) + exposure
+            self.exposure += exposure
+
+
+    # a point per interval, samples within it overwrite the last point, the drawdown follows every sample
+    def sample(self):
+        with self.lock:
+            self._sample()
+
+
+    def _sample(self):
+        now = time.time()
+        if self.count == 0 or now - self.times[(self.count - 1) % self.size] >= self.interval:
+            self.count += 1
+        i = (self.count - 1) % self.size
+        total = (self.defi + self.cefi) / ONE
+        self.times[i] = now
+        self.totals[i] = total
+        self.defis[i] = self.defi / ONE
+        self.cefis[i] = self.cefi / ONE
+        self.exposures[i] = self.exposure / ONE
+        if self.peak is None or total > self.peak:
+            self.peak = total
+        self.drawdown = self.peak - total
+        self.maxDrawdown = max(self.maxDrawdown, self.drawdown)
+
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': self.times[(self.count - 1) % self.size] if self.count else None,
+                'defi': State.to_decimal(self.defi),
+                'cefi': State.to_decimal(self.cefi),
+                'total': State.to_decimal(self.defi + self.cefi),
+                'exposure': State.to_decimal(self.exposure),
+                'grossExposure': State.to_decimal(sum(abs(exposure) for exposure in self.hedges.values())),
+                'peak': self.peak,
+                'drawdown': self.drawdown,
+                'maxDrawdown': self.maxDrawdown
+            }
+
+
+    # points of the last seconds (all kept by default) in time order, as {column: [values]}
+    def series(self, seconds=None):
+        with self.lock:
+            n = min(self.count, self.size)
+            start = self.count - n
+            rows = [(start + k) % self.size for k in range(n)]
+            if seconds is not None:
+                since = time.time() - seconds
+                rows = [i for i in rows if self.times[i] >= since]
+            return {
+                'time': [self.times[i] for i in rows],
+                'total': [self.totals[i] for i in rows],
+                'defi': [self.defis[i] for i in rows],
+                'cefi': [self.cefis[i] for i in rows],
+                'exposure': [self.exposures[i] for i in rows]
+            }
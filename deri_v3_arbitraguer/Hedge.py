@@ -0,0 +1,118 @@
+from math import gcd
+import pyarrow as pa
+import pyarrow.compute as pc
+from State import ONE, truncate, div, round_lot
+
+
+# hedge decision logic of ArbitraguerV3, free of any I/O so that live trading and backtests share it
+# volumes are 18-decimal integers, lots are rounded toward zero as the Decimal '//' of the earlier version did
+# get_deltas evaluates all pairs at once in whole lots: pool, position and max volumes that are multiples of an even
+# lot are exact int64 counts of half-lots, so the defi leg is exact, and the cefi target in its own lots is the defi
+# volume in lots times the reduced ratio of the two lot sizes, pairs that do not fit are computed with the integers
+MAX_LOTS = 2**40
+MAX_RATIO = 2**20
+MASK = 2**64 - 1
+
+
+def get_defi_delta(pool_volume, defi_volume, max_volume, min_volume):
+    target = truncate(defi_volume - pool_volume, 2)
+    target = min(target, max_volume) if target >= 0 else max(target, -max_volume)
+    if target == 0:
+        delta = -defi_volume
+    elif target * defi_volume >= 0:
+        delta = round_lot(target - defi_volume, min_volume)
+    else:
+        delta = round_lot(target, min_volume) - defi_volume
+    if delta == 0 and pool_volume * defi_volume >= 0:
+        delta = -defi_volume
+    return target, delta
+
+
+def get_cefi_delta(defi_volume, cefi_volume, multiplier, min_volume):
+    target = round_lot(-div(defi_volume, multiplier), min_volume)
+    return target, target - cefi_volume
+
+
+# cefi lots per defi lot as the reduced numerator and denominator, None where the pair can not be computed in lots
+def _lot_ratio(min_volume, multiplier, cefi_min_volume):
+    if not 0 < min_volume < 2**62 or min_volume % 2 or multiplier <= 0 or cefi_min_volume <= 0: return None
+    numerator = min_volume * ONE
+    denominator = multiplier * cefi_min_volume
+    common = gcd(numerator, denominator)
+    if numerator // common >= MAX_RATIO or denominator // common >= 2**62: return None
+    return numerator // common, denominator // common
+
+
+# volumes as whole lots, found in floats and confirmed exactly on the low 64 bits,
+# |volume - count * lot| < 2**64 as |count| < MAX_LOTS and lot < 2**62, so equal low bits mean equal volumes
+def _lots(volumes, lotFloats, lotBits):
+    count = pc.round(pc.divide(pa.array([float(volume) for volume in volumes], pa.float64()), lotFloats))
+    valid = pc.less(pc.abs(count), MAX_LOTS)
+    count = pc.cast(pc.if_else(valid, count, 0.0), pa.int64())
+    bits = pa.array([volume & MASK for volume in volumes], pa.uint64())
+    return count, pc.and_(valid, pc.equal(pc.multiply(pc.cast(count, pa.uint64(), safe=False), lotBits), bits))
+
+
+# defi and cefi deltas of every pair as lists of ints, equal to those of get_defi_delta and get_cefi_delta,
+# the cefi leg is hedged against the defi volume after its delta
+def get_deltas(pool_volumes, defi_volumes, defi_max_volumes, defi_min_volumes, cefi_volumes, cefi_multipliers, cefi_min_volumes):
+    keys = list(zip(defi_min_volumes, cefi_multipliers, cefi_min_volumes))
+    ratios = {key: _lot_ratio(*key) for key in set(keys)}
+    positions = {key: i for i, key in enumerate(ratios)}
+    index = pa.array([positions[key] for key in keys], pa.int64())
+    lotBits = pc.take(pa.array([key[0] if ratio else 2 for key, ratio in ratios.items()], pa.uint64()), index)
+    lotFloats = pc.cast(lotBits, pa.float64(), safe=False)
+    numerator = pc.take(pa.array([ratio[0] if ratio else 0 for ratio in ratios.values()], pa.int64()), index)
+    denominator = pc.take(pa.array([ratio[1] if ratio else 1 for ratio in ratios.values()], pa.int64()), index)
+    pool, exact = _lots(pool_volumes, lotFloats, lotBits)
+    defi, defiExact = _lots(defi_volumes, lotFloats, lotBits)
+    maximum, maxExact = _lots(defi_max_volumes, lotFloats, lotBits)
+    exact = pc.and_(pc.and_(pc.and_(exact, defiExact), pc.and_(maxExact, pc.greater_equal(maximum, 0))), pc.not_equal(numerator, 0))
+
+    # in half-lots the target is defi - pool clamped to the max, the delta is then rounded back to whole lots
+    target = pc.subtract(defi, pool)
+    target = pc.if_else(
+        pc.greater_equal(target, 0), pc.min_element_wise(target, pc.multiply(maximum, 2)), pc.max_element_wise(target, pc.multiply(maximum, -2))
+    )
+    same = pc.greater_equal(pc.multiply(pc.sign(target), pc.sign(defi)), 0)
+    delta = pc.if_else(same, pc.divide(pc.subtract(target, pc.multiply(defi, 2)), 2), pc.subtract(pc.divide(target, 2), defi))
+    close = pc.or_(
+        pc.equal(target, 0), pc.and_(pc.equal(delta, 0), pc.greater_equal(pc.multiply(pc.sign(pool), pc.sign(defi)), 0))
+    )
+    delta = pc.if_else(close, pc.negate(defi), delta)
+    cefiTarget = pc.divide(pc.multiply(pc.negate(pc.add(defi, delta)), numerator), denominator)
+
+    defiDeltas = [count * lot for count, lot in zip(delta.to_pylist(), defi_min_volumes)]
+    cefiDeltas = [count * lot - volume for count, lot, volume in zip(cefiTarget.to_pylist(), cefi_min_volumes, cefi_volumes)]
+    for i in pc.indices_nonzero(pc.invert(exact)).to_pylist():
+        _, defiDeltas[i] = get_defi_delta(pool_volumes[i], defi_volumes[i], defi_max_volumes[i], defi_min_volumes[i])
+        _, cefiDeltas[i] = get_cefi_delta(defi_volumes[i] + defiDeltas[i], cefi_volumes[i], cefi_multipliers[i], cefi_min_volumes[i])
+    return defiDeltas, cefiDeltas
+
+
+
+
+if __name__ == '__main__':
+    import time
+    import random
+
+    n = 100000
+    pool_volumes = [random.randint(-100000, 100000) * 10**15 + random.choice((0,) * 9 + (random.randint(1, 10**15),)) for _ in range(n)]
+    defi_volumes = [random.randint(-50000, 50000) * 10**15 for _ in range(n)]
+    cefi_volumes = [random.choice((-volume, 0, random.randint(-50000, 50000) * 10**15)) for volume in defi_volumes]
+    max_volumes = [random.choice((40 * ONE, 10**6 * ONE)) for _ in range(n)]
+    multipliers = [random.choice((ONE, ONE // 10, 1000 * ONE)) for _ in range(n)]
+
+    start = time.perf_counter()
+    defi, cefi = get_deltas(pool_volumes, defi_volumes, max_volumes, [10**15] * n, cefi_volumes, multipliers, [10**15] * n)
+    batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = []
+    for i in range(n):
+        _, delta = get_defi_delta(pool_volumes[i], defi_volumes[i], max_volumes[i], 10**15)
+        _, cefiDelta = get_cefi_delta(defi_volumes[i] + delta, cefi_volumes[i], multipliers[i], 10**15)
+        results.append((delta, cefiDelta))
+    single = time.perf_counter() - start
+    assert results == list(zip(defi, cefi))
+    print(f'{n} pairs in {batch:.3f}s batched ({batch / n * 1e6:.2f}us per pair), {single:.3f}s one by one, results equal')
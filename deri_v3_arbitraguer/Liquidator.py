@@ -0,0 +1,228 @@
+import time
+import array
+import logging
+import traceback
+import pyarrow as pa
+import pyarrow.compute as pc
+from web3 import Web3
+from Preference import *
+import Chain
+import Oracle
+import Metrics
+import State
+
+
+# every trader of a pool, found from the pool's margin events and the events of its symbols indexed by pTokenId,
+# positions are kept as one float column per symbol and the terms fixed until a position changes as one more column,
+# each index price update recomputes the margin of all accounts in one vectorized pass over the columns,
+# the accounts below the maintenance margin are checked again with exact integers and liquidated without waiting
+# for each other's receipts
+#   dynamic margin  = margin + sum(volume * (price - cumulativeFundingPerVolume) - cost + volume * lastCumulativeFundingPerVolume)
+#   required margin = sum(|volume| * price * maintenanceMarginRatio)
+MARGIN_TOPICS = {
+    Web3.keccak(text='AddMargin(uint256,address,uint256,int256)').hex(),
+    Web3.keccak(text='RemoveMargin(uint256,address,uint256,int256)').hex()
+}
+
+
+def column(values, length):
+    return pa.Array.from_buffers(pa.float64(), length, [None, pa.py_buffer(values)])
+
+
+class Liquidator:
+
+    def __init__(self, details):
+        self.network = details['network']
+        self.poolAddress = details['poolAddress']
+        self.account = details['account']
+        self.private = details['private']
+        self.symbols = details['symbols']
+        self.oracleSymbols = details.get('oracleSymbols', [])
+        self.startBlock = details.get('startBlock', 0)
+
+        self.symbolManagerAddress = Chain.call(self.network, self.poolAddress, 'PoolImplementation', 'symbolManager', [])
+        self.symbolAddresses = Chain.batchCall(self.network, [
+            (self.symbolManagerAddress, 'SymbolManagerImplementation', 'symbols', [Chain.getId(symbol)]) for symbol in self.symbols
+        ])
+        self.maintenanceMarginRatios = Chain.batchCall(self.network, [
+            (address, 'SymbolImplementationFutures', 'maintenanceMarginRatio', []) for address in self.symbolAddresses
+        ])
+        if self.oracleSymbols:
+            Oracle.register(self.oracleSymbols)
+
+        self.pTokenIds = []
+        self.rows = {}
+        self.margins = []
+        self.positions = [[] for _ in self.symbols]
+        self.volumes = [array.array('d') for _ in self.symbols]
+        self.constants = array.array('d')
+        self.prices = [0] * len(self.symbols)
+        self.cumulativeFundingPerVolumes = [0] * len(self.symbols)
+
+        self.cursor = None
+        self.refreshed = 0
+        self.pending = {}
+
+
+    def add_rows(self, pTokenIds):
+        for pTokenId in pTokenIds:
+            if pTokenId in self.rows: continue
+            self.rows[pTokenId] = len(self.pTokenIds)
+            self.pTokenIds.append(pTokenId)
+            self.margins.append(0)
+            self.constants.append(0)
+            for positions, volumes in zip(self.positions, self.volumes):
+                positions.append((0, 0, 0))
+                volumes.append(0)
+
+
+    def set_row(self, row, margin, positions):
+        self.margins[row] = margin
+        constant = margin
+        for j, (volume, cost, lastCumulativeFundingPerVolume) in enumerate(positions):
+            self.positions[j][row] = (volume, cost, lastCumulativeFundingPerVolume)
+            self.volumes[j][row] = volume / ONE
+            constant += State.mul(volume, lastCumulativeFundingPerVolume) - cost
+        self.constants[row] = constant / ONE
+
+
+    # margin and positions of the accounts, LIQUIDATION_BATCH_SIZE accounts per batch, vault liquidity in a second one
+    def refresh(self, pTokenIds):
+        pTokenIds = list(pTokenIds)
+        self.add_rows(pTokenIds)
+        for start in range(0, len(pTokenIds), LIQUIDATION_BATCH_SIZE):
+            chunk = pTokenIds[start:start + LIQUIDATION_BATCH_SIZE]
+            calls = []
+            for pTokenId in chunk:
+                calls.append((self.poolAddress, 'PoolImplementation', 'tdInfos', [pTokenId]))
+                calls += [(address, 'SymbolImplementationFutures', 'positions', [pTokenId]) for address in self.symbolAddresses]
+            results = Chain.batchCall(self.network, calls)
+            width = len(self.symbolAddresses) + 1
+            tdInfos = [results[i * width] for i in range(len(chunk))]
+            vaults = sorted({vault for vault, _ in tdInfos if vault != ZERO_ADDRESS})
+            liquidities = dict(zip(vaults, Chain.batchCall(self.network, [
+                (vault, 'VaultImplementation', 'getVaultLiquidity', []) for vault in vaults
+            ])))
+            for i, pTokenId in enumerate(chunk):
+                vault, amountB0 = tdInfos[i]
+                self.set_row(self.rows[pTokenId], amountB0 + liquidities.get(vault, 0), results[i * width + 1:(i + 1) * width])
+
+
+    # accounts touched since the last sync, from logs of the pool and symbols with the pTokenId as first indexed topic
+    def sync(self):
+        block = Chain.getBlockNumber(self.network)
+        cursor = self.cursor if self.cursor is not None else self.startBlock - 1
+        addresses = [self.poolAddress] + list(self.symbolAddresses)
+        pools = {self.poolAddress.lower()}
+        touched = set()
+        while cursor < block:
+            toBlock = min(cursor + WATCH_MAX_BLOCKS, block)
+            for log in Chain.getLogs(self.network, addresses, cursor + 1, toBlock):
+                if len(log['topics']) < 2: continue
+                if log['address'].lower() in pools and log['topics'][0].hex() not in MARGIN_TOPICS: continue
+                touched.add(int(log['topics'][1].hex(), 16))
+            cursor = toBlock
+        self.cursor = block
+        if time.time() - self.refreshed >= LIQUIDATION_REFRESH_INTERVAL:
+            touched.update(self.pTokenIds)
+            self.refreshed = time.time()
+        if touched: self.refresh(touched)
+        return touched
+
+
+    def update_prices(self):
+        calls = []
+        for address in self.symbolAddresses:
+            calls.append((address, 'SymbolImplementationFutures', 'indexPrice', []))
+            calls.append((address, 'SymbolImplementationFutures', 'cumulativeFundingPerVolume', []))
+        results = Chain.batchCall(self.network, calls)
+        self.prices = results[0::2]
+        self.cumulativeFundingPerVolumes = results[1::2]
+
+
+    def is_liquidatable(self, row):
+        dynamic = self.margins[row]
+        required = 0
+        for j, (price, cumulativeFundingPerVolume, ratio) in enumerate(zip(self.prices, self.cumulativeFundingPerVolumes, self.maintenanceMarginRatios)):
+            volume, cost, lastCumulativeFundingPerVolume = self.positions[j][row]
+            dynamic += State.mul(volume, price) - cost - State.mul(cumulativeFundingPerVolume - lastCumulativeFundingPerVolume, volume)
+            required += State.mul(State.mul(abs(volume), price), ratio)
+        return dynamic < required
+
+
+    # accounts below the maintenance margin, the vectorized pass over-selects by LIQUIDATION_TOLERANCE
+    # for float rounding and the candidates are confirmed with the exact integer margins
+    def scan(self):
+        n = len(self.pTokenIds)
+        if n == 0: return []
+        dynamic = column(self.constants, n)
+        required = pa.scalar(0.0)
+        for volumes, price, cumulativeFundingPerVolume, ratio in zip(
+            self.volumes, self.prices, self.cumulativeFundingPerVolumes, self.maintenanceMarginRatios
+        ):
+            volume = column(volumes, n)
+            dynamic = pc.add(dynamic, pc.multiply(volume, (price - cumulativeFundingPerVolume) / ONE))
+            required = pc.add(required, pc.multiply(pc.abs(volume), price / ONE * ratio / ONE))
+        rows = pc.indices_nonzero(pc.less(dynamic, pc.multiply(required, 1 + LIQUIDATION_TOLERANCE))).to_pylist()
+        return [self.pTokenIds[row] for row in rows if self.is_liquidatable(row)]
+
+
+    def liquidate(self, pTokenIds):
+        submitted = []
+        for pTokenId in pTokenIds:
+            if pTokenId in self.pending: continue
+            try:
+                oracleSignatures = Oracle.getSignatures(self.oracleSymbols)
+                self.pending[pTokenId] = Chain.submit(
+                    self.network, self.poolAddress, 'PoolImplementation', 'liquidate', [pTokenId, oracleSignatures], self.account, self.private
+                )
+                submitted.append(pTokenId)
+                logging.info(f'(Liquidator) {self.network} pTokenId {pTokenId} submitted: {self.pending[pTokenId].txHash.hex()}')
+            except Exception as e:
+                logging.info(f'(Liquidator) {self.network} pTokenId {pTokenId} not submitted: {e}')
+        Metrics.count('liquidations_submitted', len(submitted), network=self.network)
+        return submitted
+
+
+    # liquidations mined since the last check, their accounts are read again
+    def collect(self):
+        done = [pTokenId for pTokenId, future in self.pending.items() if future.done()]
+        for pTokenId in done:
+            future = self.pending.pop(pTokenId)
+            try:
+                status = future.result().status
+            except Exception:
+                status = 0
+            logging.info(f'(Liquidator) {self.network} pTokenId {pTokenId} liquidation status: {status}')
+            Metrics.count('liquidations_confirmed', network=self.network, status=status)
+        if done: self.refresh(done)
+        return done
+
+
+    def check(self):
+        with Metrics.timer('liquidator_check', network=self.network):
+            self.collect()
+            self.sync()
+            self.update_prices()
+            with Metrics.timer('liquidator_scan', network=self.network):
+                candidates = self.scan()
+            return self.liquidate(candidates)
+
+
+
+
+if __name__ == '__main__':
+
+    if METRICS: Metrics.start()
+    liquidators = [Liquidator(details) for details in LIQUIDATORS]
+    blocks = {}
+    while True:
+        for liquidator in liquidators:
+            try:
+                head = Chain.getBlockNumber(liquidator.network)
+                if head != blocks.get(liquidator):
+                    blocks[liquidator] = head
+                    liquidator.check()
+            except Exception:
+                logging.error(f'(Liquidator) {liquidator.network} error: {traceback.format_exc()}')
+        time.sleep(WATCH_INTERVAL)
@@ -1,29 +1,58 @@
+import sys
 import time
+import signal
 import traceback
 from Preference import *
-from ArbitraguerV3 import ArbitraguerV3
+from ArbitraguerV3 import create_arbitraguers
+from Scheduler import Scheduler
+from Watcher import Watcher
+from Equity import Equity
+import Metrics
 
 
 if __name__ == '__main__':
 
-    arbitraguers = [ArbitraguerV3(details) for details in ARBITRAGUERS]
+    # stopping the service exits normally, so atexit handlers such as Recorder.close still run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
+    # the equity pages are served even with metrics off, /metrics is then empty
+    if METRICS: Metrics.start()
+    elif METRICS_PORT: Metrics.serve(METRICS_PORT)
+    arbitraguers = create_arbitraguers(ARBITRAGUERS)
+    scheduler = Scheduler(arbitraguers)
+    watcher = Watcher(arbitraguers) if CHECK_MODE == 'event' else None
+    equity = Equity(arbitraguers)
+    Metrics.addPage('/equity', equity.snapshot)
+    Metrics.addPage('/equity/series', lambda seconds=None: equity.series(float(seconds) if seconds else None))
+
+    last = 0
     while True:
 
         try:
-            defi_dynamic_equity = Decimal(0)
-            cefi_dynamic_equity = Decimal(0)
-
-            for arbitraguer in arbitraguers:
-                arbitraguer.check()
-                defi_dynamic_equity += arbitraguer.get_defi_pnl()
-
-            defi_dynamic_equity += arbitraguers[0].defi_margin
-            cefi_dynamic_equity = arbitraguers[0].get_cefi_dynamic_equity()
-
-            logging.info(f'====> Dynamic equity: Defi: {defi_dynamic_equity:.3f}, Cefi: {cefi_dynamic_equity:.3f}, Total: {defi_dynamic_equity + cefi_dynamic_equity:.3f}')
+            if time.time() - last >= CHECK_INTERVAL:
+                last = time.time()
+
+                results = scheduler.run()
+                for arbitraguer in arbitraguers:
+                    if not results[arbitraguer]:
+                        logging.info(f'====> Using last known state of {arbitraguer.defiSymbol}.{arbitraguer.cefiSymbol} for dynamic equity')
+
+                # kept up to date by every state refresh, sampled once the whole cycle is in, see Equity
+                equity.sample()
+                snapshot = equity.snapshot()
+                logging.info(f'====> Dynamic equity: Defi: {snapshot["defi"]:.3f}, Cefi: {snapshot["cefi"]:.3f}, Total: {snapshot["total"]:.3f}, '
+                             f'Exposure: {snapshot["exposure"]:.3f}, Drawdown: {snapshot["drawdown"]:.3f} (max {snapshot["maxDrawdown"]:.3f})')
+
+            elif watcher is not None:
+                changed = watcher.poll()
+                if changed:
+                    scheduler.run(changed, refresh=False)
+                    equity.sample()
 
         except Exception as e:
             logging.error(f'Arbitraguer error: {traceback.format_exc()}')
 
-        time.sleep(60)
+        if watcher is not None:
+            time.sleep(WATCH_INTERVAL)
+        else:
+            time.sleep(max(CHECK_INTERVAL - (time.time() - last), 0))
@@ -0,0 +1,180 @@
+import time
+import json
+import bisect
+import urllib.parse
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from Preference import *
+
+
+# latency histograms and counters keyed by metric name and labels, exposed in the prometheus text format
+# over http and / or dumped to the log as json, everything is a no-op while ENABLED is False
+ENABLED = METRICS
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HISTOGRAMS = {}
+COUNTERS = {}
+PAGES = {}
+LOCK = threading.Lock()
+
+
+class Timer:
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        observe(self.name, time.perf_counter() - self.start, error=type is not None, **self.labels)
+
+
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def timer(name, **labels):
+    return Timer(name, labels) if ENABLED else NULL_TIMER
+
+
+def observe(name, seconds, error=False, **labels):
+    if not ENABLED: return
+    key = (name, tuple(labels.items()))
+    with LOCK:
+        histogram = HISTOGRAMS.get(key)
+        if histogram is None:
+            histogram = HISTOGRAMS[key] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0, 'errors': 0}
+        histogram['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+        if error: histogram['errors'] += 1
+
+
+def count(name, value=1, **labels):
+    if not ENABLED: return
+    key = (name, tuple(labels.items()))
+    with LOCK:
+        COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+
+def reset():
+    with LOCK:
+        HISTOGRAMS.clear()
+        COUNTERS.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items: return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items) + '}'
+
+
+def render():
+    with LOCK:
+        histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in HISTOGRAMS.items()}
+        counters = dict(COUNTERS)
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {name}_seconds histogram')
+        for (key, labels), histogram in histograms.items():
+            if key != name: continue
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += value
+                lines.append(f'{name}_seconds_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_seconds_sum{_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{name}_seconds_count{_labels(labels)} {histogram["count"]}')
+        lines.append(f'# TYPE {name}_errors_total counter')
+        for (key, labels), histogram in histograms.items():
+            if key == name: lines.append(f'{name}_errors_total{_labels(labels)} {histogram["errors"]}')
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name}_total counter')
+        for (key, labels), value in counters.items():
+            if key == name: lines.append(f'{name}_total{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    with LOCK:
+        return {
+            'histograms': [
+                {'name': name, 'labels': dict(labels), 'count': value['count'], 'errors': value['errors'], 'sum': value['sum'],
+                 'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], value['buckets']))}
+                for (name, labels), value in HISTOGRAMS.items()
+            ],
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in COUNTERS.items()]
+        }
+
+
+# json served next to /metrics, page() is called on each request with the query parameters
+def addPage(path, page):
+    PAGES[path] = page
+
+
+def dump():
+    logging.info(f'(Metrics) {json.dumps(snapshot())}')
+
+
+def serve(port, host='127.0.0.1'):
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path in PAGES:
+                data = json.dumps(PAGES[url.path](**dict(urllib.parse.parse_qsl(url.query))), default=str).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            found = url.path == '/metrics'
+            data = render().encode() if found else b''
+            self.send_response(200 if found else 404)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def startDumps(interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            dump()
+    threading.Thread(target=run, daemon=True).start()
+
+
+# enables collection and starts the configured exporters, METRICS_PORT 0 disables http, METRICS_DUMP_INTERVAL 0 disables dumps
+def start(port=METRICS_PORT, interval=METRICS_DUMP_INTERVAL):
+    global ENABLED
+    ENABLED = True
+    if port: serve(port)
+    if interval: startDumps(interval)
@@ -0,0 +1,628 @@
+import json
+import time
+import base64
+import hashlib
+import threading
+import urllib.parse
+from decimal import Decimal
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import rlp
+import eth_abi
+from web3 import Web3
+from eth_account import Account
+from web3._utils.abi import get_abi_input_types, get_abi_output_types
+from Preference import *
+import Chain
+
+
+# local stand-ins for a deri v3 pool node and the binance futures rest api, so the arbitraguer can run
+# (and be benchmarked) without rpc endpoints or exchange keys, requests are counted per method / path
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+# the default listen backlog of 5 drops connections when many pairs connect at once, costing a 1s syn retransmit
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def getAddress(name):
+    return Web3.toChecksumAddress(Web3.keccak(text=f'Mock.{name}')[-20:])
+
+
+# websocket frames as in rfc 6455, unfragmented, masked only from the client
+def encodeFrame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        head = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        head = bytes([0x80 | opcode, 126]) + length.to_bytes(2, 'big')
+    else:
+        head = bytes([0x80 | opcode, 127]) + length.to_bytes(8, 'big')
+    return head + payload
+
+
+def readFrame(rfile):
+    head = rfile.read(2)
+    if len(head) < 2:
+        raise EOFError('websocket closed')
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(rfile.read(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(rfile.read(8), 'big')
+    mask = rfile.read(4) if head[1] & 0x80 else bytes(4)
+    payload = rfile.read(length)
+    return opcode, bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+
+class Server:
+
+    def __init__(self, latency=0, port=0):
+        self.latency = latency
+        self.port = port
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.counts = Counter()
+        self.httpd = None
+        self.url = None
+        self.sockets = []
+        self.socketLock = threading.Lock()
+
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, method):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if server.latency: time.sleep(server.latency)
+                with server.lock:
+                    server.requests += 1
+                status, data = server.handle(method, self.path, body)
+                data = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.headers.get('Upgrade', '').lower() == 'websocket':
+                    server.serve_websocket(self)
+                else:
+                    self._respond('GET')
+
+            def do_POST(self): self._respond('POST')
+            def do_PUT(self): self._respond('PUT')
+            def do_DELETE(self): self._respond('DELETE')
+
+        self.httpd = HTTPServer(('127.0.0.1', self.port), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        return self.url
+
+
+    def stop(self):
+        self.close_websockets()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+    # websocket connections on the same port, they receive whatever is pushed until either side closes
+    def serve_websocket(self, handler):
+        accept = base64.b64encode(hashlib.sha1((handler.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+        with self.socketLock:
+            handler.send_response(101)
+            handler.send_header('Upgrade', 'websocket')
+            handler.send_header('Connection', 'Upgrade')
+            handler.send_header('Sec-WebSocket-Accept', accept)
+            handler.end_headers()
+            self.sockets.append(handler)
+        handler.close_connection = True
+        try:
+            while True:
+                opcode, payload = readFrame(handler.rfile)
+                if opcode == 0x8:
+                    self._send(handler, 0x8, payload[:2])
+                    break
+                if opcode == 0x9:
+                    self._send(handler, 0xA, payload)
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self.socketLock:
+                if handler in self.sockets: self.sockets.remove(handler)
+
+
+    def _send(self, handler, opcode, payload):
+        with self.socketLock:
+            try:
+                handler.wfile.write(encodeFrame(opcode, payload))
+            except OSError:
+                pass
+
+
+    # a json message to every open websocket
+    def push(self, message):
+        data = json.dumps(message).encode()
+        with self.socketLock:
+            handlers = list(self.sockets)
+        for handler in handlers:
+            self._send(handler, 0x1, data)
+
+
+    def close_websockets(self):
+        with self.socketLock:
+            handlers = list(self.sockets)
+        for handler in handlers:
+            self._send(handler, 0x8, (1000).to_bytes(2, 'big'))
+
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = 0
+            self.counts = Counter()
+
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+
+
+
+class MockChain(Server):
+
+    ABI_NAMES = ['PoolImplementation', 'SymbolManagerImplementation', 'SymbolImplementationFutures', 'VaultImplementation', 'DToken']
+    TRADE_TOPIC = Web3.keccak(text='Trade(uint256,bytes32,int256,int256)').hex()
+    ADD_MARGIN_TOPIC = Web3.keccak(text='AddMargin(uint256,address,uint256,int256)').hex()
+    TRADE_GAS = 150000
+
+    def __init__(self, symbols, prices=None, chainId=1337, latency=0, port=0):
+        super().__init__(latency, port)
+        self.chainId = chainId
+
+        self.functions = {}
+        for abiName in self.ABI_NAMES:
+            self.functions[abiName] = {
+                Web3.keccak(text=f'{abi["name"]}({",".join(get_abi_input_types(abi))})')[:4].hex(): abi
+                for abi in Chain.getAbi(abiName) if abi['type'] == 'function'
+            }
+
+        self.pool = getAddress('PoolImplementation')
+        self.symbolManager = getAddress('SymbolManagerImplementation')
+        self.pToken = getAddress('DToken')
+        self.vault = getAddress('VaultImplementation')
+        self.contracts = {
+            self.pool.lower(): 'PoolImplementation',
+            self.symbolManager.lower(): 'SymbolManagerImplementation',
+            self.pToken.lower(): 'DToken',
+            self.vault.lower(): 'VaultImplementation'
+        }
+
+        self.symbols = {}
+        self.symbolIds = {}
+        self.symbolStates = {}
+        for symbol in symbols:
+            address = getAddress(f'SymbolImplementationFutures.{symbol}')
+            self.contracts[address.lower()] = 'SymbolImplementationFutures'
+            self.symbolIds[bytes(Web3.keccak(text=symbol))] = address
+            self.symbols[symbol] = {
+                'address': address,
+                'indexPrice': (prices or {}).get(symbol, 20000 * ONE),
+                'cumulativeFundingPerVolume': 0,
+                'netVolume': 0,
+                'netCost': 0,
+                'maintenanceMarginRatio': ONE // 20,
+                'positions': {}
+            }
+            self.symbolStates[address.lower()] = self.symbols[symbol]
+
+        self.tokenIds = {}
+        self.tdInfos = {}
+        self.vaultLiquidity = 0
+        self.nonces = {}
+        self.block = 1
+        self.logs = []
+        self.receipts = {}
+
+
+    def add_account(self, account, amountB0=0, vaultLiquidity=0):
+        with self.lock:
+            tokenId = self.tokenIds.setdefault(account.lower(), len(self.tokenIds) + 1)
+            self.tdInfos[tokenId] = [self.vault, amountB0]
+            self.vaultLiquidity += vaultLiquidity
+        return tokenId
+
+
+    # trader of the pool with a margin held in the pool only, positions: {symbol: (volume, cost)},
+    # logged like the pool and the symbols do, pTokenId first indexed topic
+    def add_trader(self, amountB0, positions):
+        with self.lock:
+            tokenId = len(self.tokenIds) + 1
+            self.tokenIds[getAddress(f'Trader.{tokenId}').lower()] = tokenId
+            self.tdInfos[tokenId] = [ZERO_ADDRESS, amountB0]
+            self._log(self.pool, [self.ADD_MARGIN_TOPIC, self._topic(tokenId), self._topic(0)], eth_abi.encode_abi(['uint256', 'int256'], [amountB0, amountB0]))
+            for symbol, (volume, cost) in positions.items():
+                state = self.symbols[symbol]
+                state['positions'][tokenId] = [volume, cost, state['cumulativeFundingPerVolume']]
+                state['netVolume'] += volume
+                state['netCost'] += cost
+                self._log(state['address'], [self.TRADE_TOPIC, self._topic(tokenId)], eth_abi.encode_abi(['int256'], [volume]))
+        return tokenId
+
+
+    def _topic(self, value):
+        return '0x' + value.to_bytes(32, 'big').hex()
+
+
+    def _log(self, address, topics, data=b''):
+        self.logs.append({
+            'address': address,
+            'topics': topics,
+            'data': '0x' + data.hex(),
+            'blockNumber': hex(self.block),
+            'blockHash': '0x' + self.block.to_bytes(32, 'big').hex(),
+            'transactionHash': '0x' + '00' * 32,
+            'transactionIndex': '0x0',
+            'logIndex': hex(len(self.logs)),
+            'removed': False
+        })
+        return self.logs[-1]
+
+
+    # volume traded by everyone else, mined in its own block with a trade log on the symbol
+    def move(self, symbol, volume):
+        with self.lock:
+            state = self.symbols[symbol]
+            state['netVolume'] += volume
+            state['netCost'] += volume * state['indexPrice'] // ONE
+            self.block += 1
+            self._log(state['address'], [self.TRADE_TOPIC], eth_abi.encode_abi(['int256'], [volume]))
+
+
+    def set_price(self, symbol, price):
+        with self.lock:
+            self.symbols[symbol]['indexPrice'] = price
+
+
+    def _state(self, address):
+        return self.symbolStates[address.lower()]
+
+
+    def _symbolManager(self, address):
+        return self.symbolManager
+
+    def _pToken(self, address):
+        return self.pToken
+
+    def _tdInfos(self, address, tokenId):
+        return self.tdInfos.get(tokenId, [ZERO_ADDRESS, 0])
+
+    def _symbols(self, address, symbolId):
+        return self.symbolIds.get(symbolId, ZERO_ADDRESS)
+
+    def _getTokenIdOf(self, address, account):
+        return self.tokenIds.get(account.lower(), 0)
+
+    def _getVaultLiquidity(self, address):
+        return self.vaultLiquidity
+
+    def _indexPrice(self, address):
+        return self._state(address)['indexPrice']
+
+    def _cumulativeFundingPerVolume(self, address):
+        return self._state(address)['cumulativeFundingPerVolume']
+
+    def _netVolume(self, address):
+        return self._state(address)['netVolume']
+
+    def _netCost(self, address):
+        return self._state(address)['netCost']
+
+    def _positions(self, address, tokenId):
+        return self._state(address)['positions'].get(tokenId, [0, 0, 0])
+
+    def _maintenanceMarginRatio(self, address):
+        return self._state(address)['maintenanceMarginRatio']
+
+
+    # fills at the index price, reverts like the pool when the price limit is crossed
+    def _trade(self, address, sender, symbolName, tradeVolume, priceLimit, oracleSignatures):
+        tokenId = self.tokenIds.get(sender.lower())
+        state = self.symbols.get(symbolName)
+        if tokenId is None or state is None:
+            return False
+        price = state['indexPrice']
+        if (tradeVolume > 0 and price > priceLimit) or (tradeVolume < 0 and price < priceLimit):
+            return False
+        cost = tradeVolume * price // ONE
+        volume, positionCost, _ = state['positions'].get(tokenId, [0, 0, 0])
+        state['positions'][tokenId] = [volume + tradeVolume, positionCost + cost, state['cumulativeFundingPerVolume']]
+        state['netVolume'] += tradeVolume
+        state['netCost'] += cost
+        return True
+
+
+    # closes every position of an account below the maintenance margin, margin held in the pool only
+    def _liquidate(self, address, sender, tokenId, oracleSignatures):
+        _, dynamic = self.tdInfos.get(tokenId, [ZERO_ADDRESS, 0])
+        required = 0
+        for state in self.symbols.values():
+            volume, cost, lastCumulativeFundingPerVolume = state['positions'].get(tokenId, [0, 0, 0])
+            price = state['indexPrice']
+            dynamic += volume * price // ONE - cost - (state['cumulativeFundingPerVolume'] - lastCumulativeFundingPerVolume) * volume // ONE
+            required += abs(volume) * price // ONE * state['maintenanceMarginRatio'] // ONE
+        if dynamic >= required:
+            return False
+        for state in self.symbols.values():
+            volume, cost, _ = state['positions'].pop(tokenId, [0, 0, 0])
+            state['netVolume'] -= volume
+            state['netCost'] -= cost
+        self.tdInfos[tokenId] = [ZERO_ADDRESS, 0]
+        return True
+
+
+    def _function(self, to, data):
+        abiName = self.contracts.get((to or '').lower())
+        if abiName is None:
+            raise ValueError(f'No contract at {to}')
+        abi = self.functions[abiName].get(data[:10])
+        if abi is None:
+            raise ValueError(f'Unknown selector {data[:10]} on {abiName}')
+        return abi, eth_abi.decode_abi(get_abi_input_types(abi), bytes.fromhex(data[10:]))
+
+
+    def eth_call(self, tx, block='latest'):
+        abi, args = self._function(tx['to'], tx['data'])
+        result = getattr(self, f'_{abi["name"]}')(Web3.toChecksumAddress(tx['to']), *args)
+        types = get_abi_output_types(abi)
+        return '0x' + eth_abi.encode_abi(types, result if len(types) > 1 else [result]).hex()
+
+
+    def eth_estimateGas(self, tx, block='latest'):
+        self._function(tx['to'], tx['data'])
+        return hex(self.TRADE_GAS)
+
+
+    def eth_sendRawTransaction(self, raw):
+        raw = bytes.fromhex(raw[2:])
+        if raw[0] < 0x80:
+            chainId, nonce, _, _, gas, to, _, data = rlp.decode(raw[1:])[:8]
+        else:
+            nonce, _, gas, to, _, data = rlp.decode(raw)[:6]
+        sender = Account.recover_transaction(raw)
+        nonce = int.from_bytes(nonce, 'big')
+        if nonce != self.nonces.get(sender.lower(), 0):
+            raise ValueError(f'nonce {nonce} invalid for {sender}, expected {self.nonces.get(sender.lower(), 0)}')
+        self.nonces[sender.lower()] = nonce + 1
+
+        to = Web3.toChecksumAddress(to)
+        abi, args = self._function(to, '0x' + bytes(data).hex())
+        if abi['name'] not in ('trade', 'liquidate'):
+            raise ValueError(f'Unsupported transaction {abi["name"]}')
+        self.block += 1
+        txHash = Web3.keccak(raw).hex()
+        logs = []
+        if abi['name'] == 'trade':
+            status = self._trade(to, sender, *args)
+            if status:
+                tokenId = self.tokenIds[sender.lower()]
+                logs.append(self._log(self.symbols[args[0]]['address'], [self.TRADE_TOPIC, self._topic(tokenId)], eth_abi.encode_abi(['int256'], [args[1]])))
+        else:
+            positions = {symbol: state['positions'].get(args[0]) for symbol, state in self.symbols.items()}
+            status = self._liquidate(to, sender, *args)
+            if status:
+                for symbol, position in positions.items():
+                    if position is not None and position[0] != 0:
+                        logs.append(self._log(self.symbols[symbol]['address'], [self.TRADE_TOPIC, self._topic(args[0])], eth_abi.encode_abi(['int256'], [-position[0]])))
+        for log in logs:
+            log['transactionHash'] = txHash
+        self.receipts[txHash] = {
+            'transactionHash': txHash,
+            'transactionIndex': '0x0',
+            'blockHash': '0x' + self.block.to_bytes(32, 'big').hex(),
+            'blockNumber': hex(self.block),
+            'from': sender,
+            'to': to,
+            'cumulativeGasUsed': hex(self.TRADE_GAS),
+            'gasUsed': hex(self.TRADE_GAS),
+            'effectiveGasPrice': hex(10**9),
+            'contractAddress': None,
+            'logs': logs,
+            'logsBloom': '0x' + '00' * 256,
+            'status': '0x1' if status else '0x0',
+            'type': '0x2' if raw[0] == 2 else '0x0'
+        }
+        return txHash
+
+
+    def eth_getTransactionReceipt(self, txHash):
+        return self.receipts.get(txHash)
+
+
+    # stand-in runtime code, the abi name of the contract, so code hashes differ per contract kind
+    def eth_getCode(self, address, block='latest'):
+        abiName = self.contracts.get(address.lower())
+        return '0x' + abiName.encode().hex() if abiName else '0x'
+
+
+    def eth_getTransactionCount(self, account, block='latest'):
+        return hex(self.nonces.get(account.lower(), 0))
+
+
+    def eth_getLogs(self, filter):
+        addresses = filter.get('address') or []
+        addresses = {address.lower() for address in ([addresses] if isinstance(addresses, str) else addresses)}
+        fromBlock = int(filter.get('fromBlock', '0x0'), 16)
+        toBlock = self.block if filter.get('toBlock', 'latest') == 'latest' else int(filter['toBlock'], 16)
+        return [
+            log for log in self.logs
+            if fromBlock <= int(log['blockNumber'], 16) <= toBlock and (not addresses or log['address'].lower() in addresses)
+        ]
+
+
+    def eth_feeHistory(self, blocks, newest, percentiles):
+        blocks = int(blocks, 16) if isinstance(blocks, str) else blocks
+        return {
+            'oldestBlock': hex(max(self.block - blocks + 1, 0)),
+            'baseFeePerGas': [hex(10**9)] * (blocks + 1),
+            'gasUsedRatio': [0.5] * blocks,
+            'reward': [[hex(10**9)] * len(percentiles)] * blocks
+        }
+
+
+    def eth_getBlockByNumber(self, block, full=False):
+        number = self.block if block in ('latest', 'pending') else int(block, 16)
+        zero = '0x' + '00' * 32
+        return {
+            'number': hex(number), 'hash': '0x' + number.to_bytes(32, 'big').hex(), 'parentHash': zero,
+            'nonce': '0x' + '00' * 8, 'sha3Uncles': zero, 'logsBloom': '0x' + '00' * 256, 'transactionsRoot': zero,
+            'stateRoot': zero, 'receiptsRoot': zero, 'miner': ZERO_ADDRESS, 'difficulty': '0x0', 'totalDifficulty': '0x0',
+            'extraData': '0x', 'size': '0x0', 'gasLimit': hex(30000000), 'gasUsed': '0x0', 'timestamp': hex(int(time.time())),
+            'transactions': [], 'uncles': [], 'baseFeePerGas': hex(10**9), 'mixHash': zero
+        }
+
+
+    def eth_blockNumber(self):
+        return hex(self.block)
+
+    def eth_chainId(self):
+        return hex(self.chainId)
+
+    def net_version(self):
+        return str(self.chainId)
+
+    def eth_gasPrice(self):
+        return hex(10**9)
+
+    def eth_maxPriorityFeePerGas(self):
+        return hex(10**9)
+
+
+    def _request(self, request):
+        method = request.get('method')
+        with self.lock:
+            self.counts[method] += 1
+            try:
+                if not method or method.startswith('_') or not hasattr(self, method):
+                    return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32601, 'message': f'Method {method} not found'}}
+                return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': getattr(self, method)(*request.get('params', []))}
+            except Exception as e:
+                return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32000, 'message': str(e)}}
+
+
+    def handle(self, method, path, body):
+        request = json.loads(body)
+        if isinstance(request, list):
+            return 200, [self._request(item) for item in request]
+        return 200, self._request(request)
+
+
+
+
+# market orders fill immediately at the symbol price, positions are one way (BOTH),
+# fills are pushed to the user data stream (ws://.../ws/<listenKey>) as an ACCOUNT_UPDATE and an ORDER_TRADE_UPDATE
+class MockBinance(Server):
+
+    def __init__(self, prices=None, balance=Decimal(100000), fee_ratio=Decimal('0.0004'), latency=0, port=0):
+        super().__init__(latency, port)
+        self.prices = dict(prices or {})
+        self.balance = balance
+        self.fee_ratio = fee_ratio
+
+        self.positions = {}
+        self.orderId = 0
+
+
+    def set_price(self, symbol, price):
+        with self.lock:
+            self.prices[symbol] = price
+
+
+    def _position(self, symbol):
+        volume, cost = self.positions.get(symbol, (Decimal(0), Decimal(0)))
+        return {
+            'symbol': symbol,
+            'positionAmt': str(volume),
+            'entryPrice': str(cost / volume if volume else Decimal(0)),
+            'markPrice': str(self.prices.get(symbol, Decimal(0))),
+            'unRealizedProfit': str(volume * self.prices.get(symbol, Decimal(0)) - cost),
+            'positionSide': 'BOTH'
+        }
+
+
+    def _unrealized(self):
+        return sum((volume * self.prices.get(symbol, Decimal(0)) - cost for symbol, (volume, cost) in self.positions.items()), Decimal(0))
+
+
+    def _order(self, params):
+        symbol = params['symbol']
+        if params.get('type') != 'MARKET' or symbol not in self.prices:
+            return 400, {'code': -1100, 'msg': f'Unsupported order {params}'}
+        quantity = Decimal(params['quantity'])
+        delta = quantity if params['side'] == 'BUY' else -quantity
+        price = self.prices[symbol]
+        volume, cost = self.positions.get(symbol, (Decimal(0), Decimal(0)))
+        if volume * delta < 0:
+            closed = min(abs(delta), abs(volume)) * (1 if volume > 0 else -1)
+            closedCost = cost * closed / volume
+            self.balance += closed * price - closedCost
+            volume, cost, delta = volume - closed, cost - closedCost, delta + closed
+        self.positions[symbol] = (volume + delta, cost + delta * price)
+        self.balance -= quantity * price * self.fee_ratio
+        self.orderId += 1
+        now = int(time.time() * 1000)
+        position = self._position(symbol)
+        self.push({'e': 'ACCOUNT_UPDATE', 'E': now, 'T': now, 'a': {
+            'm': 'ORDER',
+            'B': [{'a': 'USDT', 'wb': str(self.balance), 'cw': str(self.balance)}],
+            'P': [{'s': symbol, 'pa': position['positionAmt'], 'ep': position['entryPrice'], 'ps': 'BOTH'}]
+        }})
+        self.push({'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now, 'o': {
+            's': symbol, 'i': self.orderId, 'S': params['side'], 'o': 'MARKET', 'q': str(quantity), 'x': 'TRADE', 'X': 'FILLED',
+            'l': str(quantity), 'z': str(quantity), 'L': str(price), 'ap': str(price), 'T': now
+        }})
+        return 200, {
+            'orderId': self.orderId, 'symbol': symbol, 'status': 'FILLED', 'side': params['side'], 'type': 'MARKET',
+            'origQty': str(quantity), 'executedQty': str(quantity), 'avgPrice': str(price), 'updateTime': now
+        }
+
+
+    # binance sends this when a listen key was not kept alive, the client has to reconnect with a new one
+    def expire_listen_key(self):
+        self.push({'e': 'listenKeyExpired', 'E': int(time.time() * 1000)})
+
+
+    def handle(self, method, path, body):
+        url = urllib.parse.urlparse(path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if body: params.update(urllib.parse.parse_qsl(body.decode()))
+        with self.lock:
+            self.counts[f'{method} {url.path}'] += 1
+            if (method, url.path) == ('GET', '/fapi/v2/balance'):
+                status, data = 200, [{'asset': 'USDT', 'balance': str(self.balance), 'crossUnPnl': str(self._unrealized())}]
+            elif (method, url.path) == ('GET', '/fapi/v2/positionRisk'):
+                symbols = [params['symbol']] if 'symbol' in params else list(self.prices)
+                status, data = 200, [self._position(symbol) for symbol in symbols]
+            elif (method, url.path) == ('GET', '/fapi/v2/account'):
+                status, data = 200, {
+                    'assets': [{'asset': 'USDT', 'walletBalance': str(self.balance), 'crossUnPnl': str(self._unrealized())}],
+                    'positions': [self._position(symbol) for symbol in self.prices]
+                }
+            elif (method, url.path) == ('POST', '/fapi/v1/order'):
+                status, data = self._order(params)
+            elif url.path == '/fapi/v1/listenKey':
+                status, data = 200, {'listenKey': 'mock'} if method == 'POST' else {}
+            else:
+                status, data = 404, {'code': -1, 'msg': f'Unknown endpoint {method} {url.path}'}
+        return status, data
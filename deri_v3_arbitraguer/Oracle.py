@@ -0,0 +1,87 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from web3 import Web3
+from Preference import *
+import Chain
+import Metrics
+
+
+# signed prices of the oracle symbols traded, refreshed in the background every ORACLE_REFRESH_INTERVAL,
+# all symbols fetched concurrently, the freshest signature of each one is kept with the time the pool stops accepting it
+# so trades are built without waiting on the oracle server, a symbol without a usable signature is fetched on demand
+SESSION = Chain.getSession()
+EXECUTOR = ThreadPoolExecutor(max_workers=ORACLE_WORKERS)
+
+SIGNATURES = {}
+SYMBOLS = set()
+LOCK = threading.Lock()
+THREAD = None
+
+
+# [oracleSymbolId, timestamp, value, v, r, s] as the pool's oracleSignatures expect,
+# the symbol id is keccak(symbol) unless the server sends it
+def fetch(symbol):
+    with Metrics.timer('oracle_request', symbol=symbol):
+        res = SESSION.get(ORACLE_URL.format(symbol=symbol), timeout=RPC_TIMEOUT)
+        res.raise_for_status()
+        data = res.json()
+    symbolId = data['oracleSymbolId'] if 'oracleSymbolId' in data else Web3.keccak(text=symbol).hex()
+    return [symbolId, int(data['timestamp']), int(data['price']), Web3.toInt(hexstr=data['v']), data['r'], data['s']]
+
+
+def store(symbol, signature):
+    with LOCK:
+        current = SIGNATURES.get(symbol)
+        if current is None or signature[1] > current[1]:
+            SIGNATURES[symbol] = signature
+
+
+def valid(signature):
+    return signature is not None and signature[1] + ORACLE_SIGNATURE_TTL - ORACLE_MARGIN > time.time()
+
+
+def refresh(symbols):
+    def update(symbol):
+        try:
+            store(symbol, fetch(symbol))
+        except Exception as e:
+            logging.info(f'(Oracle) {symbol} signature unavailable: {e}')
+    list(EXECUTOR.map(update, symbols))
+
+
+def register(symbols):
+    global THREAD
+    with LOCK:
+        new = set(symbols) - SYMBOLS
+        SYMBOLS.update(new)
+        start = THREAD is None and bool(SYMBOLS)
+        if start:
+            THREAD = threading.Thread(target=run, daemon=True)
+    if new: refresh(new)
+    if start: THREAD.start()
+
+
+def run():
+    while True:
+        time.sleep(ORACLE_REFRESH_INTERVAL)
+        with LOCK:
+            symbols = list(SYMBOLS)
+        refresh(symbols)
+
+
+# signatures of the symbols for a transaction, symbols without a valid prefetched one are fetched concurrently first
+def getSignatures(symbols):
+    if not symbols: return []
+    with LOCK:
+        missing = [symbol for symbol in symbols if not valid(SIGNATURES.get(symbol))]
+    if missing:
+        Metrics.count('oracle_miss', len(missing))
+        refresh(missing)
+    with LOCK:
+        signatures = [SIGNATURES.get(symbol) for symbol in symbols]
+    for symbol, signature in zip(symbols, signatures):
+        if not valid(signature):
+            raise ValueError(f'(Oracle) no valid signature for {symbol}')
+    return signatures
@@ -16,6 +16,12 @@ logging.basicConfig(
 DIR_ABIS = 'Abis'
 os.makedirs(DIR_ABIS, exist_ok=True)
 
+DIR_CACHE = 'Cache'
+os.makedirs(DIR_CACHE, exist_ok=True)
+
+RECORD = True
+DIR_RECORDS = 'Records'
+
 ONE = 10**18
 ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
 
@@ -25,6 +31,61 @@ RPCS = {
     ]
 }
 
+MULTICALLS = {
+    'bsc': ''
+}
+
+RPC_TIMEOUT = 10
+RPC_POOL_SIZE = 16
+
+RPC_EWMA_ALPHA = 0.2
+RPC_ERROR_PENALTY = 10
+RPC_LAG_PENALTY = 0.5
+RPC_BREAKER_FAILURES = 3
+RPC_BREAKER_TIMEOUT = 30
+RPC_PROBE_INTERVAL = 10
+RPC_HEDGE = False
+RPC_HEDGE_PERCENTILE = 0.9
+
+CHECK_INTERVAL = 60
+CHECK_TIMEOUT = 30
+CHECK_WORKERS = 0
+
+CHECK_MODE = 'poll'
+WATCH_INTERVAL = 3
+WATCH_MAX_BLOCKS = 5000
+
+LIQUIDATION_BATCH_SIZE = 200
+LIQUIDATION_TOLERANCE = 0.001
+LIQUIDATION_REFRESH_INTERVAL = 600
+
+ACCOUNT_TTL = 10
+
+# mark-to-market equity history of Main.py, points kept and seconds between them, in the cefi margin asset
+EQUITY_HISTORY_SIZE = 86400
+EQUITY_SAMPLE_INTERVAL = 1
+EQUITY_CURRENCY = 'USDT'
+
+# oracle server of the signed prices, {symbol} is replaced by the oracle symbol
+ORACLE_URL = ''
+ORACLE_WORKERS = 8
+ORACLE_REFRESH_INTERVAL = 5
+ORACLE_SIGNATURE_TTL = 60
+ORACLE_MARGIN = 15
+
+TX_POLL_INTERVAL = 1
+TX_REPLACE_TIMEOUT = 60
+TX_RECEIPT_TIMEOUT = 300
+
+FEE_TTL = 10
+FEE_HISTORY_BLOCKS = 20
+FEE_PERCENTILE = 50
+GAS_PROFILE_SIZE = 20
+
+METRICS = False
+METRICS_PORT = 9108
+METRICS_DUMP_INTERVAL = 0
+
 ARBITRAGUERS = [
     {
         'defiNetwork': '',
@@ -34,9 +95,11 @@ ARBITRAGUERS = [
         'defiSymbol': '',
         'defiMinVolume': ,
         'defiMaxVolume': ,
+        'defiOracleSymbols': [],
 
         'cefiExchange': '',
         'cefiUrl': '',
+        'cefiStreamUrl': '',
         'cefiKey': '',
         'cefiSecret': '',
         'cefiSymbol': '',
@@ -51,9 +114,11 @@ ARBITRAGUERS = [
         'defiSymbol': '',
         'defiMinVolume': ,
         'defiMaxVolume': ,
+        'defiOracleSymbols': [],
 
         'cefiExchange': '',
         'cefiUrl': '',
+        'cefiStreamUrl': '',
         'cefiKey': '',
         'cefiSecret': '',
         'cefiSymbol': '',
@@ -61,3 +126,7 @@ ARBITRAGUERS = [
         'cefiMinVolume': ,
     }
 ]
+
+# pools scanned by Liquidator.py, each
+# {'network': '', 'poolAddress': '', 'account': '', 'private': '', 'symbols': [], 'oracleSymbols': [], 'startBlock': 0}
+LIQUIDATORS = []
@@ -0,0 +1,156 @@
+import os
+import time
+import glob
+import atexit
+import logging
+import threading
+import traceback
+import pyarrow as pa
+import pyarrow.compute as pc
+from decimal import Decimal, Context
+
+
+VALUE = pa.decimal128(38, 18)
+QUANTUM = Decimal(1).scaleb(-18)
+CONTEXT = Context(prec=38)
+
+COLUMNS = {
+    'defi_symbol_state': ['price', 'cumulativeFundingPerVolume', 'netVolume', 'netCost'],
+    'defi_position': ['volume', 'cost', 'lastCumulativeFundingPerVolume'],
+    'defi_margin': ['margin'],
+    'cefi_position': ['volume', 'price'],
+    'hedge': ['delta', 'price']
+}
+SCHEMAS = {
+    table: pa.schema(
+        [('timestamp', pa.timestamp('ms')), ('pair', pa.string())] + [(column, VALUE) for column in columns]
+        + ([('venue', pa.string()), ('reference', pa.string())] if table == 'hedge' else [])
+    )
+    for table, columns in COLUMNS.items()
+}
+
+RECORDERS = {}
+LOCK = threading.Lock()
+
+
+def getRecorder(directory, segment_rows=100000, segment_seconds=86400, batch_rows=1000, flush_seconds=60):
+    with LOCK:
+        if directory not in RECORDERS:
+            RECORDERS[directory] = Recorder(directory, segment_rows, segment_seconds, batch_rows, flush_seconds)
+        return RECORDERS[directory]
+
+
+# append only columnar store, each table is a directory of arrow ipc stream segments named by their first timestamp
+# rows are buffered and written as record batches, a segment is rotated after segment_rows rows or segment_seconds,
+# buffers are also written every flush_seconds by a background thread and when the process exits
+class Recorder:
+
+    def __init__(self, directory, segment_rows=100000, segment_seconds=86400, batch_rows=1000, flush_seconds=60):
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+
+        self.lock = threading.Lock()
+        self.buffers = {table: [] for table in SCHEMAS}
+        self.flushed = {table: time.time() for table in SCHEMAS}
+        self.writers = {}
+        for table in SCHEMAS:
+            os.makedirs(f'{self.directory}/{table}', exist_ok=True)
+
+        self.closed = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.close)
+
+
+    def _run(self):
+        while not self.closed.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception:
+                logging.error(f'(Recorder) flush error: {traceback.format_exc()}')
+
+
+    # int values are raw 18-decimal fixed point as State keeps them, others are units
+    def record(self, table, pair, values, venue=None, reference=None):
+        row = [int(time.time() * 1000), pair] + [
+            Decimal(value).scaleb(-18, CONTEXT) if isinstance(value, int) else Decimal(value).quantize(QUANTUM, context=CONTEXT)
+            for value in values
+        ]
+        if table == 'hedge':
+            row += [venue, reference]
+        with self.lock:
+            self.buffers[table].append(row)
+            if len(self.buffers[table]) >= self.batch_rows or time.time() - self.flushed[table] >= self.flush_seconds:
+                self._flush(table)
+
+
+    def _writer(self, table, timestamp):
+        writer = self.writers.get(table)
+        if writer is not None and (writer['rows'] >= self.segment_rows or timestamp - writer['start'] >= self.segment_seconds * 1000):
+            writer['writer'].close()
+            writer['sink'].close()
+            writer = None
+        if writer is None:
+            sink = pa.OSFile(f'{self.directory}/{table}/{timestamp}.arrows', 'wb')
+            writer = {'sink': sink, 'writer': pa.ipc.new_stream(sink, SCHEMAS[table]), 'start': timestamp, 'rows': 0}
+            self.writers[table] = writer
+        return writer
+
+
+    def _flush(self, table):
+        rows = self.buffers[table]
+        self.flushed[table] = time.time()
+        if not rows: return
+        schema = SCHEMAS[table]
+        batch = pa.record_batch([pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)], schema=schema)
+        writer = self._writer(table, rows[0][0])
+        writer['writer'].write_batch(batch)
+        writer['sink'].flush()
+        writer['rows'] += len(rows)
+        self.buffers[table] = []
+
+
+    def flush(self):
+        with self.lock:
+            for table in SCHEMAS:
+                self._flush(table)
+
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            for table in SCHEMAS:
+                self._flush(table)
+            for writer in self.writers.values():
+                writer['writer'].close()
+                writer['sink'].close()
+            self.writers = {}
+
+
+    # rows of table with start <= timestamp < end (epoch seconds), segments are memory mapped and skipped by name
+    def query(self, table, start=0, end=None, pair=None):
+        self.flush()
+        start_ms = int(start * 1000)
+        end_ms = int(end * 1000) if end is not None else None
+        segments = sorted(
+            (int(os.path.basename(path).split('.')[0]), path) for path in glob.glob(f'{self.directory}/{table}/*.arrows')
+        )
+        batches = []
+        for i, (first, path) in enumerate(segments):
+            following = segments[i + 1][0] if i + 1 < len(segments) else None
+            if (end_ms is not None and first >= end_ms) or (following is not None and following <= start_ms):
+                continue
+            try:
+                for batch in pa.ipc.open_stream(pa.memory_map(path)):
+                    batches.append(batch)
+            except pa.ArrowInvalid:
+                pass
+        result = pa.Table.from_batches(batches, schema=SCHEMAS[table])
+        mask = pc.greater_equal(result['timestamp'], pa.scalar(start_ms, pa.timestamp('ms')))
+        if end_ms is not None:
+            mask = pc.and_(mask, pc.less(result['timestamp'], pa.scalar(end_ms, pa.timestamp('ms'))))
+        if pair is not None:
+            mask = pc.and_(mask, pc.equal(result['pair'], pair))
+        return result.filter(mask)
@@ -8,6 +8,7 @@ import threading
 import logging
 import traceback
 from decimal import Decimal
+import Metrics
 
 
 class Rest:
@@ -34,21 +35,27 @@ class Rest:
         return hmac.new(self.secret.encode(), message.encode(), hashlib.sha256).hexdigest()
 
 
-    def _http_request(self, method, path, **kwargs):
+    def _http_request(self, method, path, signed=True, **kwargs):
         headers = {}
         params = {key: value for key, value in kwargs.items() if value is not None}
         if self.authen:
-            params['timestamp'] = int(time.time() * 1000)
-            params['signature'] = self._sign(params)
+            if signed:
+                params['timestamp'] = int(time.time() * 1000)
+                params['signature'] = self._sign(params)
             headers = {'X-MBX-APIKEY': self.key}
+        start = time.perf_counter()
+        error = True
         try:
             res = self.methods[method.upper()](self.url + path, params=params, headers=headers, timeout=self.timeout)
             if res.status_code // 2 == 100:
+                error = False
                 return res.json()
             else:
                 logging.error(f'({self.name}) {method} {path} ({kwargs}) invalid response: {res.text}')
         except:
             logging.error(f'({self.name}) {method} {path} ({kwargs}) error: {traceback.format_exc()}')
+        finally:
+            Metrics.observe('binance_request', time.perf_counter() - start, error=error, method=method.upper(), path=path)
 
 
     def get_balance(self, currency='USDT'):
@@ -58,6 +65,10 @@ class Rest:
                 return Decimal(item['balance']) + Decimal(item['crossUnPnl'])
 
 
+    def get_account(self):
+        return self._http_request('GET', '/fapi/v2/account')
+
+
     def get_position(self, symbol='BTCUSDT'):
         data = self._http_request('GET', '/fapi/v2/positionRisk', symbol=symbol)[0]
         return {
@@ -67,6 +78,14 @@ class Rest:
         }
 
 
+    def create_listen_key(self):
+        return self._http_request('POST', '/fapi/v1/listenKey', signed=False)
+
+
+    def keepalive_listen_key(self):
+        return self._http_request('PUT', '/fapi/v1/listenKey', signed=False)
+
+
     def place_order(self, symbol, side, amount, order_type, price=None):
         return self._http_request(
             'POST',
@@ -0,0 +1,152 @@
+import time
+import hmac
+import urllib
+import asyncio
+import hashlib
+import aiohttp
+import logging
+from decimal import Decimal
+import Metrics
+
+
+# request weight of the endpoints used, https://binance-docs.github.io/apidocs/futures/en/
+WEIGHTS = {
+    '/fapi/v2/balance': 5,
+    '/fapi/v2/positionRisk': 5,
+    '/fapi/v2/account': 5,
+    '/fapi/v1/order': 1
+}
+
+
+class Rest:
+
+    def __init__(self, url, key=None, secret=None, timeout=5, connections=20, weight_limit=2400, weight_ratio=0.8):
+        self.url = url
+        self.key = key
+        self.secret = secret
+        self.timeout = timeout
+        self.connections = connections
+        self.weight_limit = weight_limit
+        self.weight_ratio = weight_ratio
+
+        self.name = 'RestAsync.Binance'
+        self.authen = bool(self.key and self.secret)
+        self.hmac = hmac.new(self.secret.encode(), digestmod=hashlib.sha256) if self.authen else None
+        self.session = None
+        self.weight = 0
+        self.weight_minute = 0
+        self.lock = asyncio.Lock()
+
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self.session
+
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+    def _sign(self, params):
+        message = urllib.parse.urlencode(params)
+        signer = self.hmac.copy()
+        signer.update(message.encode())
+        return signer.hexdigest()
+
+
+    # binance counts weight per ip per minute, reserve the weight before sending and wait for the next minute
+    # when the budget (weight_limit * weight_ratio) would be exceeded, the wait does not hold the lock
+    async def _throttle(self, weight):
+        while True:
+            async with self.lock:
+                minute = int(time.time() // 60)
+                if minute != self.weight_minute:
+                    self.weight_minute = minute
+                    self.weight = 0
+                if self.weight + weight <= self.weight_limit * self.weight_ratio:
+                    self.weight += weight
+                    return
+                used = self.weight
+            delay = 60 - time.time() % 60
+            logging.info(f'({self.name}) used weight {used}, throttling for {delay:.3f}s')
+            await asyncio.sleep(delay)
+
+
+    def _update_weight(self, headers):
+        used = headers.get('X-MBX-USED-WEIGHT-1M') or headers.get('X-MBX-USED-WEIGHT')
+        if used is not None and int(time.time() // 60) == self.weight_minute:
+            self.weight = max(self.weight, int(used))
+
+
+    async def _http_request(self, method, path, **kwargs):
+        while True:
+            await self._throttle(WEIGHTS.get(path, 1))
+            headers = {}
+            # sent as strings, aiohttp would truncate Decimal values to integers
+            params = {key: str(value) for key, value in kwargs.items() if value is not None}
+            if self.authen:
+                params['timestamp'] = str(int(time.time() * 1000))
+                params['signature'] = self._sign(params)
+                headers = {'X-MBX-APIKEY': self.key}
+            session = await self._get_session()
+            with Metrics.timer('binance_request', method=method.upper(), path=path):
+                async with session.request(method.upper(), self.url + path, params=params, headers=headers) as res:
+                    self._update_weight(res.headers)
+                    if res.status // 2 == 100:
+                        return await res.json()
+                    text = await res.text()
+                if res.status not in (418, 429):
+                    logging.error(f'({self.name}) {method} {path} ({kwargs}) invalid response: {text}')
+                    raise ValueError(f'({self.name}) {method} {path} invalid response: {res.status} {text}')
+                self.weight = self.weight_limit
+                Metrics.count('binance_rate_limited', method=method.upper(), path=path)
+                retry = int(res.headers.get('Retry-After', 60 - time.time() % 60))
+                logging.error(f'({self.name}) {method} {path} rate limited, retry after {retry}s')
+            await asyncio.sleep(retry)
+
+
+    async def get_balance(self, currency='USDT'):
+        data = await self._http_request('GET', '/fapi/v2/balance')
+        for item in data:
+            if item['asset'] == currency:
+                return Decimal(item['balance']) + Decimal(item['crossUnPnl'])
+
+
+    async def get_position(self, symbol='BTCUSDT'):
+        data = (await self._http_request('GET', '/fapi/v2/positionRisk', symbol=symbol))[0]
+        return {
+            'symbol': data['symbol'],
+            'volume': Decimal(data['positionAmt']),
+            'price': Decimal(data['entryPrice'])
+        }
+
+
+    async def place_order(self, symbol, side, amount, order_type, price=None):
+        return await self._http_request(
+            'POST',
+            '/fapi/v1/order',
+            symbol=symbol,
+            side=side.upper(),
+            quantity=amount,
+            type=order_type.upper(),
+            price=price
+        )
+
+
+
+
+if __name__ == '__main__':
+    from Preference import *
+
+    async def main():
+        rest = Rest(ARBITRAGUERS[0]['cefiUrl'], ARBITRAGUERS[0]['cefiKey'], ARBITRAGUERS[0]['cefiSecret'])
+        data = await asyncio.gather(rest.get_balance(), *[rest.get_position(details['cefiSymbol']) for details in ARBITRAGUERS])
+        await rest.close()
+        return data
+
+    print(asyncio.run(main()))
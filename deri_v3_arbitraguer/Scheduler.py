@@ -0,0 +1,66 @@
+import time
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from Preference import *
+from ArbitraguerV3 import update_defi_states
+import Metrics
+import Chain
+
+
+class Scheduler:
+
+    def __init__(self, arbitraguers, workers=None, timeout=CHECK_TIMEOUT):
+        self.arbitraguers = arbitraguers
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers or CHECK_WORKERS or len(arbitraguers))
+        self.futures = {}
+
+
+    def _check(self, arbitraguer, update):
+        try:
+            arbitraguer.check(update=update)
+            return True
+        except Exception:
+            logging.error(f'Arbitraguer {arbitraguer.defiSymbol}.{arbitraguer.cefiSymbol} error: {traceback.format_exc()}')
+            return False
+
+
+    # checks the given arbitraguers (all by default) with their defi state refreshed in one batch, pinned to the head block,
+    # unless refresh is False
+    # returns {arbitraguer: True/False}, pairs that failed, timed out or are still busy from a previous run are False
+    def run(self, arbitraguers=None, refresh=True):
+        with Metrics.timer('scheduler_run', refresh=refresh):
+            return self._run(arbitraguers, refresh)
+
+
+    def _run(self, arbitraguers=None, refresh=True):
+        if arbitraguers is None: arbitraguers = self.arbitraguers
+        update = False
+        if refresh:
+            try:
+                for network in {arbitraguer.defiNetwork for arbitraguer in arbitraguers}:
+                    Chain.pinBlock(network)
+                update_defi_states(arbitraguers)
+            except Exception:
+                logging.error(f'Batch state update error, falling back to per pair updates: {traceback.format_exc()}')
+                update = True
+
+        results = {}
+        for arbitraguer in arbitraguers:
+            future = self.futures.get(arbitraguer)
+            if future is not None and not future.done():
+                logging.error(f'Arbitraguer {arbitraguer.defiSymbol}.{arbitraguer.cefiSymbol} still busy, skipped')
+                results[arbitraguer] = False
+                continue
+            self.futures[arbitraguer] = self.executor.submit(self._check, arbitraguer, update)
+
+        futures = {arbitraguer: self.futures[arbitraguer] for arbitraguer in arbitraguers if arbitraguer not in results}
+        wait(futures.values(), timeout=self.timeout)
+        for arbitraguer, future in futures.items():
+            if future.done():
+                results[arbitraguer] = future.result()
+            else:
+                logging.error(f'Arbitraguer {arbitraguer.defiSymbol}.{arbitraguer.cefiSymbol} timed out after {self.timeout}s')
+                results[arbitraguer] = False
+        return results
@@ -0,0 +1,78 @@
+from decimal import Decimal, Context
+from Preference import *
+
+
+# pool state as the contracts keep it, raw 18-decimal integers updated in place on each refresh,
+# arithmetic truncates toward zero as solidity does, Decimal is only built at the edges (config, logs, cefi orders)
+CONTEXT = Context(prec=78)
+
+
+def truncate(a, b):
+    return a // b if (a >= 0) == (b > 0) else -(-a // b)
+
+
+def mul(a, b):
+    return truncate(a * b, ONE)
+
+
+def div(a, b):
+    return truncate(a * ONE, b)
+
+
+def round_lot(volume, lot):
+    return truncate(volume, lot) * lot
+
+
+# units (Decimal, str or int) to 18 decimals, exact for up to 18 fractional digits
+def to_int(value):
+    return int(Decimal(value).scaleb(18, CONTEXT))
+
+
+def to_decimal(value):
+    return Decimal(value) / ONE
+
+
+class SymbolState:
+
+    __slots__ = ('price', 'cumulativeFundingPerVolume', 'netVolume', 'netCost')
+
+    def __init__(self, price=0, cumulativeFundingPerVolume=0, netVolume=0, netCost=0):
+        self.set(price, cumulativeFundingPerVolume, netVolume, netCost)
+
+
+    def set(self, price, cumulativeFundingPerVolume, netVolume, netCost):
+        self.price = price
+        self.cumulativeFundingPerVolume = cumulativeFundingPerVolume
+        self.netVolume = netVolume
+        self.netCost = netCost
+
+
+    def values(self):
+        return (self.price, self.cumulativeFundingPerVolume, self.netVolume, self.netCost)
+
+
+class Position:
+
+    __slots__ = ('volume', 'cost', 'lastCumulativeFundingPerVolume')
+
+    def __init__(self, volume=0, cost=0, lastCumulativeFundingPerVolume=0):
+        self.set(volume, cost, lastCumulativeFundingPerVolume)
+
+
+    def set(self, volume, cost, lastCumulativeFundingPerVolume):
+        self.volume = volume
+        self.cost = cost
+        self.lastCumulativeFundingPerVolume = lastCumulativeFundingPerVolume
+
+
+    def values(self):
+        return (self.volume, self.cost, self.lastCumulativeFundingPerVolume)
+
+
+    def get_pnl(self, state):
+        return mul(self.volume, state.price) - self.cost
+
+
+    # funding paid since the position last changed, positive is paid by the trader
+    def get_funding(self, state):
+        return mul(state.cumulativeFundingPerVolume - self.lastCumulativeFundingPerVolume, self.volume)
@@ -0,0 +1,141 @@
+import time
+import json
+import logging
+import threading
+import traceback
+import websocket
+from decimal import Decimal
+from collections import deque, OrderedDict
+
+
+FINAL_ORDER_STATUS = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED')
+
+
+# starts at most one user data stream per account
+def startStream(account, url):
+    if account.stream is None:
+        account.stream = Stream(account, url)
+        account.stream.start()
+    return account.stream
+
+
+class Stream:
+
+    def __init__(self, account, url, keepalive=1800, reconnect=5):
+        self.account = account
+        self.rest = account.rest
+        self.url = url
+        self.keepalive = keepalive
+        self.reconnect = reconnect
+
+        self.name = 'Stream.Binance'
+        self.ws = None
+        self.running = False
+        self.live = False
+        self.condition = threading.Condition()
+        self.orders = OrderedDict()
+        self.fills = deque(maxlen=1000)
+        self.account_update_time = 0
+
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        threading.Thread(target=self._keepalive, daemon=True).start()
+
+
+    def stop(self):
+        self.running = False
+        if self.ws is not None: self.ws.close()
+
+
+    def _run(self):
+        while self.running:
+            try:
+                listen_key = self.rest.create_listen_key()['listenKey']
+                self.ws = websocket.WebSocketApp(
+                    f'{self.url}/ws/{listen_key}',
+                    on_open=self._on_open,
+                    on_message=self._on_message,
+                    on_error=lambda ws, error: logging.error(f'({self.name}) error: {error}'),
+                )
+                self.ws.run_forever(ping_interval=60, ping_timeout=10)
+            except Exception:
+                logging.error(f'({self.name}) error: {traceback.format_exc()}')
+            self._set_live(False)
+            if self.running:
+                logging.info(f'({self.name}) disconnected, reconnecting in {self.reconnect}s')
+                time.sleep(self.reconnect)
+
+
+    def _keepalive(self):
+        while self.running:
+            time.sleep(self.keepalive)
+            if self.live: self.rest.keepalive_listen_key()
+
+
+    def _set_live(self, live):
+        with self.condition:
+            self.live = live
+            self.account.live = live
+            self.condition.notify_all()
+
+
+    # events missed while disconnected are replayed through a rest snapshot, taken once the stream is open
+    def _on_open(self, ws):
+        try:
+            with self.account.lock:
+                self.account.refresh()
+            self._set_live(True)
+            logging.info(f'({self.name}) connected')
+        except Exception:
+            logging.error(f'({self.name}) snapshot error: {traceback.format_exc()}')
+            ws.close()
+
+
+    def _on_message(self, ws, message):
+        event = json.loads(message)
+        if event.get('e') == 'ACCOUNT_UPDATE':
+            self.account.apply_account_update(event['a'])
+            with self.condition:
+                self.account_update_time = max(self.account_update_time, event['T'])
+                self.condition.notify_all()
+        elif event.get('e') == 'ORDER_TRADE_UPDATE':
+            order = event['o']
+            with self.condition:
+                self.orders[order['i']] = order
+                while len(self.orders) > 1000: self.orders.popitem(last=False)
+                if order['x'] == 'TRADE':
+                    self.fills.append({
+                        'symbol': order['s'],
+                        'orderId': order['i'],
+                        'side': order['S'],
+                        'volume': Decimal(order['l']),
+                        'price': Decimal(order['L']),
+                        'time': order['T']
+                    })
+                self.condition.notify_all()
+        elif event.get('e') == 'listenKeyExpired':
+            logging.info(f'({self.name}) listen key expired')
+            ws.close()
+
+
+    # waits until the order reached a final status and the account update of its last trade arrived
+    def wait_order(self, order_id, timeout=5):
+        def done():
+            order = self.orders.get(order_id)
+            return not self.live or (
+                order is not None and order['X'] in FINAL_ORDER_STATUS
+                and (Decimal(order['z']) == 0 or self.account_update_time >= order['T'])
+            )
+        with self.condition:
+            result = self.condition.wait_for(done, timeout) and self.live
+            self.orders.pop(order_id, None)
+        return result
+
+
+    def pop_fills(self):
+        with self.condition:
+            fills = list(self.fills)
+            self.fills.clear()
+        return fills
@@ -0,0 +1,48 @@
+import logging
+from Preference import *
+from ArbitraguerV3 import update_defi_states
+import State
+import Chain
+
+
+class Watcher:
+
+    def __init__(self, arbitraguers, maxBlocks=WATCH_MAX_BLOCKS):
+        self.arbitraguers = arbitraguers
+        self.maxBlocks = maxBlocks
+        self.cursors = {}
+
+
+    # scans the logs of the watched pools since the last poll with a block cursor,
+    # returns the arbitraguers whose pool net volume changed, with their defi state already refreshed at the pinned head
+    def poll(self):
+        networks = {}
+        for arbitraguer in self.arbitraguers:
+            networks.setdefault(arbitraguer.defiNetwork, []).append(arbitraguer)
+
+        changed = []
+        for network, group in networks.items():
+            block = Chain.pinBlock(network)
+            cursor = self.cursors.get(network)
+            if cursor is None or block <= cursor:
+                self.cursors.setdefault(network, block)
+                continue
+
+            if block - cursor > self.maxBlocks:
+                logging.info(f'(Watcher) {network} cursor {cursor} lags head {block}, rechecking all pools')
+                candidates = group
+            else:
+                addresses = {address for arbitraguer in group for address in arbitraguer.get_watch_addresses()}
+                touched = {log['address'] for log in Chain.getLogs(network, addresses, cursor + 1, block)}
+                candidates = [arbitraguer for arbitraguer in group if touched & set(arbitraguer.get_watch_addresses())]
+            self.cursors[network] = block
+
+            if candidates:
+                volumes = [arbitraguer.defi_symbol_state.netVolume for arbitraguer in candidates]
+                update_defi_states(candidates)
+                for arbitraguer, volume in zip(candidates, volumes):
+                    if arbitraguer.defi_symbol_state.netVolume != volume:
+                        logging.info(f'(Watcher) {arbitraguer.defiSymbol} PoolNetVolume: {State.to_decimal(volume)} => '
+                                     f'{State.to_decimal(arbitraguer.defi_symbol_state.netVolume)} at block {block}')
+                        changed.append(arbitraguer)
+        return changed
@@ -0,0 +1,110 @@
+import types
+import asyncio
+import unittest
+from decimal import Decimal
+from aiohttp import web
+import RestBinanceAsync
+
+
+# RestBinanceAsync.Rest against a local stub of the binance futures endpoints,
+# the clock and the sleeps of the module are replaced so that throttling runs without waiting
+class TestRestBinanceAsync(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.requests = []
+        self.responses = []
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.rest = RestBinanceAsync.Rest(f'http://127.0.0.1:{port}', 'key', 'secret', weight_limit=10, weight_ratio=1)
+
+        self.now = 600.0
+        self.sleeps = []
+        self.sleeping = asyncio.Event()
+        self.wake = asyncio.Event()
+        self.wake.set()
+        sleep = asyncio.sleep
+
+        async def fake_sleep(delay):
+            self.sleeps.append(delay)
+            self.sleeping.set()
+            await self.wake.wait()
+            self.now += delay
+            await sleep(0)
+
+        self.patches = [
+            (RestBinanceAsync, 'time', types.SimpleNamespace(time=lambda: self.now)),
+            (RestBinanceAsync, 'asyncio', types.SimpleNamespace(sleep=fake_sleep, Lock=asyncio.Lock))
+        ]
+        self.originals = [(module, name, getattr(module, name)) for module, name, _ in self.patches]
+        for module, name, value in self.patches:
+            setattr(module, name, value)
+
+
+    async def asyncTearDown(self):
+        for module, name, value in self.originals:
+            setattr(module, name, value)
+        await self.rest.close()
+        await self.runner.cleanup()
+
+
+    async def handle(self, request):
+        self.requests.append(request)
+        status, headers, body = self.responses.pop(0) if self.responses else (200, {}, [])
+        return web.json_response(body, status=status, headers=headers)
+
+
+    async def test_signed_request(self):
+        self.responses.append((200, {}, [{'asset': 'BNB', 'balance': '1', 'crossUnPnl': '0'},
+                                         {'asset': 'USDT', 'balance': '100.5', 'crossUnPnl': '-0.5'}]))
+        self.assertEqual(await self.rest.get_balance(), Decimal(100))
+        request = self.requests[0]
+        self.assertEqual(request.path, '/fapi/v2/balance')
+        self.assertEqual(request.headers['X-MBX-APIKEY'], 'key')
+        params = dict(request.query)
+        signature = params.pop('signature')
+        self.assertEqual(signature, self.rest._sign(params))
+
+
+    async def test_used_weight_header(self):
+        self.responses.append((200, {'X-MBX-USED-WEIGHT-1M': '8'}, {'orderId': 1}))
+        await self.rest.place_order('BTCUSDT', 'buy', Decimal('0.001'), 'limit', Decimal('20000.5'))
+        self.assertEqual(self.rest.weight, 8)
+        query = self.requests[0].query
+        self.assertEqual((query['side'], query['quantity'], query['type'], query['price']), ('BUY', '0.001', 'LIMIT', '20000.5'))
+
+
+    async def test_rate_limited_retry(self):
+        self.responses.append((429, {'Retry-After': '3'}, {'code': -1003}))
+        self.responses.append((200, {}, [{'symbol': 'BTCUSDT', 'positionAmt': '-0.002', 'entryPrice': '20000'}]))
+        position = await self.rest.get_position('BTCUSDT')
+        self.assertEqual(position, {'symbol': 'BTCUSDT', 'volume': Decimal('-0.002'), 'price': Decimal(20000)})
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.sleeps[0], 3)
+
+
+    async def test_invalid_response(self):
+        self.responses.append((400, {}, {'code': -1102}))
+        with self.assertRaises(ValueError):
+            await self.rest.place_order('BTCUSDT', 'sell', Decimal('0.001'), 'market')
+
+
+    async def test_throttle_waits_without_lock(self):
+        await self.rest._throttle(6)
+        self.wake.clear()
+        task = asyncio.create_task(self.rest._throttle(6))
+        await self.sleeping.wait()
+        self.assertEqual(self.sleeps, [60])
+        self.assertFalse(self.rest.lock.locked())
+        await asyncio.wait_for(self.rest._throttle(4), 1)
+        self.wake.set()
+        await asyncio.wait_for(task, 1)
+        self.assertEqual((self.rest.weight_minute, self.rest.weight), (11, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import time
+import types
+import threading
+import unittest
+from decimal import Decimal
+import Mock
+import RestBinance
+import AccountBinance
+import StreamBinance
+
+
+# the user data stream of StreamBinance against Mock.MockBinance, which serves the rest api and pushes
+# ACCOUNT_UPDATE, ORDER_TRADE_UPDATE and listenKeyExpired over a local websocket
+class TestStreamBinance(unittest.TestCase):
+
+    def setUp(self):
+        self.binance = Mock.MockBinance(prices={'BTCUSDT': Decimal(20000)})
+        url = self.binance.start()
+        self.account = AccountBinance.Account(RestBinance.Rest(url, 'key', 'secret'), ttl=60)
+        self.stream = StreamBinance.Stream(self.account, url.replace('http', 'ws'), reconnect=0.1)
+        self.account.stream = self.stream
+        self.stream.start()
+        self.wait(lambda: self.stream.live)
+
+
+    def tearDown(self):
+        self.stream.stop()
+        self.binance.stop()
+
+
+    def wait(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('condition not met in time')
+            time.sleep(0.01)
+
+
+    def order_update(self, order_id, status, filled, trade_time):
+        return {'e': 'ORDER_TRADE_UPDATE', 'E': trade_time, 'T': trade_time, 'o': {
+            's': 'BTCUSDT', 'i': order_id, 'S': 'BUY', 'o': 'MARKET', 'q': '0.001', 'x': 'TRADE' if filled else status,
+            'X': status, 'l': str(filled), 'z': str(filled), 'L': '20000', 'T': trade_time
+        }}
+
+
+    def account_update(self, update_time, *positions):
+        return {'e': 'ACCOUNT_UPDATE', 'E': update_time, 'T': update_time, 'a': {'m': 'ORDER', 'B': [], 'P': [
+            {'s': 'BTCUSDT', 'pa': volume, 'ep': price, 'ps': side} for side, volume, price in positions
+        ]}}
+
+
+    # the fill reaches the position through the stream, no rest snapshot is taken after the order
+    def test_position_update(self):
+        order = self.account.place_order('BTCUSDT', 'sell', '0.002', 'market')
+        self.assertEqual(order['status'], 'FILLED')
+        self.assertEqual(self.account.get_position('BTCUSDT'), {'symbol': 'BTCUSDT', 'volume': Decimal('-0.002'), 'price': Decimal(20000)})
+        self.assertEqual(self.binance.counts['GET /fapi/v2/account'], 1)
+        self.assertEqual(self.stream.pop_fills()[0]['volume'], Decimal('0.002'))
+
+
+    # changes missed while disconnected are picked up by the snapshot taken when the new stream opens
+    def test_snapshot_on_reconnect(self):
+        with self.binance.lock:
+            self.binance.positions['BTCUSDT'] = (Decimal('0.003'), Decimal(60))
+        self.binance.expire_listen_key()
+        self.wait(lambda: self.binance.counts['POST /fapi/v1/listenKey'] == 2 and self.stream.live)
+        self.assertEqual(self.binance.counts['GET /fapi/v2/account'], 2)
+        self.assertEqual(self.account.get_position('BTCUSDT'), {'symbol': 'BTCUSDT', 'volume': Decimal('0.003'), 'price': Decimal(20000)})
+
+
+    # an order is done once it is final and the account update of its last trade arrived
+    def test_wait_order(self):
+        self.assertFalse(self.stream.wait_order(1, timeout=0.1))
+
+        self.binance.push(self.order_update(2, 'FILLED', Decimal('0.001'), 1000))
+        self.assertFalse(self.stream.wait_order(2, timeout=0.2))
+
+        self.binance.push(self.order_update(3, 'FILLED', Decimal('0.001'), 2000))
+        threading.Timer(0.1, self.binance.push, [self.account_update(2000, ('BOTH', '0.001', '20000'))]).start()
+        self.assertTrue(self.stream.wait_order(3, timeout=5))
+        self.assertEqual(self.account.get_position('BTCUSDT')['volume'], Decimal('0.001'))
+
+        self.binance.push(self.order_update(4, 'CANCELED', 0, 3000))
+        self.assertTrue(self.stream.wait_order(4, timeout=5))
+
+        self.binance.push(self.order_update(5, 'NEW', 0, 4000))
+        threading.Timer(0.1, self.binance.close_websockets).start()
+        self.assertFalse(self.stream.wait_order(5, timeout=5))
+
+
+    # in hedge mode the LONG and SHORT sides are netted into one position, each update carries only the changed sides
+    def test_hedge_mode_sides(self):
+        self.binance.push(self.account_update(1000, ('LONG', '0.003', '100'), ('SHORT', '-0.001', '110')))
+        self.wait(lambda: self.account.positions['BTCUSDT']['volume'] == Decimal('0.002'))
+        self.assertEqual(self.account.get_position('BTCUSDT')['price'], Decimal(95))
+        self.binance.push(self.account_update(2000, ('SHORT', '0', '0')))
+        self.wait(lambda: self.account.positions['BTCUSDT']['volume'] == Decimal('0.003'))
+        self.assertEqual(self.account.get_position('BTCUSDT')['price'], Decimal(100))
+
+        account = AccountBinance.Account(types.SimpleNamespace(get_account=lambda: {
+            'assets': [{'asset': 'USDT', 'walletBalance': '100', 'crossUnPnl': '0'}],
+            'positions': [
+                {'symbol': 'BTCUSDT', 'positionAmt': '0', 'entryPrice': '0', 'positionSide': 'BOTH'},
+                {'symbol': 'BTCUSDT', 'positionAmt': '0.002', 'entryPrice': '100', 'positionSide': 'LONG'},
+                {'symbol': 'BTCUSDT', 'positionAmt': '-0.005', 'entryPrice': '104', 'positionSide': 'SHORT'}
+            ]
+        }))
+        self.assertEqual(account.get_position('BTCUSDT'), {'symbol': 'BTCUSDT', 'volume': Decimal('-0.003'), 'price': Decimal(320) / 3})
+
+
+    def test_missing_symbol(self):
+        self.assertEqual(self.account.get_position('ETHUSDT'), {'symbol': 'ETHUSDT', 'volume': Decimal(0), 'price': Decimal(0)})
+        self.assertEqual(self.binance.counts['GET /fapi/v2/account'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
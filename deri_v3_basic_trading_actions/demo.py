@@ -23,10 +23,28 @@ def get_contract(address, contract_name):
     return web3.eth.contract(address=address, abi=get_abi(contract_name))
 
 
+# gas used by the last successful transaction of each contract function and argument shape, estimated only the first time
+GAS_USED = {}
+
+
+# which arguments are negative and how many oracle signatures are passed, the sign of a trade volume and
+# each signature verified change the gas
+def get_arg_shape(params):
+    shape = []
+    for param in params:
+        if isinstance(param, list):
+            shape.append(len(param))
+        else:
+            shape.append(isinstance(param, int) and param < 0)
+    return tuple(shape)
+
+
 def transact(contract, function_name, params=()):
+    function = contract.functions[function_name](*params)
     nonce = web3.eth.getTransactionCount(ACCOUNT_ADDRESS)
-    gas = contract.functions[function_name](*params).estimateGas({'from': ACCOUNT_ADDRESS})
-    tx = contract.functions[function_name](*params).buildTransaction({
+    key = (contract.address, function_name, get_arg_shape(params))
+    gas = GAS_USED[key] if key in GAS_USED else function.estimateGas({'from': ACCOUNT_ADDRESS})
+    tx = function.buildTransaction({
         'nonce': nonce,
         'from': ACCOUNT_ADDRESS,
         'gas': int(gas * 1.2)
@@ -34,6 +52,10 @@ def transact(contract, function_name, params=()):
     signed_tx = web3.eth.ACCOUNT_ADDRESS.signTransaction(tx, ACCOUNT_PRIVATE)
     tx_hash = web3.eth.sendRawTransaction(signed_tx.rawTransaction)
     receipt = web3.eth.waitForTransactionReceipt(tx_hash)
+    if receipt.status == 0 and receipt.gasUsed >= tx['gas']:
+        GAS_USED.pop(key, None)
+    elif receipt.status == 1:
+        GAS_USED[key] = max(GAS_USED.get(key, 0), receipt.gasUsed)
     return receipt
 
 
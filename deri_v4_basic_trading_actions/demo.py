@@ -1,5 +1,6 @@
 import json
 import time
+import requests
 from web3 import Web3
 import eth_abi
 import hexbytes
@@ -42,6 +43,14 @@ SYMBOL_MANAGER_ADDRESS = ""
 
 web3 = Web3(Web3.HTTPProvider(ICHAIN_PROVIDER_URL))
 
+web3_dchain = Web3(Web3.HTTPProvider(DCHAIN_PROVIDER_URL))
+
+session = requests.Session()
+
+FINISH_ADD_MARGIN_TOPIC = Web3.keccak(
+    text="FinishAddMargin(uint256,uint256,address,uint256)"
+)
+
 
 def get_abi(contract_name):
     with open(f"abis/{contract_name}.json") as file:
@@ -71,10 +80,70 @@ def call(contract, function_name, params=None):
     return contract.functions[function_name](*params).call()
 
 
+# send [(method, params), ...] as JSON-RPC batches of at most size requests,
+# results are returned in request order
+def batch_request(web3, batch, timeout=30, size=500):
+    results = []
+    for start in range(0, len(batch), size):
+        payload = [
+            {"jsonrpc": "2.0", "id": start + i, "method": method, "params": params}
+            for i, (method, params) in enumerate(batch[start : start + size])
+        ]
+        res = session.post(web3.provider.endpoint_uri, json=payload, timeout=timeout)
+        res.raise_for_status()
+        responses = sorted(res.json(), key=lambda response: response["id"])
+        for response in responses:
+            if "error" in response:
+                method, params = batch[response["id"]]
+                raise ValueError(f"{method} {params} error: {response['error']}")
+        results += [response["result"] for response in responses]
+    return results
+
+
+# read [(contract, function_name, params), ...] of one chain with a single batch_request,
+# decoded as contract.functions[function_name](*params).call() would
+def batch_call(calls, block_identifier="latest"):
+    if not calls:
+        return []
+    block = (
+        hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+    )
+    functions = [
+        contract.functions[function_name](*params)
+        for contract, function_name, params in calls
+    ]
+    results = batch_request(
+        calls[0][0].w3,
+        [
+            (
+                "eth_call",
+                [
+                    {
+                        "to": contract.address,
+                        "data": contract.encodeABI(fn_name=function_name, args=params),
+                    },
+                    block,
+                ],
+            )
+            for contract, function_name, params in calls
+        ],
+    )
+    values = []
+    for function, result in zip(functions, results):
+        value = decode([output["type"] for output in function.abi["outputs"]], result)
+        values.append(value[0] if len(value) == 1 else value)
+    return values
+
+
 _, _, REMOVE_MARGIN_EXECUTION_FEE, TRADE_EXECUTION_FEE, _ = call(
     get_contract(GATEWAY_ADDRESS, "GatewayImplementation"), "getExecutionFees"
 )
 
+symbol_manager = web3_dchain.eth.contract(
+    address=Web3.to_checksum_address(SYMBOL_MANAGER_ADDRESS),
+    abi=get_abi("SymbolManagerImplementation"),
+)
+
 
 # approve gateway for spending your base token
 def approve():
@@ -119,11 +188,7 @@ def request_trade(p_token_id, symbol_id, trade_volume, price_limit):
 
 
 def check_position(symbol_id, p_token_id):
-    web3_dchain = Web3(Web3.HTTPProvider(DCHAIN_PROVIDER_URL))
-    contract = web3_dchain.eth.contract(
-        address=SYMBOL_MANAGER_ADDRESS, abi=get_abi("SymbolManagerImplementation")
-    )
-    res = call(contract, "getPosition", (symbol_id, p_token_id))
+    res = call(symbol_manager, "getPosition", (symbol_id, p_token_id))
     return int(res[0].hex(), 16)
 
 
@@ -139,21 +204,24 @@ def get_symbol_id(symbol, category):
     return symbol_id
 
 
+def get_symbol_name(symbol_id):
+    return symbol_id[:-1].rstrip(b"\x00").decode("utf-8", "replace")
+
+
+# signed value of a bytes32 field of a position or symbol state
+def to_int(value):
+    return int.from_bytes(value, "big", signed=True)
+
+
 def get_min_trade_volume(symbol_id):
-    web3_dchain = Web3(Web3.HTTPProvider(DCHAIN_PROVIDER_URL))
-    contract = web3_dchain.eth.contract(
-        address=SYMBOL_MANAGER_ADDRESS, abi=get_abi("SymbolManagerImplementation")
-    )
-    res = call(contract, "getState", (symbol_id,))
+    res = call(symbol_manager, "getState", (symbol_id,))
     return int(res[2].hex(), 16)
 
 
 def get_p_token_id(receipt):
     logs = receipt.logs
     for log in logs:
-        if log.topics == [
-            web3.keccak(text="FinishAddMargin(uint256,uint256,address,uint256)")
-        ]:
+        if log.topics and log.topics[0] == FINISH_ADD_MARGIN_TOPIC:
             _, p_token_id, _, _ = decode(
                 ["uint256", "uint256", "address", "uint256"], log.data
             )
@@ -199,8 +267,10 @@ if __name__ == "__main__":
     price_limit = 110000
     pre_position = check_position(symbol_id, p_token_id)
     request_trade(p_token_id, symbol_id, trade_volume, price_limit)
+    deadline = time.time() + 300
     while check_position(symbol_id, p_token_id) != pre_position + int(
         trade_volume * ONE
     ):
+        assert time.time() < deadline, "Trade was not executed in time"
         time.sleep(1)
     print(f"Traded: {trade_volume} BTCUSD")
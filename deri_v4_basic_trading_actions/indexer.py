@@ -0,0 +1,334 @@
+import json
+import time
+import sqlite3
+import argparse
+import hexbytes
+from web3 import Web3
+from demo import (
+    ONE,
+    GATEWAY_ADDRESS,
+    web3,
+    symbol_manager,
+    get_abi,
+    decode,
+    batch_request,
+    batch_call,
+    get_symbol_name,
+    to_int,
+)
+
+# Indexer of the Gateway events of the ichain, kept in a local sqlite database.
+# Logs are scanned in block ranges of CHUNK_SIZE, BATCH_SIZE ranges per JSON-RPC batch,
+# and the symbols each pToken trades are taken from its RequestTrade events.
+# The SymbolManager emits no position events, so positions are read from the dchain
+# with batched getPosition calls whenever a pToken has new requests, and lookups are
+# then answered from memory.
+
+# Database file of the index
+DB_PATH = "indexer.db"
+
+# Block the Gateway was deployed at, the first scan starts there
+START_BLOCK = 0
+
+# Blocks per eth_getLogs range, halved when a node rejects a range as too large
+CHUNK_SIZE = 2000
+
+# eth_getLogs ranges sent per JSON-RPC batch
+BATCH_SIZE = 10
+
+# Blocks behind the head that are indexed, so reorgs never reach the index
+CONFIRMATIONS = 5
+
+# Requests are executed on the dchain after they are emitted on the ichain,
+# the positions of a pToken are refreshed every round for this many seconds after its request
+SETTLE_SECONDS = 60
+
+
+def get_events(contract_name):
+    events = {}
+    for item in get_abi(contract_name):
+        if item["type"] != "event":
+            continue
+        types = [input["type"] for input in item["inputs"]]
+        names = [input["name"] for input in item["inputs"]]
+        topic = Web3.keccak(text=f"{item['name']}({','.join(types)})")
+        events[Web3.to_hex(topic)] = (item["name"], types, names)
+    return events
+
+
+GATEWAY_EVENTS = get_events("GatewayImplementation")
+
+
+# (name, args) of a Gateway log, raw or as returned by web3, None for other events
+def decode_log(log):
+    if not log["topics"]:
+        return None
+    event = GATEWAY_EVENTS.get(Web3.to_hex(hexbytes.HexBytes(log["topics"][0])))
+    if event is None:
+        return None
+    name, types, names = event
+    return name, dict(zip(names, decode(types, log["data"])))
+
+
+# events carrying the symbol traded by the pToken
+TRADE_EVENTS = {"RequestTrade", "RequestTradeAndRemoveMargin"}
+
+# events after which the positions of the pToken can change
+POSITION_EVENTS = TRADE_EVENTS | {"RequestLiquidate", "FinishLiquidate"}
+
+
+def to_json(value):
+    if isinstance(value, bytes):
+        return Web3.to_hex(value)
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    return value
+
+
+class Indexer:
+    def __init__(self, db_path=DB_PATH, p_token_ids=None, start_block=START_BLOCK):
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS cursor (
+                id INTEGER PRIMARY KEY CHECK (id = 0), block INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                block INTEGER NOT NULL, log_index INTEGER NOT NULL,
+                tx_hash TEXT NOT NULL, name TEXT NOT NULL,
+                request_id TEXT NOT NULL, p_token_id TEXT, args TEXT NOT NULL,
+                PRIMARY KEY (block, log_index)
+            );
+            CREATE INDEX IF NOT EXISTS events_p_token_id ON events (p_token_id);
+            CREATE INDEX IF NOT EXISTS events_request_id ON events (request_id);
+            CREATE TABLE IF NOT EXISTS symbols (
+                p_token_id TEXT NOT NULL, symbol_id BLOB NOT NULL, block INTEGER NOT NULL,
+                PRIMARY KEY (p_token_id, symbol_id)
+            );
+            CREATE TABLE IF NOT EXISTS positions (
+                p_token_id TEXT NOT NULL, symbol_id BLOB NOT NULL,
+                position TEXT NOT NULL, timestamp INTEGER NOT NULL,
+                PRIMARY KEY (p_token_id, symbol_id)
+            );
+            """)
+        # only these pTokens are indexed, None indexes every pToken of the Gateway
+        self.p_token_ids = set(p_token_ids) if p_token_ids is not None else None
+        self.chunk_size = CHUNK_SIZE
+        self.pending = {}
+
+        row = self.db.execute("SELECT block FROM cursor").fetchone()
+        self.block = row[0] if row is not None else start_block - 1
+        # pTokenId -> {symbolId: position}
+        self.index = {}
+        for p_token_id, symbol_id in self.db.execute(
+            "SELECT p_token_id, symbol_id FROM symbols"
+        ):
+            self.index.setdefault(int(p_token_id), {})[bytes(symbol_id)] = None
+        for p_token_id, symbol_id, position in self.db.execute(
+            "SELECT p_token_id, symbol_id, position FROM positions"
+        ):
+            self.index.setdefault(int(p_token_id), {})[bytes(symbol_id)] = [
+                int(value) for value in json.loads(position)
+            ]
+
+    def get_symbols(self, p_token_id):
+        return list(self.index.get(p_token_id, {}))
+
+    # {symbolId: [volume, cost, ...]} of the pToken, None for symbols not read yet
+    def get_positions(self, p_token_id):
+        return dict(self.index.get(p_token_id, {}))
+
+    def get_position(self, p_token_id, symbol_id):
+        return self.index.get(p_token_id, {}).get(symbol_id)
+
+    def get_p_token_ids(self):
+        return list(self.index)
+
+    def get_events(self, p_token_id=None, request_id=None):
+        query = "SELECT block, log_index, tx_hash, name, args FROM events"
+        if p_token_id is not None:
+            rows = self.db.execute(
+                f"{query} WHERE p_token_id = ? ORDER BY block, log_index",
+                (str(p_token_id),),
+            )
+        elif request_id is not None:
+            rows = self.db.execute(
+                f"{query} WHERE request_id = ? ORDER BY block, log_index",
+                (str(request_id),),
+            )
+        else:
+            rows = self.db.execute(f"{query} ORDER BY block, log_index")
+        return [
+            {
+                "block": block,
+                "logIndex": log_index,
+                "transactionHash": tx_hash,
+                "event": name,
+                "args": json.loads(args),
+            }
+            for block, log_index, tx_hash, name, args in rows
+        ]
+
+    def _get_logs(self, ranges):
+        return batch_request(
+            web3,
+            [
+                (
+                    "eth_getLogs",
+                    [
+                        {
+                            "address": GATEWAY_ADDRESS,
+                            "fromBlock": hex(from_block),
+                            "toBlock": hex(to_block),
+                            "topics": [list(GATEWAY_EVENTS)],
+                        }
+                    ],
+                )
+                for from_block, to_block in ranges
+            ],
+        )
+
+    # index the Gateway events up to to_block, CONFIRMATIONS behind the head by default
+    def sync(self, to_block=None):
+        if to_block is None:
+            to_block = web3.eth.block_number - CONFIRMATIONS
+        count = 0
+        while self.block < to_block:
+            ranges = []
+            from_block = self.block + 1
+            while len(ranges) < BATCH_SIZE and from_block <= to_block:
+                ranges.append(
+                    (from_block, min(from_block + self.chunk_size - 1, to_block))
+                )
+                from_block = ranges[-1][1] + 1
+            try:
+                results = self._get_logs(ranges)
+            except ValueError:
+                if self.chunk_size == 1:
+                    raise
+                self.chunk_size = max(self.chunk_size // 2, 1)
+                continue
+            count += self._store(
+                [log for logs in results for log in logs], ranges[-1][1]
+            )
+        return count
+
+    def _store(self, logs, block):
+        events, symbols = [], []
+        for log in logs:
+            event = decode_log(log)
+            if event is None:
+                continue
+            name, args = event
+            p_token_id = args.get("pTokenId")
+            if p_token_id is None:
+                continue
+            if self.p_token_ids is not None and p_token_id not in self.p_token_ids:
+                continue
+            events.append(
+                (
+                    int(log["blockNumber"], 16),
+                    int(log["logIndex"], 16),
+                    log["transactionHash"],
+                    name,
+                    str(args["requestId"]),
+                    str(p_token_id),
+                    json.dumps(to_json(args)),
+                )
+            )
+            if name in TRADE_EVENTS:
+                symbols.append(
+                    (str(p_token_id), args["symbolId"], int(log["blockNumber"], 16))
+                )
+                self.index.setdefault(p_token_id, {}).setdefault(args["symbolId"])
+            elif p_token_id not in self.index:
+                self.index[p_token_id] = {}
+            if name in POSITION_EVENTS:
+                self.pending[p_token_id] = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", events
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO symbols VALUES (?, ?, ?)", symbols
+            )
+            self.db.execute("INSERT OR REPLACE INTO cursor VALUES (0, ?)", (block,))
+        self.block = block
+        return len(events)
+
+    # read the positions of the pTokens, every pToken indexed by default, in one JSON-RPC batch
+    def refresh_positions(self, p_token_ids=None):
+        if p_token_ids is None:
+            p_token_ids = list(self.index)
+        pairs = [
+            (p_token_id, symbol_id)
+            for p_token_id in p_token_ids
+            for symbol_id in self.index.get(p_token_id, {})
+        ]
+        if not pairs:
+            return 0
+        results = batch_call(
+            [
+                (symbol_manager, "getPosition", (symbol_id, p_token_id))
+                for p_token_id, symbol_id in pairs
+            ]
+        )
+        timestamp = int(time.time())
+        rows = []
+        for (p_token_id, symbol_id), position in zip(pairs, results):
+            position = [to_int(value) for value in position]
+            self.index[p_token_id][symbol_id] = position
+            rows.append(
+                (
+                    str(p_token_id),
+                    symbol_id,
+                    json.dumps([str(value) for value in position]),
+                    timestamp,
+                )
+            )
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    # one round of sync, then the positions of the pTokens with recent requests are read again
+    def update(self):
+        count = self.sync()
+        now = time.time()
+        self.pending = {
+            p_token_id: timestamp
+            for p_token_id, timestamp in self.pending.items()
+            if now - timestamp < SETTLE_SECONDS
+        }
+        self.refresh_positions(list(self.pending))
+        return count
+
+    def run(self, interval=5):
+        self.refresh_positions()
+        while True:
+            self.update()
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("p_token_ids", nargs="*", type=int, help="all pTokens if none")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--start-block", type=int, default=START_BLOCK)
+    args = parser.parse_args()
+
+    indexer = Indexer(args.db, args.p_token_ids or None, args.start_block)
+    start = time.time()
+    count = indexer.sync()
+    print(
+        f"Indexed {count} events up to block {indexer.block} in {time.time() - start:.1f}s"
+    )
+    indexer.refresh_positions()
+    for p_token_id in indexer.get_p_token_ids():
+        for symbol_id, position in indexer.get_positions(p_token_id).items():
+            volume = position[0] / ONE if position else None
+            print(f"{p_token_id} {get_symbol_name(symbol_id)} {volume}")
@@ -0,0 +1,154 @@
+import time
+import array
+import argparse
+from demo import (
+    ONE,
+    web3_dchain,
+    symbol_manager,
+    batch_call,
+    get_symbol_id,
+    get_symbol_name,
+    to_int,
+)
+
+# Snapshots of the positions of many pTokens, read from the dchain SymbolManager at one block.
+# The symbols of every pToken are read in one JSON-RPC batch, and every position and
+# symbol state in a second one, so the round trips do not grow with the number of positions.
+
+
+# Positions of row i belong to p_token_ids[i] for offsets[i] <= row < offsets[i + 1],
+# with the symbol symbol_ids[symbols[row]] and the values positions[row].
+class Portfolio:
+    __slots__ = (
+        "block",
+        "p_token_ids",
+        "offsets",
+        "symbol_ids",
+        "states",
+        "symbols",
+        "positions",
+        "rows",
+    )
+
+    def __init__(
+        self, block, p_token_ids, offsets, symbol_ids, states, symbols, positions
+    ):
+        self.block = block
+        self.p_token_ids = p_token_ids
+        self.offsets = offsets
+        self.symbol_ids = symbol_ids
+        self.states = states
+        self.symbols = symbols
+        self.positions = positions
+        self.rows = {p_token_id: i for i, p_token_id in enumerate(p_token_ids)}
+
+    def __len__(self):
+        return len(self.positions)
+
+    # (pTokenId, symbolId, position) of every position
+    def __iter__(self):
+        for i, p_token_id in enumerate(self.p_token_ids):
+            for row in range(self.offsets[i], self.offsets[i + 1]):
+                symbol_id = self.symbol_ids[self.symbols[row]]
+                yield p_token_id, symbol_id, self.positions[row]
+
+    # {symbolId: position} of the pToken
+    def get_positions(self, p_token_id):
+        i = self.rows[p_token_id]
+        return {
+            self.symbol_ids[self.symbols[row]]: self.positions[row]
+            for row in range(self.offsets[i], self.offsets[i + 1])
+        }
+
+    def get_state(self, symbol_id):
+        return self.states[self.symbol_ids.index(symbol_id)]
+
+    # net volume of every symbol over the pTokens of the snapshot
+    def get_volumes(self):
+        volumes = [0] * len(self.symbol_ids)
+        for symbol, position in zip(self.symbols, self.positions):
+            volumes[symbol] += position[0]
+        return dict(zip(self.symbol_ids, volumes))
+
+
+def call_symbol_manager(calls, block_identifier="latest"):
+    return batch_call(
+        [(symbol_manager, function_name, params) for function_name, params in calls],
+        block_identifier,
+    )
+
+
+def get_symbol_ids():
+    return call_symbol_manager([("getSymbolIds", ())])[0]
+
+
+# pTokens holding positions in any of the symbols
+def get_p_token_ids(symbol_ids, block_identifier="latest"):
+    results = call_symbol_manager(
+        [("getPTokenIdsOfSymbol", (symbol_id,)) for symbol_id in symbol_ids],
+        block_identifier,
+    )
+    return sorted({p_token_id for p_token_ids in results for p_token_id in p_token_ids})
+
+
+def get_portfolio(p_token_ids, block_identifier=None):
+    block = (
+        block_identifier
+        if block_identifier is not None
+        else web3_dchain.eth.block_number
+    )
+    p_token_ids = list(p_token_ids)
+    symbol_ids_of_p_tokens = call_symbol_manager(
+        [("getSymbolIdsOfPToken", (p_token_id,)) for p_token_id in p_token_ids], block
+    )
+
+    symbol_ids, indices = [], {}
+    offsets, symbols = array.array("I", [0]), array.array("I")
+    calls = []
+    for p_token_id, p_token_symbol_ids in zip(p_token_ids, symbol_ids_of_p_tokens):
+        for symbol_id in p_token_symbol_ids:
+            if symbol_id not in indices:
+                indices[symbol_id] = len(symbol_ids)
+                symbol_ids.append(symbol_id)
+            symbols.append(indices[symbol_id])
+            calls.append(("getPosition", (symbol_id, p_token_id)))
+        offsets.append(len(symbols))
+    calls += [("getState", (symbol_id,)) for symbol_id in symbol_ids]
+
+    results = call_symbol_manager(calls, block)
+    positions = [tuple(map(to_int, result)) for result in results[: len(symbols)]]
+    states = [tuple(map(to_int, result)) for result in results[len(symbols) :]]
+    return Portfolio(
+        block, p_token_ids, offsets, symbol_ids, states, symbols, positions
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("p_token_ids", nargs="*", type=int)
+    parser.add_argument(
+        "--symbol",
+        action="append",
+        default=[],
+        help="also every pToken holding the symbol, e.g. BTCUSD:1",
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    p_token_ids = set(args.p_token_ids)
+    if args.symbol:
+        p_token_ids.update(
+            get_p_token_ids(
+                [
+                    get_symbol_id(symbol, int(category))
+                    for symbol, category in (item.split(":") for item in args.symbol)
+                ]
+            )
+        )
+    portfolio = get_portfolio(sorted(p_token_ids))
+    print(
+        f"{len(portfolio)} positions of {len(portfolio.p_token_ids)} pTokens "
+        f"at block {portfolio.block} in {time.time() - start:.2f}s"
+    )
+    for p_token_id, symbol_id, position in portfolio:
+        print(f"{p_token_id} {get_symbol_name(symbol_id)} {position[0] / ONE}")
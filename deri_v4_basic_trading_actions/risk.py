@@ -0,0 +1,452 @@
+import time
+import argparse
+from demo import (
+    ONE,
+    web3_dchain,
+    symbol_manager,
+    call,
+    batch_request,
+    decode,
+    get_symbol_id,
+    get_symbol_name,
+)
+from portfolio import get_portfolio, get_p_token_ids
+
+# Local PnL, funding and margin requirements of dchain futures positions.
+# Positions and symbol states are loaded from a portfolio snapshot, after which a price tick only
+# recomputes the positions of its symbol and moves the totals of their pTokens by the difference,
+# with the truncating 18-decimal integer math of the contracts, so no round trip is needed per tick.
+# cross_check compares the results with the SymbolManager's own settlement of the same pTokens, and
+# the engine refuses its first snapshot unless one such settlement matches.
+
+# Category of futures symbols, the only one computed here
+FUTURES = 1
+
+# Fields of the bytes32[] returned by getPosition and getState of a futures symbol. They are not
+# part of the ABI: only the volume and minTradeVolume indices are the ones demo.py reads, the
+# others must match the deployed implementation, which RiskEngine.verify checks
+POSITION_VOLUME = 0
+POSITION_COST = 1
+POSITION_CUMULATIVE_FUNDING_PER_VOLUME = 2
+
+STATE_MIN_TRADE_VOLUME = 2
+STATE_INITIAL_MARGIN_RATIO = 3
+STATE_MAINTENANCE_MARGIN_RATIO = 4
+STATE_MARK_PRICE = 5
+STATE_CUMULATIVE_FUNDING_PER_VOLUME = 6
+
+# Outputs of settleSymbolsOnRemoveMargin, all int256
+SETTLEMENT_FIELDS = (
+    "funding",
+    "diffTradersPnl",
+    "traderFunding",
+    "traderPnl",
+    "traderInitialMarginRequired",
+)
+
+
+# a * b / ONE truncated toward zero as solidity does
+def mul(a, b):
+    c = a * b
+    return c // ONE if c >= 0 else -(-c // ONE)
+
+
+class Symbol:
+    __slots__ = (
+        "symbol_id",
+        "price",
+        "cumulative_funding_per_volume",
+        "initial_margin_ratio",
+        "maintenance_margin_ratio",
+        "positions",
+    )
+
+    def __init__(self, symbol_id, state):
+        self.symbol_id = symbol_id
+        self.price = state[STATE_MARK_PRICE]
+        self.cumulative_funding_per_volume = state[STATE_CUMULATIVE_FUNDING_PER_VOLUME]
+        self.initial_margin_ratio = state[STATE_INITIAL_MARGIN_RATIO]
+        self.maintenance_margin_ratio = state[STATE_MAINTENANCE_MARGIN_RATIO]
+        self.positions = []
+
+
+class PToken:
+    __slots__ = (
+        "p_token_id",
+        "margin",
+        "pnl",
+        "funding",
+        "initial_margin_required",
+        "maintenance_margin_required",
+        "positions",
+    )
+
+    def __init__(self, p_token_id):
+        self.p_token_id = p_token_id
+        self.margin = None
+        self.pnl = 0
+        self.funding = 0
+        self.initial_margin_required = 0
+        self.maintenance_margin_required = 0
+        # symbolId -> Position
+        self.positions = {}
+
+
+# values of a position at the last price of its symbol, its pToken's totals include them
+class Position:
+    __slots__ = (
+        "p_token",
+        "symbol",
+        "volume",
+        "cost",
+        "cumulative_funding_per_volume",
+        "pnl",
+        "funding",
+        "initial_margin_required",
+        "maintenance_margin_required",
+    )
+
+    def __init__(self, p_token, symbol, volume, cost, cumulative_funding_per_volume):
+        self.p_token = p_token
+        self.symbol = symbol
+        self.volume = volume
+        self.cost = cost
+        self.cumulative_funding_per_volume = cumulative_funding_per_volume
+        self.pnl = 0
+        self.funding = 0
+        self.initial_margin_required = 0
+        self.maintenance_margin_required = 0
+
+
+class RiskEngine:
+    # liquidity is the pool liquidity the layout is verified with, see verify
+    def __init__(self, liquidity, verify=True):
+        self.liquidity = liquidity
+        self.verified = not verify
+        self.block = None
+        # symbolId -> Symbol
+        self.symbols = {}
+        # pTokenId -> PToken
+        self.p_tokens = {}
+
+    # replaces the symbols and positions of the pTokens in a portfolio.Portfolio,
+    # positions in symbols other than futures are left out
+    def load(self, portfolio):
+        self._load(portfolio)
+        if not self.verified:
+            self.verify(portfolio)
+
+    def _load(self, portfolio):
+        self.block = portfolio.block
+        for symbol_id, state in zip(portfolio.symbol_ids, portfolio.states):
+            if symbol_id[-1] == FUTURES:
+                self.set_symbol(symbol_id, state)
+        for p_token_id in portfolio.p_token_ids:
+            p_token = self.p_tokens.setdefault(p_token_id, PToken(p_token_id))
+            for symbol_id in list(p_token.positions):
+                self.remove_position(p_token_id, symbol_id)
+        for p_token_id, symbol_id, position in portfolio:
+            if symbol_id in self.symbols:
+                self.set_position(
+                    p_token_id,
+                    symbol_id,
+                    position[POSITION_VOLUME],
+                    position[POSITION_COST],
+                    position[POSITION_CUMULATIVE_FUNDING_PER_VOLUME],
+                )
+
+    def refresh(self, p_token_ids, block_identifier=None):
+        self.load(get_portfolio(p_token_ids, block_identifier))
+
+    # the field layout checked against the on-chain settlement of one futures-only pToken of the
+    # loaded snapshot, when it cannot be checked or does not match the engine is cleared and
+    # ValueError is raised
+    def verify(self, portfolio):
+        p_token_ids = [
+            p_token_id
+            for p_token_id in get_futures_p_token_ids(portfolio)
+            if self.p_tokens[p_token_id].positions
+        ][:1]
+        if not p_token_ids:
+            self.clear()
+            raise ValueError(
+                f"No futures-only position at block {portfolio.block} to verify the layout with"
+            )
+        mismatches = compare(self, portfolio, p_token_ids, self.liquidity)
+        if mismatches:
+            self.clear()
+            raise ValueError(
+                f"Position and state layout does not match the dchain: {mismatches}"
+            )
+        self.verified = True
+
+    def clear(self):
+        self.block = None
+        self.symbols.clear()
+        self.p_tokens.clear()
+
+    # state is the getState fields as ints, the positions of a known symbol are recomputed
+    def set_symbol(self, symbol_id, state):
+        symbol = self.symbols.get(symbol_id)
+        if symbol is None:
+            self.symbols[symbol_id] = Symbol(symbol_id, state)
+            return
+        symbol.price = state[STATE_MARK_PRICE]
+        symbol.cumulative_funding_per_volume = state[
+            STATE_CUMULATIVE_FUNDING_PER_VOLUME
+        ]
+        symbol.initial_margin_ratio = state[STATE_INITIAL_MARGIN_RATIO]
+        symbol.maintenance_margin_ratio = state[STATE_MAINTENANCE_MARGIN_RATIO]
+        self._update(symbol, symbol.positions)
+
+    def set_position(
+        self, p_token_id, symbol_id, volume, cost, cumulative_funding_per_volume
+    ):
+        self.remove_position(p_token_id, symbol_id)
+        if volume == 0:
+            return
+        symbol = self.symbols[symbol_id]
+        p_token = self.p_tokens.setdefault(p_token_id, PToken(p_token_id))
+        position = Position(
+            p_token, symbol, volume, cost, cumulative_funding_per_volume
+        )
+        p_token.positions[symbol_id] = position
+        symbol.positions.append(position)
+        self._update(symbol, (position,))
+
+    def remove_position(self, p_token_id, symbol_id):
+        p_token = self.p_tokens.get(p_token_id)
+        position = p_token.positions.pop(symbol_id, None) if p_token else None
+        if position is None:
+            return
+        position.symbol.positions.remove(position)
+        p_token.pnl -= position.pnl
+        p_token.funding -= position.funding
+        p_token.initial_margin_required -= position.initial_margin_required
+        p_token.maintenance_margin_required -= position.maintenance_margin_required
+
+    # margin of the pToken in the base token with 18 decimals, for its dynamic margin and margin ratio
+    def set_margin(self, p_token_id, margin):
+        self.p_tokens.setdefault(p_token_id, PToken(p_token_id)).margin = margin
+
+    # a price tick, the totals of the pTokens holding the symbol are moved by the change of each position
+    def update_price(self, symbol_id, price):
+        symbol = self.symbols[symbol_id]
+        symbol.price = price
+        self._update(symbol, symbol.positions, funding=False)
+
+    def update_funding(self, symbol_id, cumulative_funding_per_volume):
+        symbol = self.symbols[symbol_id]
+        symbol.cumulative_funding_per_volume = cumulative_funding_per_volume
+        self._update(symbol, symbol.positions)
+
+    # recomputes the positions, funding only when the cumulative funding may have moved
+    def _update(self, symbol, positions, funding=True):
+        price = symbol.price
+        cumulative_funding_per_volume = symbol.cumulative_funding_per_volume
+        initial_margin_ratio = symbol.initial_margin_ratio
+        maintenance_margin_ratio = symbol.maintenance_margin_ratio
+        for position in positions:
+            p_token = position.p_token
+            volume = position.volume
+            notional = mul(abs(volume), price)
+            pnl = mul(volume, price) - position.cost
+            initial_margin_required = mul(notional, initial_margin_ratio)
+            maintenance_margin_required = mul(notional, maintenance_margin_ratio)
+            p_token.pnl += pnl - position.pnl
+            p_token.initial_margin_required += (
+                initial_margin_required - position.initial_margin_required
+            )
+            p_token.maintenance_margin_required += (
+                maintenance_margin_required - position.maintenance_margin_required
+            )
+            position.pnl = pnl
+            position.initial_margin_required = initial_margin_required
+            position.maintenance_margin_required = maintenance_margin_required
+            if funding:
+                value = mul(
+                    volume,
+                    cumulative_funding_per_volume
+                    - position.cumulative_funding_per_volume,
+                )
+                p_token.funding += value - position.funding
+                position.funding = value
+
+    def get_position(self, p_token_id, symbol_id):
+        position = self.p_tokens[p_token_id].positions[symbol_id]
+        return {
+            "volume": position.volume,
+            "cost": position.cost,
+            "pnl": position.pnl,
+            "funding": position.funding,
+            "initialMarginRequired": position.initial_margin_required,
+            "maintenanceMarginRequired": position.maintenance_margin_required,
+        }
+
+    # totals of the pToken, funding is what the trader pays, the margin ratio is the dynamic
+    # margin over the maintenance margin required and is None until the margin is set
+    def get_p_token(self, p_token_id):
+        p_token = self.p_tokens[p_token_id]
+        result = {
+            "pnl": p_token.pnl,
+            "funding": p_token.funding,
+            "initialMarginRequired": p_token.initial_margin_required,
+            "maintenanceMarginRequired": p_token.maintenance_margin_required,
+            "dynamicMargin": None,
+            "marginRatio": None,
+        }
+        if p_token.margin is not None:
+            dynamic_margin = p_token.margin + p_token.pnl - p_token.funding
+            result["dynamicMargin"] = dynamic_margin
+            if p_token.maintenance_margin_required:
+                result["marginRatio"] = (
+                    dynamic_margin / p_token.maintenance_margin_required
+                )
+        return result
+
+
+# settleSymbolsOnRemoveMargin of each pToken as the engine would call it, simulated with eth_call,
+# liquidity is the pool liquidity the engine passes and only moves the mark price
+def get_settlements(p_token_ids, liquidity, block_identifier="latest"):
+    engine = call(symbol_manager, "engine")
+    block = (
+        hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+    )
+    results = batch_request(
+        web3_dchain,
+        [
+            (
+                "eth_call",
+                [
+                    {
+                        "from": engine,
+                        "to": symbol_manager.address,
+                        "data": symbol_manager.encodeABI(
+                            fn_name="settleSymbolsOnRemoveMargin",
+                            args=(p_token_id, liquidity),
+                        ),
+                    },
+                    block,
+                ],
+            )
+            for p_token_id in p_token_ids
+        ],
+    )
+    return [
+        dict(
+            zip(SETTLEMENT_FIELDS, decode(["int256"] * len(SETTLEMENT_FIELDS), result))
+        )
+        for result in results
+    ]
+
+
+# pTokens of the snapshot with positions in futures only, the ones the engine computes in full
+def get_futures_p_token_ids(portfolio):
+    return [
+        p_token_id
+        for i, p_token_id in enumerate(portfolio.p_token_ids)
+        if all(
+            portfolio.symbol_ids[portfolio.symbols[row]][-1] == FUTURES
+            for row in range(portfolio.offsets[i], portfolio.offsets[i + 1])
+        )
+    ]
+
+
+# differences between the values of an engine loaded with the portfolio and the settlement of the
+# same block, a difference is allowed one wei of truncation per position and the relative
+# tolerance for the funding and mark price the settlement accrues to the block time
+def compare(engine, portfolio, p_token_ids, liquidity, tolerance=1e-6):
+    settlements = get_settlements(p_token_ids, liquidity, portfolio.block)
+    mismatches = []
+    for p_token_id, settlement in zip(p_token_ids, settlements):
+        i = portfolio.rows[p_token_id]
+        count = portfolio.offsets[i + 1] - portfolio.offsets[i]
+        p_token = engine.p_tokens[p_token_id]
+        for field, local in (
+            ("traderPnl", p_token.pnl),
+            ("traderFunding", p_token.funding),
+            ("traderInitialMarginRequired", p_token.initial_margin_required),
+        ):
+            remote = settlement[field]
+            if abs(local - remote) > max(abs(remote) * tolerance, count):
+                mismatches.append(
+                    {
+                        "pTokenId": p_token_id,
+                        "field": field,
+                        "local": local,
+                        "onchain": remote,
+                    }
+                )
+    return mismatches
+
+
+# compare of every futures-only pToken of a snapshot of p_token_ids
+def cross_check(p_token_ids, liquidity, block_identifier=None, tolerance=1e-6):
+    portfolio = get_portfolio(p_token_ids, block_identifier)
+    engine = RiskEngine(liquidity, verify=False)
+    engine.load(portfolio)
+    return compare(
+        engine, portfolio, get_futures_p_token_ids(portfolio), liquidity, tolerance
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("p_token_ids", nargs="*", type=int)
+    parser.add_argument(
+        "--symbol",
+        action="append",
+        default=[],
+        help="also every pToken holding the symbol, e.g. BTCUSD:1",
+    )
+    parser.add_argument(
+        "--liquidity",
+        type=float,
+        required=True,
+        help="pool liquidity of the on-chain settlements the engine is checked against",
+    )
+    parser.add_argument(
+        "--cross-check",
+        action="store_true",
+        help="compare every futures-only pToken with its on-chain settlement",
+    )
+    args = parser.parse_args()
+
+    p_token_ids = set(args.p_token_ids)
+    if args.symbol:
+        p_token_ids.update(
+            get_p_token_ids(
+                [
+                    get_symbol_id(symbol, int(category))
+                    for symbol, category in (item.split(":") for item in args.symbol)
+                ]
+            )
+        )
+    p_token_ids = sorted(p_token_ids)
+
+    start = time.time()
+    liquidity = int(args.liquidity * ONE)
+    engine = RiskEngine(liquidity)
+    engine.refresh(p_token_ids)
+    print(
+        f"Loaded {len(p_token_ids)} pTokens at block {engine.block} in {time.time() - start:.2f}s"
+    )
+    for p_token_id in p_token_ids:
+        risk = engine.get_p_token(p_token_id)
+        symbols = ", ".join(
+            get_symbol_name(symbol_id)
+            for symbol_id in engine.p_tokens[p_token_id].positions
+        )
+        print(
+            f"{p_token_id} [{symbols}] pnl: {risk['pnl'] / ONE}, funding: {risk['funding'] / ONE}, "
+            f"initial: {risk['initialMarginRequired'] / ONE}, maintenance: {risk['maintenanceMarginRequired'] / ONE}"
+        )
+
+    if args.cross_check:
+        mismatches = cross_check(p_token_ids, liquidity, engine.block)
+        for mismatch in mismatches:
+            print(
+                f"Mismatch {mismatch['pTokenId']} {mismatch['field']}: "
+                f"local {mismatch['local'] / ONE}, onchain {mismatch['onchain'] / ONE}"
+            )
+        print(f"Cross-checked {len(p_token_ids)} pTokens, {len(mismatches)} mismatches")
@@ -0,0 +1,247 @@
+import os
+import sys
+import types
+import random
+import unittest
+from unittest import mock
+
+# Tests of risk.py. The engine math runs on hand-computed values and synthetic portfolios, the
+# cross-checks compare it with the SymbolManager of the dchain configured in demo.py. Their pTokens
+# and the pool liquidity of their settlements are given in the environment, e.g.
+#   RISK_TEST_P_TOKEN_IDS=1,2,3 RISK_TEST_LIQUIDITY=1000000 python -m unittest test_risk
+# and the cross-checks are skipped without them.
+P_TOKEN_IDS = os.environ.get("RISK_TEST_P_TOKEN_IDS", "")
+LIQUIDITY = os.environ.get("RISK_TEST_LIQUIDITY", "")
+
+ONE = 10**18
+
+
+# demo.py reads the dchain when it is imported, without a configured one risk.py is imported
+# against a stand-in, the offline tests only use ONE from it
+def setUpModule():
+    global risk, portfolio
+    try:
+        import risk
+        import portfolio
+    except Exception:
+        demo = types.ModuleType("demo")
+        demo.ONE = ONE
+        for name in (
+            "web3_dchain",
+            "symbol_manager",
+            "call",
+            "batch_call",
+            "batch_request",
+            "decode",
+            "get_symbol_id",
+            "get_symbol_name",
+            "to_int",
+        ):
+            setattr(demo, name, None)
+        with mock.patch.dict(sys.modules, {"demo": demo}):
+            import risk
+            import portfolio
+
+
+def get_symbol_id(symbol, category):
+    return symbol.encode("utf-8").ljust(31, b"\x00") + bytes([category])
+
+
+# getState fields of a futures symbol at the indices risk.py reads
+def get_state(
+    price, cumulative_funding_per_volume, initial_margin_ratio, maintenance_margin_ratio
+):
+    state = [0] * 7
+    state[risk.STATE_MARK_PRICE] = price
+    state[risk.STATE_CUMULATIVE_FUNDING_PER_VOLUME] = cumulative_funding_per_volume
+    state[risk.STATE_INITIAL_MARGIN_RATIO] = initial_margin_ratio
+    state[risk.STATE_MAINTENANCE_MARGIN_RATIO] = maintenance_margin_ratio
+    return state
+
+
+class TestMath(unittest.TestCase):
+    # solidity truncates toward zero where // floors
+    def test_mul(self):
+        self.assertEqual(risk.mul(3 * ONE, 2 * ONE), 6 * ONE)
+        self.assertEqual(risk.mul(7, ONE // 2), 3)
+        self.assertEqual(risk.mul(-7, ONE // 2), -3)
+        self.assertEqual(risk.mul(-1, 1), 0)
+        self.assertEqual(risk.mul(-2, ONE // 3), 0)
+        self.assertEqual(risk.mul(-(ONE + 1), 3 * ONE // 2), -1500000000000000001)
+        self.assertEqual(risk.mul(ONE + 1, -3 * ONE // 2), -1500000000000000001)
+        self.assertEqual(risk.mul(-(ONE + 1), -3 * ONE // 2), 1500000000000000001)
+        self.assertEqual(risk.mul(0, -ONE), 0)
+
+    # a third of a unit sold at 3, every product then truncates toward zero:
+    #   volume * (3 + 1e-18) = -0.999999999999999999333.. -> pnl = -0.999999999999999999 + 1
+    #   notional 0.999999999999999999, margins 10% and 5% of it truncated
+    #   funding volume * (1 + 1e-18) = -0.333333333333333333333.. -> -0.333333333333333333
+    def test_update(self):
+        symbol_id = get_symbol_id("BTCUSD", risk.FUTURES)
+        engine = risk.RiskEngine(0, verify=False)
+        engine.set_symbol(
+            symbol_id, get_state(3 * ONE + 1, ONE + 1, ONE // 10, ONE // 20)
+        )
+        engine.set_position(1, symbol_id, -(ONE // 3), -ONE, 0)
+        self.assertEqual(
+            engine.get_position(1, symbol_id),
+            {
+                "volume": -333333333333333333,
+                "cost": -ONE,
+                "pnl": 1,
+                "funding": -333333333333333333,
+                "initialMarginRequired": 99999999999999999,
+                "maintenanceMarginRequired": 49999999999999999,
+            },
+        )
+
+        # volume * (3 - 1e-18) = -0.999999999999999998666.., funding is kept on a price tick
+        engine.update_price(symbol_id, 3 * ONE - 1)
+        engine.set_margin(1, ONE)
+        self.assertEqual(
+            engine.get_p_token(1),
+            {
+                "pnl": 2,
+                "funding": -333333333333333333,
+                "initialMarginRequired": 99999999999999999,
+                "maintenanceMarginRequired": 49999999999999999,
+                "dynamicMargin": ONE + 2 + 333333333333333333,
+                "marginRatio": (ONE + 2 + 333333333333333333) / 49999999999999999,
+            },
+        )
+
+        engine.update_funding(symbol_id, 2 * ONE)
+        self.assertEqual(engine.get_p_token(1)["funding"], -666666666666666666)
+
+        engine.remove_position(1, symbol_id)
+        self.assertEqual(
+            [
+                engine.get_p_token(1)[key]
+                for key in (
+                    "pnl",
+                    "funding",
+                    "initialMarginRequired",
+                    "maintenanceMarginRequired",
+                )
+            ],
+            [0, 0, 0, 0],
+        )
+        self.assertEqual(engine.symbols[symbol_id].positions, [])
+
+
+class TestEngine(unittest.TestCase):
+    # pTokens with random positions in three futures symbols and one option symbol, which is left out
+    def get_portfolio(self, rng):
+        symbol_ids = [
+            get_symbol_id(name, risk.FUTURES) for name in ("BTCUSD", "ETHUSD", "BNBUSD")
+        ]
+        symbol_ids.append(get_symbol_id("BTCUSD-20000-C", 2))
+        states = [
+            get_state(
+                rng.randint(1, 50000) * ONE + rng.randint(0, ONE),
+                rng.randint(-ONE, ONE),
+                ONE // rng.choice((10, 20, 50)),
+                ONE // rng.choice((100, 200)),
+            )
+            for _ in symbol_ids
+        ]
+        p_token_ids = list(range(1, 51))
+        offsets = [0]
+        symbols = []
+        positions = []
+        for _ in p_token_ids:
+            for row in sorted(
+                rng.sample(range(len(symbol_ids)), rng.randint(0, len(symbol_ids)))
+            ):
+                volume = rng.choice((-1, 1)) * rng.randint(1, 1000) * ONE // 1000
+                symbols.append(row)
+                positions.append(
+                    [
+                        volume,
+                        risk.mul(volume, rng.randint(1, 50000) * ONE),
+                        rng.randint(-ONE, ONE),
+                    ]
+                )
+            offsets.append(len(positions))
+        return portfolio.Portfolio(
+            1, p_token_ids, offsets, symbol_ids, states, symbols, positions
+        )
+
+    # price ticks applied one by one end at the totals of a load at the last prices
+    def test_ticks_match_full_load(self):
+        rng = random.Random(0)
+        snapshot = self.get_portfolio(rng)
+        engine = risk.RiskEngine(0, verify=False)
+        engine.load(snapshot)
+        symbol_ids = list(engine.symbols)
+        self.assertEqual(len(symbol_ids), 3)
+        for _ in range(1000):
+            symbol_id = rng.choice(symbol_ids)
+            price = engine.symbols[symbol_id].price
+            engine.update_price(
+                symbol_id, price + rng.randint(-100, 100) * price // 1000
+            )
+
+        for i, symbol_id in enumerate(snapshot.symbol_ids):
+            if symbol_id in engine.symbols:
+                state = list(snapshot.states[i])
+                state[risk.STATE_MARK_PRICE] = engine.symbols[symbol_id].price
+                snapshot.states[i] = state
+        expected = risk.RiskEngine(0, verify=False)
+        expected.load(snapshot)
+        for p_token_id in snapshot.p_token_ids:
+            self.assertEqual(
+                engine.get_p_token(p_token_id), expected.get_p_token(p_token_id)
+            )
+
+    # a reload replaces the positions of its pTokens, closed ones leave the totals
+    def test_reload(self):
+        snapshot = self.get_portfolio(random.Random(1))
+        engine = risk.RiskEngine(0, verify=False)
+        engine.load(snapshot)
+        empty = portfolio.Portfolio(
+            2,
+            snapshot.p_token_ids,
+            [0] * (len(snapshot.p_token_ids) + 1),
+            snapshot.symbol_ids,
+            snapshot.states,
+            [],
+            [],
+        )
+        engine.load(empty)
+        self.assertEqual(engine.block, 2)
+        for p_token_id in snapshot.p_token_ids:
+            self.assertEqual(engine.p_tokens[p_token_id].positions, {})
+            self.assertEqual(engine.get_p_token(p_token_id)["pnl"], 0)
+        self.assertTrue(all(not symbol.positions for symbol in engine.symbols.values()))
+
+
+@unittest.skipUnless(
+    P_TOKEN_IDS and LIQUIDITY, "RISK_TEST_P_TOKEN_IDS and RISK_TEST_LIQUIDITY not set"
+)
+class TestCrossCheck(unittest.TestCase):
+    def setUp(self):
+        self.p_token_ids = [int(item) for item in P_TOKEN_IDS.split(",")]
+        self.liquidity = int(float(LIQUIDITY) * risk.ONE)
+
+    def test_cross_check(self):
+        self.assertEqual(risk.cross_check(self.p_token_ids, self.liquidity), [])
+
+    def test_verified_at_load(self):
+        engine = risk.RiskEngine(self.liquidity)
+        engine.refresh(self.p_token_ids)
+        self.assertTrue(engine.verified)
+
+    def test_wrong_layout_refused(self):
+        engine = risk.RiskEngine(self.liquidity)
+        with mock.patch.object(
+            risk, "STATE_MARK_PRICE", risk.STATE_INITIAL_MARGIN_RATIO
+        ):
+            with self.assertRaises(ValueError):
+                engine.refresh(self.p_token_ids)
+        self.assertFalse(engine.verified)
+        self.assertEqual(engine.p_tokens, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,349 @@
+import time
+import itertools
+import threading
+from concurrent.futures import Future
+from web3 import Web3
+from demo import (
+    ONE,
+    BASE_TOKEN_ADDRESS,
+    GATEWAY_ADDRESS,
+    web3,
+    web3_dchain,
+    symbol_manager,
+    batch_call,
+    to_int,
+    get_symbol_id,
+    request_add_margin,
+    request_remove_margin,
+    request_trade,
+)
+from indexer import GATEWAY_EVENTS, decode_log
+
+# Tracking of Gateway requests until the dchain has executed them.
+# A request is matched by its requestId with the Finish event relayed back to the Gateway.
+# Trades have none: the dchain executes the requests of a pToken in requestId order, so the trades
+# of a position are resolved strictly first in first out, each time its getPosition fields change.
+# The blocks a position changed at are found by bisection, and the volume change at each one is
+# explained by the oldest pending trades, those skipped over were rejected. A trade is also rejected
+# when a later request of its pToken has been executed while its position did not change.
+# One thread polls the Gateway logs from a block cursor and every tracked position in one batch,
+# backing off while nothing changes, and resolves the Future of each request with its outcome,
+# asyncio code can await it with asyncio.wrap_future.
+
+# Seconds between polls, doubled up to MAX_POLL_INTERVAL while no request is resolved
+POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 8
+
+# Seconds after which a request not executed fails with TimeoutError
+TIMEOUT = 300
+
+# Pending trades of a position considered when explaining one change of its volume
+MATCH_LIMIT = 8
+
+# Finish event of the requests resolved by one
+FINISH_EVENTS = {
+    "RequestRemoveMargin": "FinishRemoveMargin",
+    "RequestTradeAndRemoveMargin": "FinishRemoveMargin",
+    "RequestLiquidate": "FinishLiquidate",
+}
+
+TOPICS = {name: topic for topic, (name, _, _) in GATEWAY_EVENTS.items()}
+
+
+# (block, getPosition fields as ints) of the position at the block, the dchain head by default
+def get_position(p_token_id, symbol_id, block=None):
+    if block is None:
+        block = web3_dchain.eth.block_number
+    position = batch_call(
+        [(symbol_manager, "getPosition", (symbol_id, p_token_id))], block
+    )[0]
+    return block, tuple(map(to_int, position))
+
+
+# (k, skipped) where the first k trades explain the volume change, with the trades at the indices
+# in skipped rejected and the others executed, the shortest prefix with the fewest rejections wins
+def explain(volumes, delta):
+    volumes = volumes[:MATCH_LIMIT]
+    for k in range(1, len(volumes) + 1):
+        total = sum(volumes[:k])
+        for count in range(k):
+            for skipped in itertools.combinations(range(k - 1), count):
+                if total - sum(volumes[i] for i in skipped) == delta:
+                    return k, set(skipped)
+    return None
+
+
+class Tracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.block = None
+        # requestId -> request waiting for its Finish event
+        self.finishes = {}
+        # (pTokenId, symbolId) -> {"block", "position": last seen, "queue": trades in request order}
+        self.trades = {}
+        # pTokenId -> highest requestId the dchain is known to have executed
+        self.executed = {}
+
+    def pending(self):
+        with self.lock:
+            return len(self.finishes) + sum(
+                len(entry["queue"]) for entry in self.trades.values()
+            )
+
+    # Future of the request in the receipt, pre_position is get_position before a trade,
+    # read now if not given, which misses trades the dchain has already executed
+    def track(self, receipt, pre_position=None):
+        events = [
+            decode_log(log)
+            for log in receipt["logs"]
+            if log["address"].lower() == GATEWAY_ADDRESS.lower()
+        ]
+        events = {event[0]: event[1] for event in events if event is not None}
+        future = Future()
+        for name, args in events.items():
+            request = {
+                "request": name,
+                "requestId": args["requestId"],
+                "pTokenId": args["pTokenId"],
+                "transactionHash": Web3.to_hex(receipt["transactionHash"]),
+                "start": time.time(),
+                "future": future,
+            }
+            if name in FINISH_EVENTS:
+                with self.lock:
+                    self.finishes[args["requestId"]] = request
+                    if self.block is None or receipt["blockNumber"] <= self.block:
+                        self.block = receipt["blockNumber"] - 1
+                break
+            if name == "RequestTrade":
+                key = (args["pTokenId"], args["symbolId"])
+                request["tradeVolume"] = args["tradeParams"][0]
+                with self.lock:
+                    queued = bool(self.trades.get(key, {}).get("queue"))
+                if not queued and pre_position is None:
+                    pre_position = get_position(*key)
+                with self.lock:
+                    entry = self.trades.get(key)
+                    if entry is None or not entry["queue"]:
+                        block, position = pre_position
+                        entry = self.trades[key] = {
+                            "block": block,
+                            "position": position,
+                            "queue": [],
+                        }
+                    entry["queue"].append(request)
+                break
+        else:
+            if "FinishAddMargin" not in events:
+                raise ValueError("No Gateway request in the receipt")
+            args = events["FinishAddMargin"]
+            future.set_result(
+                {
+                    "request": "FinishAddMargin",
+                    "requestId": args["requestId"],
+                    "pTokenId": args["pTokenId"],
+                    "event": "FinishAddMargin",
+                    "args": args,
+                    "seconds": 0,
+                }
+            )
+            return future
+        self.start()
+        self.wake.set()
+        return future
+
+    # requests sent and tracked, each returns the Future of its outcome
+
+    def request_add_margin(self, p_token_id, b_token_address, amount):
+        return self.track(request_add_margin(p_token_id, b_token_address, amount))
+
+    def request_remove_margin(self, p_token_id, b_token_address, amount):
+        return self.track(request_remove_margin(p_token_id, b_token_address, amount))
+
+    def request_trade(self, p_token_id, symbol_id, trade_volume, price_limit):
+        pre_position = get_position(p_token_id, symbol_id)
+        receipt = request_trade(p_token_id, symbol_id, trade_volume, price_limit)
+        return self.track(receipt, pre_position)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        interval = POLL_INTERVAL
+        while True:
+            if not self.pending():
+                self.wake.wait()
+                interval = POLL_INTERVAL
+            self.wake.clear()
+            try:
+                resolved = self._poll_finishes() + self._poll_trades()
+            except Exception:
+                # rpc errors are retried on the next poll
+                resolved = 0
+            self._expire()
+            interval = (
+                POLL_INTERVAL if resolved else min(interval * 2, MAX_POLL_INTERVAL)
+            )
+            if self.wake.wait(interval):
+                interval = POLL_INTERVAL
+
+    def _poll_finishes(self):
+        with self.lock:
+            if not self.finishes:
+                return 0
+            from_block = self.block + 1
+        to_block = web3.eth.block_number
+        if to_block < from_block:
+            return 0
+        logs = web3.eth.get_logs(
+            {
+                "address": Web3.to_checksum_address(GATEWAY_ADDRESS),
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "topics": [[TOPICS[name] for name in set(FINISH_EVENTS.values())]],
+            }
+        )
+        resolved = []
+        with self.lock:
+            for log in logs:
+                name, args = decode_log(log)
+                self._executed(args["pTokenId"], args["requestId"])
+                request = self.finishes.pop(args["requestId"], None)
+                if request is not None:
+                    resolved.append((request, name, args, log["blockNumber"]))
+            self.block = to_block
+        for request, name, args, block in resolved:
+            self._resolve(request, event=name, args=args, block=block)
+        return len(resolved)
+
+    def _executed(self, p_token_id, request_id):
+        self.executed[p_token_id] = max(self.executed.get(p_token_id, 0), request_id)
+
+    def _poll_trades(self):
+        with self.lock:
+            keys = [key for key, entry in self.trades.items() if entry["queue"]]
+        if not keys:
+            return 0
+        block = web3_dchain.eth.block_number
+        positions = batch_call(
+            [
+                (symbol_manager, "getPosition", (symbol_id, p_token_id))
+                for p_token_id, symbol_id in keys
+            ],
+            block,
+        )
+        executed, rejected = [], []
+        for key, position in zip(keys, positions):
+            position = tuple(map(to_int, position))
+            with self.lock:
+                entry = self.trades.get(key)
+                if entry is None or entry["position"] == position:
+                    continue
+                start, start_position = entry["block"], entry["position"]
+            changes = self._changes(key, start, start_position, block, position)
+            with self.lock:
+                entry = self.trades.get(key)
+                if entry is None or entry["block"] != start:
+                    continue
+                previous = start_position
+                for change_block, change_position in changes:
+                    volumes = [request["tradeVolume"] for request in entry["queue"]]
+                    match = explain(volumes, change_position[0] - previous[0])
+                    if match is not None:
+                        k, skipped = match
+                        volume = previous[0]
+                        for i, request in enumerate(entry["queue"][:k]):
+                            if i in skipped:
+                                rejected.append(request)
+                                continue
+                            volume += request["tradeVolume"]
+                            executed.append((request, volume, change_block))
+                            self._executed(key[0], request["requestId"])
+                        del entry["queue"][:k]
+                    previous = change_position
+                entry["block"], entry["position"] = block, position
+        # trades with a later request of their pToken executed were rejected
+        with self.lock:
+            for (p_token_id, _), entry in self.trades.items():
+                queue = entry["queue"]
+                while queue and queue[0]["requestId"] < self.executed.get(
+                    p_token_id, 0
+                ):
+                    rejected.append(queue.pop(0))
+            for key in [
+                key for key, entry in self.trades.items() if not entry["queue"]
+            ]:
+                self.trades.pop(key)
+        for request, volume, change_block in executed:
+            self._resolve(request, event="Trade", volume=volume, block=change_block)
+        for request in rejected:
+            request["future"].set_exception(
+                ValueError(
+                    f"RequestTrade {request['requestId']} rejected by the dchain"
+                )
+            )
+        return len(executed) + len(rejected)
+
+    # (block, position) at each block in (start, end] where the position changed, by bisection
+    def _changes(self, key, start, start_position, end, end_position):
+        if end_position == start_position:
+            return []
+        if end - start <= 1:
+            return [(end, end_position)]
+        middle = (start + end) // 2
+        _, middle_position = get_position(*key, middle)
+        return self._changes(
+            key, start, start_position, middle, middle_position
+        ) + self._changes(key, middle, middle_position, end, end_position)
+
+    def _expire(self):
+        now = time.time()
+        expired = []
+        with self.lock:
+            for request_id, request in list(self.finishes.items()):
+                if now - request["start"] > TIMEOUT:
+                    expired.append(self.finishes.pop(request_id))
+            for key, entry in list(self.trades.items()):
+                queue = entry["queue"]
+                expired += [
+                    request for request in queue if now - request["start"] > TIMEOUT
+                ]
+                queue[:] = [
+                    request for request in queue if now - request["start"] <= TIMEOUT
+                ]
+                if not queue:
+                    self.trades.pop(key)
+        for request in expired:
+            request["future"].set_exception(
+                TimeoutError(
+                    f"{request['request']} {request['requestId']} not executed in {TIMEOUT}s"
+                )
+            )
+
+    def _resolve(self, request, **outcome):
+        result = {
+            key: value
+            for key, value in request.items()
+            if key not in ("start", "future", "tradeVolume")
+        }
+        result.update(outcome)
+        result["seconds"] = time.time() - request["start"]
+        request["future"].set_result(result)
+
+
+if __name__ == "__main__":
+    # trade BTCUSD with a new position, as demo.py does, waiting on the tracker instead of polling
+    tracker = Tracker()
+    p_token_id = tracker.request_add_margin(0, BASE_TOKEN_ADDRESS, 0.001).result()[
+        "pTokenId"
+    ]
+    symbol_id = get_symbol_id("BTCUSD", 1)
+    future = tracker.request_trade(p_token_id, symbol_id, 0.0001, 110000)
+    outcome = future.result()
+    print(f"Traded: {outcome['volume'] / ONE} BTCUSD in {outcome['seconds']:.1f}s")